@@ -2,14 +2,37 @@
 agent_hub.py — Clean Version (No "no document used" messages)
 """
 
-from typing import Callable, Dict, Iterable, List, Tuple, Optional
+from typing import AsyncIterator, Callable, Dict, Iterable, List, Tuple, Optional
+from concurrent.futures import ThreadPoolExecutor
 import ast
+import asyncio
+import contextvars
+import functools
+import os
 import re
+import time
 import logging
 
+from . import telemetry
+from .conversation import format_history, memory as conversation_memory
+from .router import ROUTER_MODE, router
+
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
+# Bounded pool for blocking work (embedding, Chroma, SQLite, web search) so the
+# event loop never waits on it directly.
+AGENT_MAX_WORKERS = int(os.getenv("AGENT_MAX_WORKERS", "8"))
+_executor = ThreadPoolExecutor(max_workers=AGENT_MAX_WORKERS, thread_name_prefix="agent")
+
+
+async def run_blocking(fn: Callable, *args, **kwargs):
+    """Run a blocking callable on the shared agent executor (with the caller's
+    contextvars, so request ids and traces follow the work)."""
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(_executor, ctx.run, functools.partial(fn, *args, **kwargs))
+
 # ---------------------------------------------------------
 # Safe math evaluator
 # ---------------------------------------------------------
@@ -40,11 +63,12 @@ def safe_math_eval(expr: str):
 # ---------------------------------------------------------
 # RAG + Memory tool wrappers
 # ---------------------------------------------------------
-def rag_query_fn(rag_index, query: str, top_k: int = 3):
+@telemetry.traced("rag_query")
+def rag_query_fn(rag_index, query: str, top_k: int = 3, scope: Optional[dict] = None):
     if rag_index is None:
         return []
     try:
-        res = rag_index.query(query, top_k=top_k) or []
+        res = rag_index.query(query, top_k=top_k, scope=scope) or []
         cleaned = []
         for item in res:
             if isinstance(item, (tuple, list)) and len(item) == 2:
@@ -56,16 +80,138 @@ def rag_query_fn(rag_index, query: str, top_k: int = 3):
         return []
 
 
+@telemetry.traced("memory_lookup")
 def memory_lookup_fn(get_profile, get_facts, query: str):
+    """`get_facts(query)` returns the facts relevant to the message (see
+    memory_graph.search_facts), so the prompt never carries all of them."""
     mem = {}
     try:
         mem["name"] = get_profile("name") if get_profile else None
-        mem["facts"] = get_facts() if get_facts else []
+        mem["facts"] = get_facts(query) if get_facts else []
     except Exception:
         pass
     return mem
 
 
+# ---------------------------------------------------------
+# Context packing
+# ---------------------------------------------------------
+# Prompt budget for retrieved passages, per GROQ_MODEL. CONTEXT_TOKEN_BUDGET
+# overrides it; tokens are estimated at ~4 characters each.
+MODEL_CONTEXT_BUDGETS = {
+    "llama-3.1-8b-instant": 1500,
+    "llama-3.3-70b-versatile": 3000,
+    "llama3-70b-8192": 2500,
+    "llama3-8b-8192": 1500,
+    "mixtral-8x7b-32768": 3000,
+}
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET") or MODEL_CONTEXT_BUDGETS.get(os.getenv("GROQ_MODEL", "llama-3.1-8b-instant"), 1500))
+FACT_TOKEN_BUDGET = int(os.getenv("FACT_TOKEN_BUDGET", "200"))
+# Retrieve this many candidates per requested passage so MMR has room to pick
+RAG_CANDIDATE_FACTOR = int(os.getenv("RAG_CANDIDATE_FACTOR", "2"))
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+NEAR_DUP_THRESHOLD = 0.8
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def _shingles(text: str) -> set:
+    words = _WORD_RE.findall(text.lower())
+    return set(zip(words, words[1:])) or set(words)
+
+
+def _jaccard(a: set, b: set) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def _merge_overlap(a: str, b: str, min_overlap: int = 40, window: int = 400) -> Optional[str]:
+    """Join two chunks if one contains the other or b continues a (the
+    splitter's chunk_overlap repeats the tail of a chunk at the head of the next)."""
+    if b in a:
+        return a
+    if a in b:
+        return b
+    probe = b[:min_overlap]
+    if len(probe) < min_overlap:
+        return None
+    idx = a.find(probe, max(0, len(a) - window))
+    if idx != -1 and b.startswith(a[idx:]):
+        return a + b[len(a) - idx:]
+    return None
+
+
+def pack_context(rag_results, top_k: int = 3, budget: int = CONTEXT_TOKEN_BUDGET, lam: float = MMR_LAMBDA) -> List[str]:
+    """
+    Turn ranked (text, score) hits into at most `top_k` passages that fit in
+    `budget` tokens: overlapping neighbours are stitched together, near
+    duplicates dropped, and passages picked by MMR (rank-based relevance vs.
+    word-bigram similarity to what is already selected).
+    """
+    # 1. stitch overlapping / contained chunks; a merged passage keeps its best rank
+    passages: List[List] = []  # [text, rank]
+    for rank, (txt, _score) in enumerate(rag_results):
+        txt = (txt or "").strip()
+        if not txt:
+            continue
+        for p in passages:
+            merged = _merge_overlap(p[0], txt) or _merge_overlap(txt, p[0])
+            if merged is not None:
+                p[0] = merged
+                break
+        else:
+            passages.append([txt, rank])
+
+    # 2. drop near duplicates
+    kept = []
+    for txt, rank in passages:
+        sh = _shingles(txt)
+        if any(_jaccard(sh, k[2]) >= NEAR_DUP_THRESHOLD for k in kept):
+            continue
+        kept.append((txt, rank, sh))
+    if not kept:
+        return []
+
+    # 3. MMR selection under the token budget
+    n = max(r for _, r, _ in kept) + 1
+    candidates = list(kept)
+    selected, used = [], 0
+    while candidates and len(selected) < top_k:
+        def mmr(c):
+            rel = 1.0 - c[1] / n
+            div = max((_jaccard(c[2], s[2]) for s in selected), default=0.0)
+            return lam * rel - (1 - lam) * div
+        best = max(candidates, key=mmr)
+        candidates.remove(best)
+        cost = estimate_tokens(best[0])
+        if used + cost > budget:
+            if selected:
+                continue
+            # Nothing fits yet: keep a truncated copy of the best passage
+            best = (best[0][: budget * 4], best[1], best[2])
+            cost = budget
+        selected.append(best)
+        used += cost
+    return [txt for txt, _, _ in selected]
+
+
+def _pack_facts(facts, budget: int = FACT_TOKEN_BUDGET) -> str:
+    parts, used = [], 0
+    for item in facts:
+        part = f"{item[1]}: {item[2]}"
+        cost = estimate_tokens(part)
+        if used + cost > budget:
+            break
+        parts.append(part)
+        used += cost
+    return "; ".join(parts)
+
+
 # ---------------------------------------------------------
 # Planner for tool usage
 # ---------------------------------------------------------
@@ -86,19 +232,24 @@ def _decide_tools(user_text: str, docs_exist: bool):
 # ---------------------------------------------------------
 # Prompt Creation (CLEANED)
 # ---------------------------------------------------------
-def _compose_prompt(user_text: str, mem: dict, rag_excerpt: str, search_results: str, math_answer: Optional[object], tools: dict):
+def _compose_prompt(user_text: str, mem: dict, rag_excerpt: str, search_results: str, math_answer: Optional[object], tools: dict,
+                    history: str = ""):
     lines = [
         "You are Nova, a helpful and factual AI assistant.",
         "",
     ]
 
+    # Rolling summary + last few turns; bounded, see conversation.py
+    if history:
+        lines.append(history + "\n")
+
     # Basic memory usage (no unnecessary sentences)
     if mem.get("name"):
         lines.append(f"User name: {mem['name']}.")
-        if mem.get("facts"):
-            # facts is list of (category, label, value)
-            fact_str = "; ".join([f"{item[1]}: {item[2]}" for item in mem["facts"]])
-            lines.append(f"Memory facts: {fact_str}")
+    if mem.get("facts"):
+        # facts is list of (category, label, value), most relevant first
+        fact_str = _pack_facts(mem["facts"])
+        lines.append(f"Memory facts: {fact_str}")
 
     # Include RAG context ONLY if available
     if rag_excerpt:
@@ -117,6 +268,71 @@ def _compose_prompt(user_text: str, mem: dict, rag_excerpt: str, search_results:
     return "\n".join(lines)
 
 
+# ---------------------------------------------------------
+# Shared helpers for the sync and async runners
+# ---------------------------------------------------------
+def _format_rag_excerpt(rag_results, top_k: int = 3) -> str:
+    if not rag_results:
+        return ""
+    passages = pack_context(rag_results, top_k=top_k)
+    return "\n\n".join([f"[Passage {i + 1}] {txt}" for i, txt in enumerate(passages)])
+
+
+@telemetry.traced("web_search")
+def _search_fn(user_text: str) -> str:
+    # Import locally to avoid circular deps if any
+    from .search_tool import web_search
+    res = web_search(user_text, limit=3)
+    if not res:
+        return ""
+    return "\n".join([f"- {r.get('title')}: {r.get('body')}" for r in res])
+
+
+def _math_fn(user_text: str):
+    expr = user_text.lower().replace("calculate", "").replace("what is", "").strip()
+    try:
+        return safe_math_eval(expr)
+    except:
+        return None
+
+
+def _docs_exist(rag_index, scope: Optional[dict] = None) -> bool:
+    try:
+        return rag_index.count(scope) > 0
+    except:
+        return False
+
+
+def _history_fn(thread_id: Optional[str]) -> str:
+    if not thread_id:
+        return ""
+    with telemetry.span("history"):
+        return format_history(*conversation_memory.context(thread_id))
+
+
+def _chunk_text(chunk) -> str:
+    return chunk.content if hasattr(chunk, "content") else str(chunk)
+
+
+def _plan(user_text: str, rag_index, scope: Optional[dict] = None) -> dict:
+    """Pick tools for a turn with the embedding router (see router.py),
+    or with the keyword rules when AGENT_ROUTER=keyword or the index has
+    no encoder to route with."""
+    with telemetry.span("decide_tools"):
+        tools = None
+        if ROUTER_MODE == "embedding" and getattr(rag_index, "model", None) is not None:
+            try:
+                tools = router.route(user_text, rag_index, scope, math_ok=_math_fn(user_text) is not None)
+            except Exception:
+                logger.exception("Embedding router failed; falling back to keyword rules")
+        if tools is None:
+            tools = _decide_tools(user_text, _docs_exist(rag_index, scope))
+    for name, used in tools.items():
+        if used:
+            telemetry.TOOL_USAGE.inc(name[len("use_"):])
+    return tools
+
+
 # ---------------------------------------------------------
 # Main Agent Runner
 # ---------------------------------------------------------
@@ -127,44 +343,33 @@ def run_agent(
     get_profile_fn,
     get_facts_fn,
     top_k: int = 3,
+    scope: Optional[dict] = None,
+    thread_id: Optional[str] = None,
 ) -> Iterable[str]:
+    """`scope` ({"owner": ..., "doc_id": ...}) limits retrieval to the
+    caller's documents; None searches the whole index. With `thread_id` the
+    prompt carries the thread's summary and recent turns."""
 
-    # Determine if docs exist
-    try:
-        docs_exist = rag_index.count() > 0
-    except:
-        docs_exist = False
-
-    tools = _decide_tools(user_text, docs_exist)
+    tools = _plan(user_text, rag_index, scope)
+    history = _history_fn(thread_id)
 
     # Memory
     mem = memory_lookup_fn(get_profile_fn, get_facts_fn, user_text) if tools["use_memory"] else {}
 
     # RAG
-    rag_results, rag_excerpt = [], ""
-    # Increased top_k for better context handling
+    rag_excerpt = ""
+    # Over-fetch candidates; the packer trims them to top_k passages within budget
     if tools["use_rag"]:
-        rag_results = rag_query_fn(rag_index, user_text, top_k=5)
-        if rag_results:
-             rag_excerpt = "\n\n".join([f"[Source: {txt[:20]}...] {txt}" for txt, score in rag_results])
+        rag_results = rag_query_fn(rag_index, user_text, top_k=top_k * RAG_CANDIDATE_FACTOR, scope=scope)
+        rag_excerpt = _format_rag_excerpt(rag_results, top_k=top_k)
 
     # Search
     search_results = ""
-    # Import locally to avoid circular deps if any
-    from .search_tool import web_search
-    if tools["use_search"] and not rag_excerpt: 
-         res = web_search(user_text, limit=3)
-         if res:
-             search_results = "\n".join([f"- {r.get('title')}: {r.get('body')}" for r in res])
+    if tools["use_search"] and not rag_excerpt:
+        search_results = _search_fn(user_text)
 
     # Math
-    math_answer = None
-    if tools["use_math"]:
-        expr = user_text.lower().replace("calculate", "").replace("what is", "").strip()
-        try:
-            math_answer = safe_math_eval(expr)
-        except:
-            math_answer = None
+    math_answer = _math_fn(user_text) if tools["use_math"] else None
 
     # Compose prompt
     prompt = _compose_prompt(
@@ -173,15 +378,261 @@ def run_agent(
         rag_excerpt=rag_excerpt,
         search_results=search_results,
         math_answer=math_answer,
-        tools=tools
+        tools=tools,
+        history=history
     )
 
     # Stream output
+    t0 = time.perf_counter()
+    first = True
     try:
         for chunk in llm.stream(prompt):
-            if hasattr(chunk, "content"):
-                yield chunk.content
-            else:
-                yield str(chunk)
+            if first:
+                telemetry.record("llm_ttft", time.perf_counter() - t0)
+                first = False
+            yield _chunk_text(chunk)
     except Exception as e:
         yield f"[Error: {e}]"
+    finally:
+        telemetry.record("llm_stream", time.perf_counter() - t0)
+
+
+# ---------------------------------------------------------
+# Async Agent Runner
+# ---------------------------------------------------------
+async def _astream_llm(llm, prompt: str) -> AsyncIterator[str]:
+    """Stream tokens from the LLM's async API, falling back to pulling the
+    sync iterator one chunk at a time on the executor."""
+    if hasattr(llm, "astream"):
+        async for chunk in llm.astream(prompt):
+            yield _chunk_text(chunk)
+        return
+
+    sentinel = object()
+    it = await run_blocking(lambda: iter(llm.stream(prompt)))
+    try:
+        while True:
+            chunk = await run_blocking(next, it, sentinel)
+            if chunk is sentinel:
+                break
+            yield _chunk_text(chunk)
+    finally:
+        # Closing the sync stream releases its HTTP response when the
+        # consumer stops early (e.g. the client disconnected)
+        close = getattr(it, "close", None)
+        if close is not None:
+            try:
+                close()
+            except Exception:
+                pass
+
+
+async def arun_agent(
+    user_text: str,
+    llm,
+    rag_index,
+    get_profile_fn,
+    get_facts_fn,
+    top_k: int = 3,
+    scope: Optional[dict] = None,
+    on_stage: Optional[Callable[[str, dict], None]] = None,
+    thread_id: Optional[str] = None,
+) -> AsyncIterator[str]:
+    """
+    Async counterpart of run_agent. Memory lookup, RAG retrieval and web search
+    run concurrently on the bounded executor; tokens come from llm.astream.
+    `on_stage(stage, info)`, if given, is called as the turn moves through
+    planning, retrieval/search and generation (used for SSE progress events).
+    """
+    def stage(name: str, **info):
+        if on_stage is not None:
+            on_stage(name, info)
+
+    stage("planning")
+    tools = await run_blocking(_plan, user_text, rag_index, scope)
+    for name, key in (("recalling", "use_memory"), ("retrieving", "use_rag"), ("searching", "use_search")):
+        if tools[key]:
+            stage(name)
+
+    async def _none(default):
+        return default
+
+    # Fan out independent tools. Search is started alongside RAG instead of
+    # waiting on it; its result is dropped if RAG produced context, same as
+    # the sync runner.
+    mem_task = run_blocking(memory_lookup_fn, get_profile_fn, get_facts_fn, user_text) if tools["use_memory"] else _none({})
+    rag_task = run_blocking(rag_query_fn, rag_index, user_text, top_k * RAG_CANDIDATE_FACTOR, scope) if tools["use_rag"] else _none([])
+    search_task = run_blocking(_search_fn, user_text) if tools["use_search"] else _none("")
+    history_task = run_blocking(_history_fn, thread_id) if thread_id else _none("")
+
+    results = await asyncio.gather(mem_task, rag_task, search_task, history_task, return_exceptions=True)
+    mem, rag_results, search_results, history = [
+        default if isinstance(r, BaseException) else r
+        for r, default in zip(results, ({}, [], "", ""))
+    ]
+
+    rag_excerpt = _format_rag_excerpt(rag_results, top_k=top_k)
+    if rag_excerpt:
+        search_results = ""
+
+    # Math is cheap AST evaluation, keep it inline
+    math_answer = _math_fn(user_text) if tools["use_math"] else None
+
+    prompt = _compose_prompt(
+        user_text=user_text,
+        mem=mem,
+        rag_excerpt=rag_excerpt,
+        search_results=search_results,
+        math_answer=math_answer,
+        tools=tools,
+        history=history
+    )
+    stage("generating", prompt_tokens=estimate_tokens(prompt))
+
+    t0 = time.perf_counter()
+    first = True
+    stream = _astream_llm(llm, prompt)
+    try:
+        async for token in stream:
+            if first:
+                telemetry.record("llm_ttft", time.perf_counter() - t0)
+                first = False
+            yield token
+    except Exception as e:
+        yield f"[Error: {e}]"
+    finally:
+        # Close the upstream stream right away if we are stopped early
+        await stream.aclose()
+        telemetry.record("llm_stream", time.perf_counter() - t0)
+
+
+# ---------------------------------------------------------
+# Batch Runner
+# ---------------------------------------------------------
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "8"))
+
+
+def _prepare_batch(questions: List[str], rag_index, get_profile_fn, get_facts_fn, top_k: int,
+                   scope: Optional[dict]) -> List[dict]:
+    """Blocking half of a batch: retrieve for every question at once, then
+    plan each one (the router reuses the cached embeddings and top-1 hits)."""
+    with telemetry.span("batch_retrieve"):
+        try:
+            if hasattr(rag_index, "query_batch"):
+                retrieved = rag_index.query_batch(questions, top_k=top_k * RAG_CANDIDATE_FACTOR, scope=scope)
+            else:
+                retrieved = [rag_query_fn(rag_index, q, top_k * RAG_CANDIDATE_FACTOR, scope) for q in questions]
+        except Exception as e:
+            logger.warning(f"Batched retrieval failed: {e}")
+            retrieved = [[] for _ in questions]
+
+    jobs = []
+    for question, rag_results in zip(questions, retrieved):
+        tools = _plan(question, rag_index, scope)
+        jobs.append({
+            "tools": tools,
+            "mem": memory_lookup_fn(get_profile_fn, get_facts_fn, question) if tools["use_memory"] else {},
+            "rag_excerpt": _format_rag_excerpt(rag_results, top_k=top_k) if tools["use_rag"] else "",
+            "math_answer": _math_fn(question) if tools["use_math"] else None,
+        })
+    return jobs
+
+
+async def arun_batch(
+    questions: List[str],
+    llm,
+    rag_index,
+    get_profile_fn,
+    get_facts_fn,
+    top_k: int = 3,
+    scope: Optional[dict] = None,
+    concurrency: int = BATCH_LLM_CONCURRENCY,
+    cancelled: Optional[asyncio.Future] = None,
+) -> AsyncIterator[dict]:
+    """
+    Answer independent questions (no thread history) in one call.
+
+    All questions are embedded in one encode call and retrieved with one
+    multi-query collection call. Then each is planned and prompted like
+    arun_agent, with at most `concurrency` LLM generations in flight. Yields
+    one result dict per question as soon as it finishes:
+
+        {"index", "question", "answer", "tools", "ttft_ms", "llm_ms", "elapsed_ms"}
+
+    `elapsed_ms` is measured from the start of the batch. Generations still
+    running are cancelled when `cancelled` (e.g. a client-disconnect future)
+    completes or the consumer stops early.
+    """
+    if not questions:
+        return
+    t_batch = time.perf_counter()
+    jobs = await run_blocking(_prepare_batch, questions, rag_index, get_profile_fn, get_facts_fn, top_k, scope)
+    slots = asyncio.Semaphore(max(1, concurrency))
+
+    async def answer(i: int, question: str, job: dict) -> dict:
+        tools = job["tools"]
+        search_results = ""
+        if tools["use_search"] and not job["rag_excerpt"]:
+            search_results = await run_blocking(_search_fn, question)
+        prompt = _compose_prompt(
+            user_text=question,
+            mem=job["mem"],
+            rag_excerpt=job["rag_excerpt"],
+            search_results=search_results,
+            math_answer=job["math_answer"],
+            tools=tools,
+        )
+        async with slots:
+            t0 = time.perf_counter()
+            ttft, llm_s, parts = None, 0.0, []
+            stream = _astream_llm(llm, prompt)
+            try:
+                async for token in stream:
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                        telemetry.record("llm_ttft", ttft)
+                    parts.append(token)
+            except Exception as e:
+                parts.append(f"[Error: {e}]")
+            finally:
+                await stream.aclose()
+                llm_s = time.perf_counter() - t0
+                telemetry.record("llm_stream", llm_s)
+        return {
+            "index": i,
+            "question": question,
+            "answer": "".join(parts),
+            "tools": [k[len("use_"):] for k, v in tools.items() if v],
+            "ttft_ms": round((ttft or 0.0) * 1000, 1),
+            "llm_ms": round(llm_s * 1000, 1),
+            "elapsed_ms": round((time.perf_counter() - t_batch) * 1000, 1),
+        }
+
+    tasks = [asyncio.ensure_future(answer(i, q, job)) for i, (q, job) in enumerate(zip(questions, jobs))]
+
+    def cancel_all(_=None):
+        for task in tasks:
+            task.cancel()
+
+    if cancelled is not None:
+        # The tasks run on their own, so an abandoned consumer alone would
+        # not stop them
+        cancelled.add_done_callback(cancel_all)
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        # Stopped early: cancel what is still generating
+        cancel_all()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def run_batch(questions: List[str], llm, rag_index, get_profile_fn, get_facts_fn, top_k: int = 3,
+              scope: Optional[dict] = None, concurrency: int = BATCH_LLM_CONCURRENCY) -> List[dict]:
+    """Blocking wrapper around arun_batch for scripts and evaluation jobs.
+    Returns the results in question order."""
+    async def collect():
+        return [r async for r in arun_batch(questions, llm, rag_index, get_profile_fn, get_facts_fn,
+                                            top_k=top_k, scope=scope, concurrency=concurrency)]
+
+    return sorted(asyncio.run(collect()), key=lambda r: r["index"])
@@ -0,0 +1,340 @@
+# answer_cache.py — single-flight coalescing and a semantic answer cache for /api/chat
+"""
+During bursts, many users ask the same question within seconds. Without
+this module each of them would pay for its own retrieval, web search and
+LLM generation. `answer` sits in front of arun_agent with two layers:
+
+  * Single-flight. A request identical to one still generating (same
+    normalized text, scope, index version and memory state) attaches to
+    that request's stream. One upstream turn feeds every listener: tokens
+    and stage events are buffered, so a late joiner replays from the start
+    and then follows live. The upstream is cancelled only when its last
+    listener disconnects.
+  * Semantic cache. A finished answer is stored with the question's
+    embedding (the query vector that retrieval already computed and
+    cached). A later question is served from the cache when all of these
+    hold:
+      - its embedding is at least ANSWER_CACHE_MIN_SIM similar;
+      - it has the same scope, index version and memory version;
+      - it mentions the same numbers.
+    The answer is replayed as a stream. Entries expire after
+    ANSWER_CACHE_TTL_S, and at most ANSWER_CACHE_SIZE are kept (LRU).
+
+Personalized turns bypass both layers:
+  * threads with earlier turns, since their prompt carries the
+    conversation;
+  * arithmetic;
+  * requests sent with "cache": false.
+"""
+import asyncio
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from . import memory_graph, telemetry
+from .conversation import memory as conversation_memory
+from .rag_utils import normalize_query
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE = os.getenv("ANSWER_CACHE", "1") == "1"
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "512"))
+ANSWER_CACHE_TTL_S = float(os.getenv("ANSWER_CACHE_TTL_S", "600"))
+ANSWER_CACHE_MIN_SIM = float(os.getenv("ANSWER_CACHE_MIN_SIM", "0.95"))
+SINGLE_FLIGHT = os.getenv("SINGLE_FLIGHT", "1") == "1"
+
+ANSWERS = telemetry.register(telemetry.Counter("nova_answers_total", "Chat answers by source", ("source",)))
+
+_NUM_RE = re.compile(r"\d+(?:[.,]\d+)*")
+_REPLAY_RE = re.compile(r"\s*\S+\s*")
+
+
+# ---------------------------------------------------------
+# Semantic cache
+# ---------------------------------------------------------
+class _Entry:
+    __slots__ = ("vector", "context", "numbers", "answer", "expires")
+
+    def __init__(self, vector, context, numbers, answer, expires):
+        self.vector = vector
+        self.context = context
+        self.numbers = numbers
+        self.answer = answer
+        self.expires = expires
+
+
+class AnswerCache:
+    def __init__(self, size: int = ANSWER_CACHE_SIZE, ttl_s: float = ANSWER_CACHE_TTL_S,
+                 min_sim: float = ANSWER_CACHE_MIN_SIM):
+        self.size = size
+        self.ttl_s = ttl_s
+        self.min_sim = min_sim
+        self._entries: "OrderedDict[Tuple, _Entry]" = OrderedDict()  # (context, question) -> entry
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _unit(vector) -> np.ndarray:
+        v = np.asarray(vector, dtype=np.float32).ravel()
+        n = float(np.linalg.norm(v))
+        return v / n if n else v
+
+    def get(self, vector, context: Tuple, question: str) -> Optional[Tuple[str, float]]:
+        """(answer, similarity) of the closest live entry, or None."""
+        v = self._unit(vector)
+        numbers = tuple(_NUM_RE.findall(question))
+        now = time.monotonic()
+        with self._lock:
+            keys, vectors = [], []
+            for key, e in list(self._entries.items()):
+                if e.expires <= now:
+                    del self._entries[key]
+                elif e.context == context and e.numbers == numbers and e.vector.shape == v.shape:
+                    keys.append(key)
+                    vectors.append(e.vector)
+            if vectors:
+                sims = np.stack(vectors) @ v
+                best = int(np.argmax(sims))
+                if sims[best] >= self.min_sim:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    return self._entries[keys[best]].answer, float(sims[best])
+            self.misses += 1
+        return None
+
+    def put(self, vector, context: Tuple, question: str, answer: str):
+        entry = _Entry(self._unit(vector), context, tuple(_NUM_RE.findall(question)), answer,
+                       time.monotonic() + self.ttl_s)
+        with self._lock:
+            key = (context, normalize_query(question))
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"entries": len(self._entries), "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+
+# ---------------------------------------------------------
+# Single-flight
+# ---------------------------------------------------------
+class _Flight:
+    """One upstream turn and the buffered items (token strings and
+    (stage, info) tuples) its listeners replay."""
+
+    def __init__(self, key):
+        self.key = key
+        self.items: List = []
+        self.done = False
+        self.listeners = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def push(self, item):
+        self.items.append(item)
+        self._notify()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[Tuple, _Flight] = {}
+        self.coalesced = 0
+
+    def inflight(self, key) -> Optional[_Flight]:
+        return self._flights.get(key)
+
+    def start(self, key, make_stream: Callable[[Callable], AsyncIterator[str]],
+              on_done: Optional[Callable[[str], None]] = None) -> _Flight:
+        """Run `make_stream(on_stage)` once in its own task and buffer its
+        output for listeners."""
+        flight = self._flights[key] = _Flight(key)
+        flight.task = asyncio.ensure_future(self._pump(flight, make_stream, on_done))
+        return flight
+
+    async def _pump(self, flight: _Flight, make_stream, on_done):
+        stream = make_stream(lambda name, info: flight.push((name, info)))
+        ok = False
+        try:
+            async for token in stream:
+                if token:
+                    flight.push(token)
+            ok = True
+        except asyncio.CancelledError:
+            pass  # every listener left
+        except Exception as e:
+            logger.error(f"Shared generation failed: {e}")
+            flight.push(f"[Error: {e}]")
+        finally:
+            await stream.aclose()
+            flight.done = True
+            flight._notify()
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+        if ok and on_done is not None:
+            answer = "".join(i for i in flight.items if isinstance(i, str))
+            # arun_agent reports LLM failures in-band; never reuse those
+            if answer.strip() and "[Error: " not in answer:
+                on_done(answer)
+
+    async def listen(self, flight: _Flight, on_stage: Optional[Callable] = None,
+                     disconnected: Optional[asyncio.Future] = None) -> AsyncIterator[str]:
+        flight.listeners += 1
+        left = False
+
+        def leave(_=None):
+            nonlocal left
+            if left:
+                return
+            left = True
+            flight.listeners -= 1
+            if not flight.listeners and not flight.done:
+                # Nobody is reading any more: stop the LLM call, and make
+                # sure no new request joins a truncated answer
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+                flight.task.cancel()
+
+        if disconnected is not None:
+            # A response abandoned mid-send never closes this generator
+            disconnected.add_done_callback(leave)
+        i = 0
+        try:
+            while True:
+                changed = flight._changed
+                if i < len(flight.items):
+                    item = flight.items[i]
+                    i += 1
+                    if isinstance(item, str):
+                        yield item
+                    elif on_stage is not None:
+                        on_stage(*item)
+                    continue
+                if flight.done:
+                    return
+                await changed.wait()
+        finally:
+            leave()
+
+    def stats(self) -> dict:
+        return {"inflight": len(self._flights), "coalesced": self.coalesced}
+
+
+cache = AnswerCache()
+flights = SingleFlight()
+
+
+# ---------------------------------------------------------
+# Entry point
+# ---------------------------------------------------------
+def _prepare(user_text: str, rag_index, scope: Optional[dict], thread_id: Optional[str], embed: bool):
+    """Blocking part: is the turn personalized, the state it depends on, and
+    the query vector (None when not needed)."""
+    from .agent_hub import _math_fn
+
+    if thread_id and any(conversation_memory.context(thread_id)):
+        return None, None, None
+    if _math_fn(user_text) is not None:
+        return None, None, None
+    scope_key = tuple(sorted((scope or {}).items()))
+    # Embed first: with RAGClient the response also refreshes the version
+    vector = rag_index.embed_query(user_text) if embed else None
+    context = (rag_index.version, memory_graph.memory_version(), scope_key)
+    return True, context, vector
+
+
+async def _replay(answer: str) -> AsyncIterator[str]:
+    for piece in _REPLAY_RE.findall(answer):
+        yield piece
+
+
+async def answer(
+    user_text: str,
+    rag_index,
+    make_stream: Callable[[Callable], AsyncIterator[str]],
+    scope: Optional[dict] = None,
+    thread_id: Optional[str] = None,
+    on_stage: Optional[Callable[[str, dict], None]] = None,
+    cacheable: bool = True,
+    disconnected: Optional[asyncio.Future] = None,
+) -> AsyncIterator[str]:
+    """
+    Tokens answering `user_text`, from the cache, a matching in-flight turn,
+    or a new turn built by `make_stream(on_stage)` (arun_agent). With
+    `cacheable=False` the turn always runs on its own. `disconnected`
+    completes when the client leaves, releasing its share of a flight.
+    """
+    from .agent_hub import run_blocking
+
+    def stage(name: str, **info):
+        if on_stage is not None:
+            on_stage(name, info)
+
+    eligible, context, vector = None, None, None
+    if cacheable and (ANSWER_CACHE or SINGLE_FLIGHT):
+        try:
+            eligible, context, vector = await run_blocking(_prepare, user_text, rag_index, scope, thread_id,
+                                                           ANSWER_CACHE)
+        except Exception as e:
+            logger.warning(f"Answer cache unavailable for this turn: {e}")
+    if not eligible:
+        ANSWERS.inc("bypass")
+        stream = make_stream(on_stage)
+    else:
+        stream = _shared(user_text, make_stream, context, vector, stage, on_stage, disconnected)
+    # Closed explicitly so a client leaving is seen (and the LLM call
+    # cancelled) right away, not when the generator is collected
+    try:
+        async for token in stream:
+            yield token
+    finally:
+        await stream.aclose()
+
+
+async def _shared(user_text: str, make_stream, context: Tuple, vector, stage, on_stage,
+                  disconnected) -> AsyncIterator[str]:
+    if vector is not None:
+        hit = cache.get(vector, context, user_text)
+        if hit is not None:
+            ANSWERS.inc("cache")
+            stage("cached", similarity=round(hit[1], 4))
+            async for token in _replay(hit[0]):
+                yield token
+            return
+
+    key = (normalize_query(user_text), context)
+    flight = flights.inflight(key) if SINGLE_FLIGHT else None
+    if flight is not None:
+        flights.coalesced += 1
+        ANSWERS.inc("coalesced")
+        stage("coalesced")
+    else:
+        ANSWERS.inc("llm")
+        on_done = (lambda text: cache.put(vector, context, user_text, text)) if vector is not None else None
+        flight = flights.start(key, make_stream, on_done)
+    listener = flights.listen(flight, on_stage, disconnected)
+    try:
+        async for token in listener:
+            yield token
+    finally:
+        await listener.aclose()
+
+
+def stats() -> dict:
+    return {"cache": cache.stats(), "single_flight": flights.stats()}
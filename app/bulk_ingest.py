@@ -0,0 +1,280 @@
+# bulk_ingest.py — parallel, resumable indexing of a directory of PDFs
+"""
+    python -m app.bulk_ingest /path/to/archive --owner acme
+
+Indexes every PDF under a directory into the same index the app serves:
+
+  * PDFs are parsed and split in a process pool (--workers, default: all
+    cores but one), a few files ahead of the embedder.
+  * Chunks from all documents share fixed-size embedding batches
+    (--embed-batch). Each batch is written to the collection in one add,
+    so small files don't pay a model call and a write each.
+  * A document is recorded in a checkpoint file once all its chunks are
+    stored. A re-run skips recorded files (same path, size and mtime).
+    A file cut off mid-way is parsed again, but only its missing chunks
+    are embedded (chunk ids hash the document and chunk text). A file
+    that changed since it was recorded replaces the document recorded for
+    its path.
+  * A progress line with files, pages and chunks per second is printed
+    every --progress-s seconds.
+
+Stop the app (or run it with RAG_SERVER pointing elsewhere) while bulk
+loading a Chroma directory, so only one process writes to it.
+"""
+import json
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from .rag_utils import RAGIndex, chunk_id, file_hash, iter_pdf_pages
+
+CHECKPOINT_NAME = "bulk_ingest.jsonl"
+
+
+def find_pdfs(root: str) -> List[str]:
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        paths.extend(os.path.join(dirpath, f) for f in sorted(filenames) if f.lower().endswith(".pdf"))
+    return paths
+
+
+def _file_key(path: str, rel: str) -> str:
+    st = os.stat(path)
+    return f"{rel}|{st.st_size}|{int(st.st_mtime)}"
+
+
+def parse_pdf(path: str, source: str, owner: str) -> Dict:
+    """Worker-side: hash, parse and split one PDF. Returns plain data so it
+    pickles cheaply back to the parent."""
+    doc_hash = file_hash(path)
+    meta = {"source": source, "doc_hash": doc_hash, "owner": owner}
+    chunks, seen, pages = [], set(), 0
+    try:
+        for page_no, texts in iter_pdf_pages(path):
+            pages += 1
+            for text in texts:
+                cid = chunk_id(text, owner, doc_hash)
+                if cid not in seen:
+                    seen.add(cid)
+                    chunks.append((cid, text, dict(meta, page=page_no, chunk_hash=chunk_id(text, owner))))
+    except Exception as e:
+        return {"source": source, "error": f"{type(e).__name__}: {e}", "pages": pages, "chunks": []}
+    return {"path": os.path.abspath(path), "source": source, "doc_hash": doc_hash, "pages": pages, "chunks": chunks}
+
+
+class Checkpoint:
+    """Append-only JSONL record of finished files."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        self.docs: Dict[str, str] = {}  # file path -> doc id last indexed from it
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        self._add(json.loads(line))
+                    except (ValueError, KeyError):
+                        continue  # torn last line from a crash
+        self._f = open(path, "a")
+
+    def record(self, entries: List[Dict]):
+        for e in entries:
+            self._f.write(json.dumps(e) + "\n")
+            self._add(e)
+        self._f.flush()
+        os.fsync(self._f.fileno())
+
+    def _add(self, entry: Dict):
+        self.done.add(entry["key"])
+        if entry.get("path"):
+            self.docs[entry["path"]] = entry["doc_hash"]
+
+    def close(self):
+        self._f.close()
+
+
+class _Doc:
+    __slots__ = ("key", "path", "source", "doc_hash", "pages", "chunks", "outstanding", "new")
+
+    def __init__(self, key, parsed):
+        self.key = key
+        self.path = parsed["path"]
+        self.source = parsed["source"]
+        self.doc_hash = parsed["doc_hash"]
+        self.pages = parsed["pages"]
+        self.chunks = {cid: (text, meta) for cid, text, meta in parsed["chunks"]}
+        self.outstanding = 0
+        self.new = 0
+
+
+class BulkIngester:
+    def __init__(self, rag: RAGIndex, owner: str = "", workers: Optional[int] = None, embed_batch: int = 256,
+                 checkpoint: Optional[str] = None, progress_s: float = 2.0, out=sys.stdout):
+        self.rag = rag
+        self.owner = owner or ""
+        # 0 parses in this process (single-core machines, debugging)
+        self.workers = max(0, workers) if workers is not None else max(1, (os.cpu_count() or 2) - 1)
+        self.embed_batch = max(1, embed_batch)
+        self.checkpoint = Checkpoint(checkpoint or os.path.join(rag.persist_dir, CHECKPOINT_NAME))
+        self.progress_s = progress_s
+        self.out = out
+        self.stats = {"files": 0, "skipped": 0, "failed": 0, "pages": 0, "chunks": 0, "embedded": 0}
+        self._buffer: List[Tuple[str, str, dict]] = []
+        self._waiting: Dict[str, List[_Doc]] = {}  # buffered chunk id -> docs containing it
+        self._open: List[_Doc] = []  # docs with chunks still in the buffer, in arrival order
+
+    # ---------------- Pipeline ----------------
+    def run(self, root: str) -> Dict:
+        root = os.path.abspath(root)
+        todo = []
+        for path in find_pdfs(root):
+            rel = os.path.relpath(path, root)
+            key = _file_key(path, rel)
+            if key in self.checkpoint.done:
+                self.stats["skipped"] += 1
+            else:
+                todo.append((path, rel, key))
+        self.total = len(todo)
+        print(f"📚 {self.total} PDFs to index under {root} ({self.stats['skipped']} already done), "
+              f"{self.workers} parser processes, embed batch {self.embed_batch}", file=self.out)
+
+        self._t0 = self._last_report = time.perf_counter()
+        try:
+            if self.workers:
+                ctx = multiprocessing.get_context("spawn")  # never fork a process holding model threads
+                with ProcessPoolExecutor(max_workers=self.workers, mp_context=ctx) as pool:
+                    self._drain(self._parsed(pool, todo))
+            else:
+                self._drain((key, parse_pdf(path, rel, self.owner)) for path, rel, key in todo)
+        finally:
+            self.rag._bump_version()
+            self.checkpoint.close()
+        self._report(final=True)
+        return self.stats
+
+    def _drain(self, results: Iterator[Tuple[str, Dict]]):
+        for key, parsed in results:
+            self._accept(key, parsed)
+            self._report()
+        self._flush(final=True)
+
+    def _parsed(self, pool, todo) -> Iterator[Tuple[str, Dict]]:
+        """Parse results as they finish, keeping a couple of files per worker
+        in flight so the pool never waits on the embedder."""
+        pending = {}
+        it = iter(todo)
+        while True:
+            while len(pending) < self.workers * 2:
+                nxt = next(it, None)
+                if nxt is None:
+                    break
+                path, rel, key = nxt
+                pending[pool.submit(parse_pdf, path, rel, self.owner)] = key
+            if not pending:
+                return
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for fut in done:
+                key = pending.pop(fut)
+                try:
+                    yield key, fut.result()
+                except Exception as e:
+                    yield key, {"source": key.split("|")[0], "error": f"{type(e).__name__}: {e}", "pages": 0, "chunks": []}
+
+    def _accept(self, key: str, parsed: Dict):
+        self.stats["files"] += 1
+        self.stats["pages"] += parsed["pages"]
+        if parsed.get("error"):
+            self.stats["failed"] += 1
+            print(f"\n❌ {parsed['source']}: {parsed['error']}", file=self.out)
+            return
+        doc = _Doc(key, parsed)
+        self.stats["chunks"] += len(doc.chunks)
+        # Chunks already stored by an earlier run are skipped; text other
+        # documents already embedded is reused by _add_batch
+        existing = self.rag._existing_ids(list(doc.chunks), self.owner) if doc.chunks else set()
+        for cid, (text, meta) in doc.chunks.items():
+            if cid in existing:
+                continue
+            waiters = self._waiting.get(cid)
+            if waiters is None:
+                # First copy of this file to bring the chunk stores it; duplicates wait for it
+                waiters = self._waiting[cid] = []
+                self._buffer.append((cid, text, meta))
+            waiters.append(doc)
+            doc.outstanding += 1
+        self._open.append(doc)
+        while len(self._buffer) >= self.embed_batch:
+            self._flush()
+        self._finish_ready()
+
+    def _flush(self, final: bool = False):
+        while self._buffer:
+            batch, self._buffer = self._buffer[:self.embed_batch], self._buffer[self.embed_batch:]
+            self.rag._add_batch([b[0] for b in batch], [b[1] for b in batch], [dict(b[2]) for b in batch], self.owner)
+            for cid, _, _ in batch:
+                for doc in self._waiting.pop(cid):
+                    doc.outstanding -= 1
+                    doc.new += 1
+            self.stats["embedded"] += len(batch)
+            if not final:
+                break
+        self._finish_ready()
+
+    def _finish_ready(self):
+        """Reconcile and checkpoint every document whose chunks are all stored."""
+        ready = [d for d in self._open if not d.outstanding]
+        if not ready:
+            return
+        self._open = [d for d in self._open if d.outstanding]
+        for doc in ready:
+            if doc.chunks:
+                # An earlier version of this very file, as recorded by a previous run
+                previous = self.checkpoint.docs.get(doc.path)
+                self.rag._complete_document(doc.chunks, self.owner, [previous] if previous else ())
+        self.checkpoint.record([{"key": d.key, "path": d.path, "source": d.source, "doc_hash": d.doc_hash,
+                                 "pages": d.pages, "chunks": len(d.chunks), "new": d.new} for d in ready])
+
+    # ---------------- Reporting ----------------
+    def _report(self, final: bool = False):
+        now = time.perf_counter()
+        if not final and now - self._last_report < self.progress_s:
+            return
+        self._last_report = now
+        s, elapsed = self.stats, max(now - self._t0, 1e-9)
+        rate = s["files"] / elapsed
+        eta = (self.total - s["files"]) / rate if rate and not final else 0.0
+        line = (f"{s['files']}/{self.total} files  {s['pages']} pages  {s['embedded']} chunks embedded  |  "
+                f"{rate:.1f} files/s  {s['pages'] / elapsed:.1f} pages/s  {s['embedded'] / elapsed:.1f} chunks/s  "
+                f"|  {elapsed:.0f}s elapsed" + (f", ETA {eta:.0f}s" if eta else ""))
+        if final:
+            print(("\r" if self.out.isatty() else "") + "✅ " + line + f"  ({s['failed']} failed)", file=self.out)
+        elif self.out.isatty():
+            print("\r" + line, end="", file=self.out, flush=True)
+        else:
+            print(line, file=self.out, flush=True)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Index a directory of PDFs in parallel (resumable)")
+    parser.add_argument("root", help="directory to walk for *.pdf")
+    parser.add_argument("--persist-dir", default=os.path.join(project_root, "data", "chroma_db"))
+    parser.add_argument("--owner", default="", help="owner to scope the documents to")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: cores - 1; 0 parses inline)")
+    parser.add_argument("--embed-batch", type=int, default=256, help="chunks per embedding call / collection write")
+    parser.add_argument("--checkpoint", help=f"checkpoint file (default: <persist-dir>/{CHECKPOINT_NAME})")
+    parser.add_argument("--progress-s", type=float, default=2.0, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    index = RAGIndex(persist_dir=args.persist_dir)
+    ingester = BulkIngester(index, owner=args.owner, workers=args.workers, embed_batch=args.embed_batch,
+                            checkpoint=args.checkpoint, progress_s=args.progress_s)
+    stats = ingester.run(args.root)
+    sys.exit(1 if stats["failed"] else 0)
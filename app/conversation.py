@@ -0,0 +1,287 @@
+# conversation.py — bounded conversation memory for follow-up turns
+"""
+Gives the agent the context of a thread without replaying all of it.
+
+Each thread's context is a rolling summary plus the turns the summary
+doesn't cover yet: the last HISTORY_TURNS turns, and the older ones still
+waiting to be folded in. The window holds at most HISTORY_TURNS +
+SUMMARY_EVERY turns. Summary and turns are capped (SUMMARY_TOKEN_BUDGET,
+HISTORY_TURN_CHARS), so the prompt stays about the same size however long
+the thread gets. A turn is only missing from it while the summarizer is
+more than SUMMARY_EVERY turns behind (e.g. a long thread loaded before it
+was ever summarized); those turns are queued for folding.
+
+  * The summary lives in memory_graph's thread_summaries table. It records
+    the last chat_history id it covers (upto_id).
+  * `record_turn` is called after save_turn. It appends the turn to the
+    cached window. Once SUMMARY_EVERY turns are older than the last
+    HISTORY_TURNS, it schedules a background job on one summarizer thread.
+    The job reads those turns from chat_history, folds them into the
+    summary, stores the result and only then drops them from the window.
+  * Active threads are cached in an LRU of HISTORY_CACHE_THREADS entries,
+    so a normal turn doesn't touch SQLite for its history. With several
+    workers (memory_graph.SHARED_STATE) a cached thread is first checked
+    against memory_graph.thread_version and reloaded if any worker
+    changed it.
+
+Summaries are written by the LLM given to `set_summarizer` (the chat model).
+With CONVERSATION_SUMMARIZER=extractive, or with no LLM, the summary keeps
+a clipped line per user message instead.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from . import memory_graph, telemetry
+
+logger = logging.getLogger(__name__)
+
+HISTORY_TURNS = int(os.getenv("HISTORY_TURNS", "4"))
+HISTORY_TURN_CHARS = int(os.getenv("HISTORY_TURN_CHARS", "600"))
+SUMMARY_TOKEN_BUDGET = int(os.getenv("SUMMARY_TOKEN_BUDGET", "250"))
+SUMMARY_EVERY = int(os.getenv("SUMMARY_EVERY", "4"))
+FOLD_MAX_TURNS = 16  # turns per summarization call
+HISTORY_CACHE_THREADS = int(os.getenv("HISTORY_CACHE_THREADS", "512"))
+SUMMARIZER = os.getenv("CONVERSATION_SUMMARIZER", "llm")  # llm | extractive
+
+SUMMARY_PROMPT = """You maintain a running summary of a conversation between a user and Nova, an AI assistant.
+Update the summary with the new turns. Keep names, preferences, decisions, open questions and facts the user
+may refer back to; drop small talk. Write at most {words} words of plain prose, no preamble.
+
+Current summary:
+{summary}
+
+New turns:
+{turns}
+
+Updated summary:"""
+
+
+def _clip(text: str, limit: int) -> str:
+    text = " ".join((text or "").split())
+    return text if len(text) <= limit else text[: limit - 1].rstrip() + "…"
+
+
+class _ThreadState:
+    __slots__ = ("summary", "window", "unsummarized", "version")
+
+    def __init__(self, summary: str, window: deque, unsummarized: int, version=None):
+        self.version = version            # memory_graph.thread_version when loaded (SHARED_STATE)
+        self.summary = summary
+        self.window = window              # deque of (user, assistant) newer than the summary, oldest first (maxlen window_size)
+        self.unsummarized = unsummarized  # turns newer than the summary
+
+
+class ConversationMemory:
+    def __init__(self, turns: int = HISTORY_TURNS, every: int = SUMMARY_EVERY,
+                 cache_size: int = HISTORY_CACHE_THREADS):
+        self.turns = max(1, turns)
+        self.every = max(1, every)
+        self.window_size = self.turns + self.every
+        self.cache_size = cache_size
+        self.llm = None
+        self._states: "OrderedDict[str, _ThreadState]" = OrderedDict()
+        self._loading = {}      # thread_id -> loads in flight
+        self._stale = set()     # threads that changed while being loaded
+        self._scheduled = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summarizer")
+        self.hits = 0
+        self.misses = 0
+        self.summaries = 0
+
+    # ---------------- Reads ----------------
+    def context(self, thread_id: str) -> Tuple[str, List[Tuple[str, str]]]:
+        """(summary, turns it doesn't cover as (user, assistant) pairs) for a thread."""
+        if not thread_id:
+            return "", []
+        version = memory_graph.thread_version(thread_id) if memory_graph.SHARED_STATE else None
+        with self._lock:
+            state = self._states.get(thread_id)
+            if state is not None and state.version != version:
+                state = None  # changed by another worker (or by this one's turns)
+            if state is not None:
+                self._states.move_to_end(thread_id)
+                self.hits += 1
+                return state.summary, list(state.window)
+            self.misses += 1
+            self._loading[thread_id] = self._loading.get(thread_id, 0) + 1
+        try:
+            state = self._load(thread_id, version)
+        finally:
+            with self._lock:
+                self._loading[thread_id] -= 1
+                stale = thread_id in self._stale
+                if not self._loading[thread_id]:
+                    del self._loading[thread_id]
+                    self._stale.discard(thread_id)
+        if not stale:
+            # A load that raced with a new turn or a clear is used once, not cached
+            with self._lock:
+                self._put(thread_id, state)
+                # Threads that were never summarized catch up in the background
+                due = self._due(thread_id, state)
+            if due:
+                self._executor.submit(self._summarize, thread_id)
+        return state.summary, list(state.window)
+
+    @telemetry.traced("history_load")
+    def _load(self, thread_id: str, version=None) -> _ThreadState:
+        summary, upto_id = memory_graph.load_summary(thread_id)
+        # The newest turns after the summary; anything older is left to the
+        # summarizer (scheduled by context) instead of the prompt
+        rows = memory_graph.load_history_rows(thread_id, limit=self.window_size * 2)
+        window = deque(maxlen=self.window_size)
+        pending_user = None
+        for row in rows:
+            if row["id"] <= upto_id:
+                continue
+            if row["role"] == "user":
+                pending_user = row["content"]
+            elif pending_user is not None:
+                window.append((pending_user, row["content"]))
+                pending_user = None
+        unsummarized = max(len(window), memory_graph.count_history(thread_id, after=upto_id) // 2)
+        return _ThreadState(summary, window, unsummarized, version)
+
+    def _put(self, thread_id: str, state: _ThreadState):
+        self._states[thread_id] = state
+        self._states.move_to_end(thread_id)
+        while len(self._states) > self.cache_size:
+            self._states.popitem(last=False)
+
+    # ---------------- Writes ----------------
+    def record_turn(self, thread_id: str, human: str, ai: str):
+        """Note a turn just passed to save_turn; summarizes in the background
+        once enough turns are older than the last HISTORY_TURNS."""
+        with self._lock:
+            if thread_id in self._loading:
+                self._stale.add(thread_id)
+            state = self._states.get(thread_id)
+            if state is None:
+                return  # loaded from SQLite on the next request
+            state.window.append((human, ai))
+            state.unsummarized += 1
+            due = self._due(thread_id, state)
+        if due:
+            self._executor.submit(self._summarize, thread_id)
+
+    def _due(self, thread_id: str, state: _ThreadState) -> bool:
+        """Whether to schedule a summary now (marks it scheduled). Call with
+        the lock held."""
+        if state.unsummarized - self.turns < self.every or thread_id in self._scheduled:
+            return False
+        self._scheduled.add(thread_id)
+        return True
+
+    def forget(self, thread_id: str):
+        """Drop cached state after the thread's history is cleared."""
+        with self._lock:
+            if thread_id in self._loading:
+                self._stale.add(thread_id)
+            self._states.pop(thread_id, None)
+
+    def set_summarizer(self, llm):
+        self.llm = llm
+
+    # ---------------- Summarization ----------------
+    @telemetry.traced("history_summarize")
+    def _summarize(self, thread_id: str):
+        again = False
+        try:
+            summary, upto_id = memory_graph.load_summary(thread_id)
+            rows = memory_graph.load_history_rows(thread_id, after=upto_id)
+            # Fold everything except the turns still shown verbatim
+            folded = rows[: max(0, len(rows) - self.turns * 2)]
+            if folded and folded[-1]["role"] == "user":
+                folded = folded[:-1]  # never split a turn
+            if not folded:
+                return
+            # Bounded prompts even when catching up on a long, never-summarized thread
+            step = FOLD_MAX_TURNS * 2
+            for i in range(0, len(folded), step):
+                summary = self._fold(summary, folded[i:i + step])
+            new_upto = folded[-1]["id"]
+            with self._lock:
+                if thread_id not in self._states:
+                    return  # cleared (or evicted) meanwhile
+            memory_graph.save_summary(thread_id, summary, new_upto)
+            self.summaries += 1
+            with self._lock:
+                state = self._states.get(thread_id)
+                if state is not None:
+                    state.summary = summary
+                    # Turns recorded meanwhile stay counted; the window keeps
+                    # only turns the new summary doesn't cover
+                    state.unsummarized = max(0, state.unsummarized - len(folded) // 2)
+                    while len(state.window) > max(state.unsummarized, self.turns):
+                        state.window.popleft()
+                    again = state.unsummarized - self.turns >= self.every
+        except Exception as e:
+            logger.warning(f"Summarizing thread {thread_id} failed: {e}")
+        finally:
+            with self._lock:
+                if again:
+                    # Turns arrived faster than we summarized; catch up
+                    self._executor.submit(self._summarize, thread_id)
+                else:
+                    self._scheduled.discard(thread_id)
+
+    def _fold(self, summary: str, rows: List[dict]) -> str:
+        limit = SUMMARY_TOKEN_BUDGET * 4  # ~4 characters per token
+        if SUMMARIZER == "llm" and self.llm is not None:
+            turns = "\n".join(f"{'User' if r['role'] == 'user' else 'Nova'}: {_clip(r['content'], HISTORY_TURN_CHARS)}"
+                              for r in rows)
+            prompt = SUMMARY_PROMPT.format(words=int(SUMMARY_TOKEN_BUDGET * 0.75), summary=summary or "(none)",
+                                           turns=turns)
+            try:
+                return _clip(_complete(self.llm, prompt), limit)
+            except Exception as e:
+                logger.warning(f"LLM summary failed, using extractive summary: {e}")
+        lines = [line for line in summary.split("\n") if line]
+        lines += [f"- User asked: {_clip(r['content'], 160)}" for r in rows if r["role"] == "user"]
+        # Keep the newest lines that fit
+        kept, used = [], 0
+        for line in reversed(lines):
+            if used + len(line) + 1 > limit:
+                break
+            kept.append(line)
+            used += len(line) + 1
+        return "\n".join(reversed(kept))
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "threads_cached": len(self._states),
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "summaries": self.summaries,
+            "summarizing": len(self._scheduled),
+        }
+
+
+def _complete(llm, prompt: str) -> str:
+    """Single non-streamed completion from a LangChain chat model (or
+    anything with `stream`)."""
+    if hasattr(llm, "invoke"):
+        res = llm.invoke(prompt)
+        return getattr(res, "content", res) if not isinstance(res, str) else res
+    return "".join(getattr(c, "content", c) for c in llm.stream(prompt))
+
+
+def format_history(summary: str, window: List[Tuple[str, str]]) -> str:
+    """Prompt block for the conversation so far ('' for a new thread)."""
+    lines = []
+    if summary:
+        lines.append("Earlier in this conversation (summary):\n" + summary)
+    if window:
+        lines.append("Recent turns:")
+        for human, ai in window:
+            lines.append(f"User: {_clip(human, HISTORY_TURN_CHARS)}")
+            lines.append(f"Nova: {_clip(ai, HISTORY_TURN_CHARS)}")
+    return "\n".join(lines)
+
+
+memory = ConversationMemory()
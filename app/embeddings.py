@@ -0,0 +1,186 @@
+# embeddings.py — pluggable CPU embedding backends for RAGIndex
+"""
+RAGIndex only needs an object with `encode(texts, batch_size=...)` returning a
+2-D float array. This module builds one from RAG_EMBED_BACKEND:
+
+  torch       full-precision SentenceTransformer (the original behaviour)
+  torch-int8  same model with nn.Linear layers dynamically quantized to int8
+  onnx        SentenceTransformer on ONNX Runtime, exported once to disk
+  onnx-int8   ONNX export plus dynamic int8 quantization, exported once
+
+ONNX exports are written under RAG_MODEL_CACHE and reused on later starts.
+They need `optimum[onnxruntime]`, which is optional; if it is missing,
+load_backend raises ImportError with an install hint.
+
+RAG_EMBED_DTYPE=float16 rounds vectors to half precision before they are
+stored. Chroma keeps float32 internally, so there it only rounds.
+
+`python -m app.embeddings --backend onnx-int8` reports cold-load time,
+encode throughput, resident memory and parity against the torch backend.
+"""
+import os
+import platform
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+EMBED_BACKEND = os.getenv("RAG_EMBED_BACKEND", "torch")
+EMBED_DTYPE = os.getenv("RAG_EMBED_DTYPE", "float32")
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+
+
+class EmbeddingBackend:
+    """Wraps a SentenceTransformer-like model; optionally stores fp16 vectors."""
+
+    def __init__(self, model, name: str, dtype: str = EMBED_DTYPE):
+        self.model = model
+        self.name = name
+        self.dtype = np.float16 if dtype == "float16" else np.float32
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        vectors = np.asarray(self.model.encode(texts, batch_size=batch_size, **kwargs), dtype=np.float32)
+        if self.dtype is np.float16:
+            # Round-trip through half precision so what we store is what we query with
+            vectors = vectors.astype(np.float16).astype(np.float32)
+        return vectors
+
+    def get_sentence_embedding_dimension(self) -> Optional[int]:
+        fn = getattr(self.model, "get_sentence_embedding_dimension", None)
+        return fn() if fn else None
+
+
+def _onnx_quant_config() -> str:
+    machine = platform.machine().lower()
+    if machine in ("arm64", "aarch64"):
+        return "arm64"
+    return os.getenv("RAG_ONNX_QUANT", "avx2")
+
+
+def _load_onnx(model_name: str, cache_dir: str, quantize: bool):
+    from sentence_transformers import SentenceTransformer
+    try:
+        import optimum.onnxruntime  # noqa: F401
+    except Exception as e:
+        raise ImportError("ONNX embedding backend needs `pip install optimum[onnxruntime]`") from e
+
+    export_dir = os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", model_name) + "-onnx")
+    config = _onnx_quant_config()
+    qfile = f"onnx/model_qint8_{config}.onnx"
+
+    if not os.path.isdir(export_dir):
+        # First start: export from the PyTorch weights and keep the result
+        model = SentenceTransformer(model_name, backend="onnx", device="cpu")
+        model.save_pretrained(export_dir)
+    if quantize and not os.path.exists(os.path.join(export_dir, qfile)):
+        from sentence_transformers import export_dynamic_quantized_onnx_model
+        model = SentenceTransformer(export_dir, backend="onnx", device="cpu")
+        export_dynamic_quantized_onnx_model(model, config, export_dir)
+
+    kwargs = {"file_name": qfile} if quantize else {}
+    return SentenceTransformer(export_dir, backend="onnx", device="cpu", model_kwargs=kwargs)
+
+
+def load_backend(name: str = EMBED_BACKEND, model_name: str = "all-MiniLM-L6-v2",
+                 cache_dir: Optional[str] = None, dtype: str = EMBED_DTYPE) -> EmbeddingBackend:
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend {name!r}; expected one of {', '.join(BACKENDS)}")
+    cache_dir = cache_dir or os.getenv("RAG_MODEL_CACHE", "data/models")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    if name.startswith("onnx"):
+        model = _load_onnx(model_name, cache_dir, quantize=name == "onnx-int8")
+    else:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(model_name, device="cpu")
+        if name == "torch-int8":
+            import torch
+            torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8, inplace=True)
+    return EmbeddingBackend(model, name, dtype)
+
+
+# ---------------------------------------------------------
+# Parity & profiling
+# ---------------------------------------------------------
+def _normalize(v: np.ndarray) -> np.ndarray:
+    return v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+
+
+def check_parity(reference, candidate, texts: List[str], queries: Optional[List[str]] = None, k: int = 5) -> Dict:
+    """
+    Compare two backends on the same texts: per-text cosine similarity of
+    the vectors, and overlap of top-k neighbours when `queries` (default:
+    the first 50 texts) are searched against `texts`.
+    """
+    ref, cand = _normalize(reference.encode(texts)), _normalize(candidate.encode(texts))
+    cos = np.sum(ref * cand, axis=1)
+
+    queries = queries or texts[:50]
+    q_ref, q_cand = _normalize(reference.encode(queries)), _normalize(candidate.encode(queries))
+    k = min(k, len(texts))
+    top_ref = np.argsort(-(q_ref @ ref.T), axis=1)[:, :k]
+    top_cand = np.argsort(-(q_cand @ cand.T), axis=1)[:, :k]
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(top_ref, top_cand)]
+    return {
+        "cosine_mean": round(float(cos.mean()), 5),
+        "cosine_min": round(float(cos.min()), 5),
+        f"top{k}_overlap": round(float(np.mean(overlap)), 4),
+    }
+
+
+def _rss_mb() -> float:
+    try:
+        import resource  # not available on Windows
+    except ImportError:
+        return 0.0
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if platform.system() == "Darwin" else rss / 1024
+
+
+def profile_backend(name: str, texts: List[str], model_name: str = "all-MiniLM-L6-v2",
+                    cache_dir: Optional[str] = None) -> Tuple[Dict, EmbeddingBackend]:
+    rss0 = _rss_mb()
+    t0 = time.perf_counter()
+    backend = load_backend(name, model_name, cache_dir)
+    load_s = time.perf_counter() - t0
+    backend.encode(texts[:8])  # warm-up
+
+    t0 = time.perf_counter()
+    backend.encode(texts, batch_size=32)
+    batch_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for t in texts[:100]:
+        backend.encode([t])
+    single_s = (time.perf_counter() - t0) / min(100, len(texts))
+    return {
+        "backend": name,
+        "load_s": round(load_s, 3),
+        "batch_texts_per_s": round(len(texts) / batch_s, 1),
+        "single_query_ms": round(single_s * 1000, 3),
+        "peak_rss_growth_mb": round(_rss_mb() - rss0, 1),
+    }, backend
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    parser = argparse.ArgumentParser(description="Profile an embedding backend and check parity with torch")
+    parser.add_argument("--backend", default="onnx-int8", choices=BACKENDS)
+    parser.add_argument("--model", default="all-MiniLM-L6-v2")
+    parser.add_argument("--texts", type=int, default=500)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    words = "resume project python sql budget report policy cloud model search cache index team lead".split()
+    sample = [" ".join(rng.choice(words, size=40)) for _ in range(args.texts)]
+
+    # Profile the candidate first so its RSS and load time are not flattered
+    # by the reference model already sitting in memory
+    stats, candidate = profile_backend(args.backend, sample, args.model)
+    reference = load_backend("torch", args.model)
+    stats["parity_vs_torch"] = check_parity(reference, candidate, sample)
+    print(json.dumps(stats, indent=2))
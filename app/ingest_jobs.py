@@ -0,0 +1,130 @@
+# ingest_jobs.py — background PDF ingestion with progress tracking
+"""
+Uploads are queued here instead of being indexed inside the HTTP request.
+A small, bounded pool of worker threads drains the queue and runs
+RAGIndex.load_pdf, which reports page/chunk progress back into the job.
+"""
+import os
+import queue
+import threading
+import time
+import uuid
+import logging
+from collections import OrderedDict
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", "32"))
+INGEST_KEEP_JOBS = int(os.getenv("INGEST_KEEP_JOBS", "200"))
+
+
+class IngestJob:
+    def __init__(self, file_path: str, filename: str, owner: str = "", replaces: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.file_path = file_path
+        self.filename = filename
+        self.owner = owner
+        self.replaces = replaces
+        self.doc_id: Optional[str] = None
+        self.status = "queued"
+        self.pages = 0
+        self.chunks = 0
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def update(self, pages: int = 0, chunks: int = 0, doc_id: Optional[str] = None):
+        self.pages = pages
+        self.chunks = chunks
+        if doc_id:
+            self.doc_id = doc_id
+
+    def to_dict(self) -> Dict:
+        end = self.finished_at or time.time()
+        elapsed = (end - self.started_at) if self.started_at else 0.0
+        return {
+            "job_id": self.id,
+            "filename": self.filename,
+            "owner": self.owner,
+            "doc_id": self.doc_id,
+            "replaces": self.replaces,
+            "status": self.status,
+            "pages_done": self.pages,
+            "chunks_done": self.chunks,
+            "elapsed_s": round(elapsed, 3),
+            "pages_per_s": round(self.pages / elapsed, 2) if elapsed else 0.0,
+            "chunks_per_s": round(self.chunks / elapsed, 2) if elapsed else 0.0,
+            "error": self.error,
+        }
+
+
+class IngestQueue:
+    """
+    Bounded job queue in front of RAGIndex.load_pdf.
+
+    Workers are plain daemon threads separate from the chat executor, so a
+    large upload only ever occupies INGEST_WORKERS threads; load_pdf embeds in
+    fixed-size batches, which keeps each GIL/CPU burst short.
+    """
+
+    def __init__(self, rag_index, workers: int = INGEST_WORKERS, maxsize: int = INGEST_QUEUE_SIZE):
+        self.rag = rag_index
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._threads = []
+        for i in range(max(1, workers)):
+            t = threading.Thread(target=self._worker, name=f"ingest-{i}", daemon=True)
+            t.start()
+            self._threads.append(t)
+
+    def submit(self, file_path: str, filename: str, owner: str = "", replaces: Optional[str] = None) -> IngestJob:
+        """Queue a file for indexing (replacing document `replaces`, if
+        given). Raises queue.Full if the backlog is full."""
+        job = IngestJob(file_path, filename, owner, replaces)
+        # Registered before a worker can pick it up, so status polls never 404
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._jobs.pop(job.id, None)
+            raise
+        with self._lock:
+            self._trim()
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _trim(self):
+        # Forget the oldest finished jobs once we hold too many
+        while len(self._jobs) > INGEST_KEEP_JOBS:
+            for jid, j in self._jobs.items():
+                if j.status in ("done", "error"):
+                    del self._jobs[jid]
+                    break
+            else:
+                break
+
+    def _worker(self):
+        while True:
+            job = self._queue.get()
+            job.status = "running"
+            job.started_at = time.time()
+            try:
+                self.rag.load_pdf(job.file_path, progress=job.update, source=job.filename, owner=job.owner,
+                                  replaces=job.replaces)
+                job.status = "done"
+            except Exception as e:
+                logger.error(f"Ingest job {job.id} failed: {e}")
+                job.error = str(e)
+                job.status = "error"
+            finally:
+                job.finished_at = time.time()
+                self._queue.task_done()
@@ -0,0 +1,267 @@
+# lexical_index.py — BM25 inverted index kept next to the Chroma collection
+"""
+Keyword side of hybrid retrieval. Term frequencies are persisted per chunk in
+a small SQLite file inside the Chroma directory and inverted into in-memory
+postings on load, so a lookup is a few dict reads per query term with no disk
+or network round-trip, and a write is one row per chunk.
+"""
+import heapq
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Tuple
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+# Very common words carry almost no BM25 weight but have the longest
+# posting lists, so they are dropped before scoring.
+STOPWORDS = frozenset("""
+a an and are as at be by for from has have i in is it its me my of on or
+our that the their this to was we were what when where which who why will
+with you your
+""".split())
+
+
+def tokenize(text: str) -> List[str]:
+    return [t for t in _TOKEN_RE.findall(text.lower()) if t not in STOPWORDS]
+
+
+class BM25Index:
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, max_scan: int = 256):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.max_scan = max_scan
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # _lock guards the in-memory postings (held by searches, and by writers
+        # only while they mutate them); _db_lock serializes writers and the
+        # SQLite connection, so searches never wait on a commit
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # tf is "term:count term:count ..." (\w+ tokens never contain ':' or ' ')
+        self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, length INTEGER, tf TEXT, text TEXT)")
+        columns = {r[1] for r in self._conn.execute("PRAGMA table_info(chunks)")}
+        for col in ("owner", "doc"):
+            if col not in columns:  # indexes created before scoping
+                self._conn.execute(f"ALTER TABLE chunks ADD COLUMN {col} TEXT DEFAULT ''")
+        # Documents whose ingest finished; a document with chunks but no row
+        # here was interrupted and is picked up again on the next upload
+        self._conn.execute("CREATE TABLE IF NOT EXISTS documents (owner TEXT, doc TEXT, PRIMARY KEY (owner, doc))")
+        self._conn.commit()
+
+        self._postings: Dict[str, Dict[str, int]] = {}
+        self._lengths: Dict[str, int] = {}
+        self._tags: Dict[str, Tuple[str, str]] = {}  # chunk id -> (owner, doc)
+        self._tag_counts = Counter()  # owner -> chunks, (owner, doc) -> chunks
+        self._total_len = 0
+        self._top_cache: Dict[tuple, List[Tuple[str, int]]] = {}
+        self._load()
+
+    def _load(self):
+        for cid, length, tf, owner, doc in self._conn.execute("SELECT id, length, tf, owner, doc FROM chunks"):
+            self._lengths[cid] = length
+            self._total_len += length
+            self._set_tag(cid, (owner or "", doc or ""))
+            for pair in tf.split():
+                term, n = pair.rsplit(":", 1)
+                self._postings.setdefault(term, {})[cid] = int(n)
+
+    def _set_tag(self, cid: str, tag: Optional[Tuple[str, str]]):
+        old = self._tags.pop(cid, None)
+        if old is not None:
+            self._tag_counts[old[0]] -= 1
+            self._tag_counts[old] -= 1
+        if tag is not None:
+            self._tags[cid] = tag
+            self._tag_counts[tag[0]] += 1
+            self._tag_counts[tag] += 1
+
+    def __len__(self) -> int:
+        return len(self._lengths)
+
+    def count(self, owner: Optional[str] = None, doc: Optional[str] = None) -> int:
+        """Chunks in the whole index, or of one owner / one owner's document."""
+        if owner is None and doc is None:
+            return len(self._lengths)
+        key = (owner or "", doc) if doc is not None else (owner or "")
+        return max(0, self._tag_counts.get(key, 0))
+
+    def add(self, ids: Iterable[str], texts: Iterable[str], owner: str = "", doc: str = ""):
+        with self._db_lock:
+            new, seen = [], set()
+            for cid, text in zip(ids, texts):
+                if cid in self._lengths or cid in seen:
+                    continue
+                seen.add(cid)
+                new.append((cid, text, Counter(tokenize(text))))
+            if not new:
+                return
+            rows = []
+            with self._lock:
+                for cid, text, tf in new:
+                    length = sum(tf.values())
+                    self._lengths[cid] = length
+                    self._total_len += length
+                    self._set_tag(cid, (owner, doc))
+                    for term, n in tf.items():
+                        self._postings.setdefault(term, {})[cid] = n
+                    rows.append((cid, length, " ".join(f"{t}:{n}" for t, n in tf.items()), text, owner, doc))
+                self._top_cache.clear()
+            self._conn.executemany("INSERT OR REPLACE INTO chunks (id, length, tf, text, owner, doc) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def tag(self, ids: Iterable[str], owner: str = "", doc: str = ""):
+        """Move existing chunks to another owner/document."""
+        with self._db_lock:
+            ids = [i for i in ids if i in self._lengths]
+            if not ids:
+                return
+            with self._lock:
+                for cid in ids:
+                    self._set_tag(cid, (owner, doc))
+                self._top_cache.clear()
+            self._conn.executemany("UPDATE chunks SET owner=?, doc=? WHERE id=?", [(owner, doc, i) for i in ids])
+            self._conn.commit()
+
+    def remove(self, ids: Iterable[str]):
+        with self._db_lock:
+            ids = [i for i in ids if i in self._lengths]
+            if not ids:
+                return
+            marks = ",".join("?" * len(ids))
+            rows = self._conn.execute(f"SELECT id, tf FROM chunks WHERE id IN ({marks})", ids).fetchall()
+            with self._lock:
+                for cid, tf in rows:
+                    for pair in tf.split():
+                        term = pair.rsplit(":", 1)[0]
+                        plist = self._postings.get(term)
+                        if plist is not None:
+                            plist.pop(cid, None)
+                            if not plist:
+                                del self._postings[term]
+                self._top_cache.clear()
+                for cid in ids:
+                    self._total_len -= self._lengths.pop(cid, 0)
+                    self._set_tag(cid, None)
+            self._conn.executemany("DELETE FROM chunks WHERE id=?", [(i,) for i in ids])
+            self._conn.commit()
+
+    def clear(self):
+        with self._db_lock:
+            with self._lock:
+                self._postings.clear()
+                self._lengths.clear()
+                self._tags.clear()
+                self._tag_counts.clear()
+                self._top_cache.clear()
+                self._total_len = 0
+            self._conn.execute("DELETE FROM chunks")
+            self._conn.execute("DELETE FROM documents")
+            self._conn.commit()
+
+    def mark_complete(self, owner: str, doc: str):
+        with self._db_lock:
+            self._conn.execute("INSERT OR IGNORE INTO documents (owner, doc) VALUES (?, ?)", (owner, doc))
+            self._conn.commit()
+
+    def unmark(self, owner: str, docs: Iterable[str]):
+        with self._db_lock:
+            self._conn.executemany("DELETE FROM documents WHERE owner=? AND doc=?", [(owner, d) for d in docs])
+            self._conn.commit()
+
+    def is_complete(self, owner: str, doc: str) -> bool:
+        with self._db_lock:
+            row = self._conn.execute("SELECT 1 FROM documents WHERE owner=? AND doc=?", (owner, doc)).fetchone()
+        return row is not None
+
+    def search(self, query: str, top_k: int = 10, owner: Optional[str] = None,
+               doc: Optional[str] = None) -> List[Tuple[str, float]]:
+        """Return [(chunk_id, bm25_score)] best first, optionally limited to one
+        owner's chunks (and one of their documents)."""
+        # Writers mutate the postings in place; scoring must not see that
+        # half-done (dicts changing size mid-iteration)
+        with self._lock:
+            return self._search(query, top_k, owner, doc)
+
+    def _search(self, query: str, top_k: int, owner: Optional[str], doc: Optional[str]) -> List[Tuple[str, float]]:
+        n = len(self._lengths)
+        if not n:
+            return []
+        scope = None
+        if owner is not None or doc is not None:
+            if not self.count(owner, doc):
+                return []
+            scope = (owner or "", doc)
+        avgdl = self._total_len / n or 1.0
+        k1, b = self.k1, self.b
+        scores: Dict[str, float] = {}
+        lengths = self._lengths
+        # Rarest terms first. Once some chunks are scored, long posting lists
+        # (common terms, low idf) only top up those candidates instead of
+        # being scanned in full, which keeps lookups flat as the corpus grows.
+        terms = sorted((t for t in set(tokenize(query)) if t in self._postings), key=lambda t: len(self._postings[t]))
+        for term in terms:
+            plist = self._postings[term]
+            df = len(plist)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            if scores and df > self.max_scan:
+                items = [(cid, plist[cid]) for cid in scores if cid in plist]
+            elif scope is not None:
+                items = self._scoped_postings(term, plist, avgdl, scope)
+            elif df <= self.max_scan:
+                items = plist.items()
+            else:
+                items = self._top_postings(term, plist, avgdl)
+            for cid, tf in items:
+                norm = tf + k1 * (1 - b + b * lengths[cid] / avgdl)
+                scores[cid] = scores.get(cid, 0.0) + idf * tf * (k1 + 1) / norm
+        return heapq.nlargest(top_k, scores.items(), key=lambda kv: kv[1])
+
+    def _top_postings(self, term: str, plist: Dict[str, int], avgdl: float,
+                      scope: Optional[Tuple[str, Optional[str]]] = None) -> List[Tuple[str, int]]:
+        """Highest-impact `max_scan` postings of a long list (within `scope`),
+        cached until the next write."""
+        top = self._top_cache.get((term, scope))
+        if top is None:
+            k1, b, lengths = self.k1, self.b, self._lengths
+            items = plist.items() if scope is None else self._in_scope(plist.items(), scope)
+            top = heapq.nlargest(self.max_scan, items,
+                                 key=lambda kv: kv[1] / (kv[1] + k1 * (1 - b + b * lengths[kv[0]] / avgdl)))
+            self._top_cache[(term, scope)] = top
+        return top
+
+    def _scoped_postings(self, term: str, plist: Dict[str, int], avgdl: float,
+                         scope: Tuple[str, Optional[str]]) -> List[Tuple[str, int]]:
+        if len(plist) <= self.max_scan:
+            return list(self._in_scope(plist.items(), scope))
+        return self._top_postings(term, plist, avgdl, scope)
+
+    def _in_scope(self, items, scope: Tuple[str, Optional[str]]):
+        owner, doc = scope
+        tags = self._tags
+        if doc is None:
+            return ((cid, tf) for cid, tf in items if tags[cid][0] == owner)
+        return ((cid, tf) for cid, tf in items if tags[cid] == (owner, doc))
+
+    def get_texts(self, ids: List[str]) -> Dict[str, str]:
+        if not ids:
+            return {}
+        marks = ",".join("?" * len(ids))
+        with self._db_lock:
+            rows = self._conn.execute(f"SELECT id, text FROM chunks WHERE id IN ({marks})", ids).fetchall()
+        return dict(rows)
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = 60) -> List[Tuple[str, float]]:
+    """Fuse several best-first id lists into one [(id, rrf_score)] ranking."""
+    fused: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking):
+            fused[cid] = fused.get(cid, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(fused.items(), key=lambda kv: kv[1], reverse=True)
@@ -1,6 +1,6 @@
 
 from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Request
-from fastapi.responses import HTMLResponse, JSONResponse, StreamingResponse
+from fastapi.responses import HTMLResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from pydantic import BaseModel
@@ -9,31 +9,113 @@ import shutil
 import uuid
 import logging
 import json
+import queue
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
+# Before the local imports: they read their settings from the environment
+# at import time
+load_dotenv()
+
 # Local modules
 # Local modules (Relative imports for 'app' package)
-from .rag_utils import RAGIndex
+# rag_utils / ingest_jobs / langchain_groq are imported by _load_services so
+# the process can bind its port before the heavy dependencies load.
 from .memory_graph import (
+    WRITE_BEHIND,
+    flush_writes,
+    write_stats,
+    init_db,
     save_turn,
-    load_history,
+    load_history_rows,
+    iter_history_rows,
     clear_history,
     save_profile,
     get_profile,
     save_fact,
     get_facts,
+    search_facts,
     get_recent_threads
 )
-from . import agent_hub
-from langchain_groq import ChatGroq
-from langchain_core.messages import HumanMessage, AIMessage
+from . import agent_hub, answer_cache, telemetry
+from .conversation import memory as conversation_memory
+from .streaming import coalesce, sse_frame, wait_for_disconnect
+from typing import List, Optional
 
 # --- Setup ---
-load_dotenv()
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Nova - Agentic RAG Chatbot")
+# Filled in by _load_services during startup
+llm = None
+rag = None
+ingest_queue = None
+_ready = threading.Event()
+_startup_error: Optional[str] = None
+_started_at = time.time()
+
+def _load_services():
+    """Import heavy deps, build the LLM client and RAG index, and warm them up."""
+    global llm, rag, ingest_queue, _startup_error
+    try:
+        t0 = time.time()
+        from langchain_groq import ChatGroq
+        from .ingest_jobs import IngestQueue
+        from .rag_server import RAG_SERVER
+
+        init_db()
+        llm = ChatGroq(groq_api_key=GROQ_API_KEY, model=MODEL)
+        conversation_memory.set_summarizer(llm)
+        if RAG_SERVER:
+            # Model and index live in a shared retrieval server (multi-worker)
+            from .rag_server import RAGClient
+            rag = RAGClient(RAG_SERVER)
+        else:
+            from .rag_utils import RAGIndex
+            rag = RAGIndex(persist_dir=CHROMA_DIR)
+        rag.warm_up()
+        ingest_queue = IngestQueue(rag)
+        telemetry.register_collector(_rag_metrics)
+        _ready.set()
+        logger.info(f"Services ready in {time.time() - t0:.1f}s")
+    except Exception as e:
+        _startup_error = str(e)
+        logger.error(f"Service startup failed: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load models in the background so the server accepts connections
+    # immediately; /readyz flips to 200 once they are warm.
+    loader = asyncio.get_running_loop().run_in_executor(None, _load_services)
+    yield
+    if not loader.done():
+        logger.info("Shutting down while services are still loading")
+    # Commit any chat turns / facts still queued in the write-behind buffer
+    await asyncio.get_running_loop().run_in_executor(None, flush_writes, 10)
+
+def _rag_metrics():
+    """Scrape-time gauges: index size and cache hit ratios."""
+    from .search_tool import search_stats
+    stats = rag.cache_stats()
+    caches = [
+        ({"cache": "embedding"}, stats["embedding_cache"]["hit_rate"]),
+        ({"cache": "result"}, stats["result_cache"]["hit_rate"]),
+        ({"cache": "search"}, search_stats()["cache"]["hit_rate"]),
+        ({"cache": "answer"}, answer_cache.cache.stats()["hit_rate"]),
+    ]
+    return [
+        ("nova_index_chunks", "Chunks in the vector index", [({}, stats["count"])]),
+        ("nova_index_version", "Index version (bumped on every write)", [({}, stats["index_version"])]),
+        ("nova_cache_hit_ratio", "Hit ratio of in-process caches", caches),
+        ("nova_memory_pending_writes", "Chat turns and facts queued for the next SQLite commit",
+         [({}, write_stats()["pending"])]),
+    ]
+
+app = FastAPI(title="Nova - Agentic RAG Chatbot", lifespan=lifespan)
+app.add_middleware(telemetry.RequestIdMiddleware)
 
 # Directories
 # Since we are in app/, and run from root as module, or run from app/ dir... 
@@ -54,30 +136,75 @@ templates = Jinja2Templates(directory=os.path.join(PROJECT_ROOT, "static"))
 # LLM Setup
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant")
+CHAT_BATCH_MAX = int(os.getenv("CHAT_BATCH_MAX", "1000"))
 if not GROQ_API_KEY:
     logger.warning("GROQ_API_KEY not found in .env")
 
-llm = ChatGroq(groq_api_key=GROQ_API_KEY, model=MODEL)
-rag = RAGIndex(persist_dir=CHROMA_DIR)
-
 # Models
 class ChatRequest(BaseModel):
     message: str
     thread_id: str
+    # Optional retrieval scope: only this owner's documents (or one of them)
+    owner: Optional[str] = None
+    doc_id: Optional[str] = None
+    # "sse" for Server-Sent Events (also chosen by Accept: text/event-stream)
+    stream: Optional[str] = None
+    # False: never share or reuse an answer for this turn (see answer_cache.py)
+    cache: Optional[bool] = None
+
+class BatchChatRequest(BaseModel):
+    questions: List[str]
+    owner: Optional[str] = None
+    doc_id: Optional[str] = None
+    # LLM generations in flight at once (default BATCH_LLM_CONCURRENCY)
+    concurrency: Optional[int] = None
 
 class ProfileRequest(BaseModel):
     name: str
 
+def _require_ready():
+    if not _ready.is_set():
+        raise HTTPException(status_code=503, detail=_startup_error or "Models are still loading")
+
 # --- Routes ---
 
+@app.get("/healthz")
+async def healthz():
+    # Process is up and serving; says nothing about models
+    return {"status": "ok", "uptime_s": round(time.time() - _started_at, 1)}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    # Collectors call rag.cache_stats(), a network round-trip with RAGClient
+    body = await agent_hub.run_blocking(telemetry.render_metrics)
+    return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+
+@app.get("/readyz")
+async def readyz():
+    if _ready.is_set():
+        return {"status": "ready"}
+    status = "error" if _startup_error else "loading"
+    return JSONResponse(status_code=503, content={"status": status, "detail": _startup_error})
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse("index.html", {"request": request})
 
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def _reply(text: str, sse: bool) -> StreamingResponse:
+    if sse:
+        frames = [sse_frame("token", {"text": text}), sse_frame("done", {"chars": len(text)})]
+        return StreamingResponse(iter(frames), media_type="text/event-stream", headers=SSE_HEADERS)
+    return StreamingResponse(iter([text]), media_type="text/plain")
+
 @app.post("/api/chat")
-async def chat_endpoint(req: ChatRequest):
+async def chat_endpoint(req: ChatRequest, request: Request):
+    _require_ready()
     user_text = req.message
     thread_id = req.thread_id
+    scope = {"owner": req.owner or "", "doc_id": req.doc_id} if (req.owner or req.doc_id) else None
+    sse = req.stream == "sse" or "text/event-stream" in request.headers.get("accept", "")
 
     # Lightweight memory capture (same as original app.py)
     lower = user_text.lower()
@@ -86,93 +213,228 @@ async def chat_endpoint(req: ChatRequest):
             name = user_text.split("name is")[-1].strip().split()[0]
             save_fact("friend", "friend_name", name)
             # Short circuit response
-            return StreamingResponse(iter([f"Got it — I’ll remember your friend's name is {name}."]), media_type="text/plain")
+            return _reply(f"Got it — I’ll remember your friend's name is {name}.", sse)
         if "teacher" in lower and ("is" in lower or "sir" in lower):
             teacher = user_text.split("is")[-1].strip() if "is" in lower else user_text
             save_fact("teacher", "teacher_name", teacher)
-            return StreamingResponse(iter([f"Thanks — I’ll remember that {teacher} is your teacher."]), media_type="text/plain")
+            return _reply(f"Thanks — I’ll remember that {teacher} is your teacher.", sse)
     except Exception as e:
         logger.error(f"Memory extract error: {e}")
 
     # Agent Execution
     async def generate():
+        trace = telemetry.start_trace("chat")
+        telemetry.INFLIGHT_STREAMS.inc()
+        outcome = "ok"
+        # Stop generating (and cancel the LLM call) as soon as the client leaves
+        disconnected = asyncio.ensure_future(wait_for_disconnect(request))
+        events = asyncio.Queue()
+
+        def on_stage(name, info):
+            if sse:
+                events.put_nowait(("stage", dict(info, stage=name, t_ms=round(trace.elapsed() * 1000, 1))))
+
         try:
-            # Check rag count
-            try:
-                rag_count = rag.count()
-            except:
-                rag_count = 0
-            
             # Using agent_hub logic
-            # Note: agent_hub.run_agent returns a generator/iterator
-            streamer = agent_hub.run_agent(
-                user_text=user_text,
-                llm=llm,
-                rag_index=rag,
-                get_profile_fn=get_profile,
-                get_facts_fn=get_facts,
-                top_k=3
+            # Note: agent_hub.arun_agent is an async generator; blocking tools
+            # run on agent_hub's executor so other streams keep flowing.
+            # answer_cache replays a cached answer or joins an identical
+            # in-flight turn instead of starting one when it can.
+            streamer = answer_cache.answer(
+                user_text,
+                rag,
+                lambda stage_cb: agent_hub.arun_agent(
+                    user_text=user_text,
+                    llm=llm,
+                    rag_index=rag,
+                    get_profile_fn=get_profile,
+                    get_facts_fn=search_facts,
+                    top_k=3,
+                    scope=scope,
+                    on_stage=stage_cb,
+                    thread_id=thread_id
+                ),
+                scope=scope,
+                thread_id=thread_id,
+                on_stage=on_stage,
+                cacheable=req.cache is not False,
+                disconnected=disconnected,
             )
-            
-            full_response = ""
-            for chunk in streamer:
-                full_response += chunk
-                yield chunk
-            
-            # Save turn
-            save_turn(thread_id, user_text, full_response)
-            
+
+            # Tokens are coalesced into frames (see app/streaming.py)
+            parts = []
+            async for kind, payload in coalesce(streamer, events, disconnected):
+                if kind == "text":
+                    parts.append(payload)
+                    yield sse_frame("token", {"text": payload}) if sse else payload
+                else:
+                    yield sse_frame(kind, payload)
+
+            if disconnected.done():
+                # Abandoned mid-answer: nothing is saved for a reply nobody saw
+                outcome = "cancelled"
+                return
+            full_response = "".join(parts)
+
+            # Save turn: queued for the batched writer, or committed on the
+            # executor when write-behind is disabled
+            if WRITE_BEHIND:
+                save_turn(thread_id, user_text, full_response)
+            else:
+                await agent_hub.run_blocking(save_turn, thread_id, user_text, full_response)
+            # Window update is in memory; summarizing runs in the background
+            conversation_memory.record_turn(thread_id, user_text, full_response)
+
+            if sse:
+                stages = {}
+                for name, secs in trace.stages:
+                    stages[name] = round(stages.get(name, 0.0) + secs * 1000, 1)
+                yield sse_frame("done", {"chars": len(full_response), "total_ms": round(trace.elapsed() * 1000, 1),
+                                         "stages_ms": stages})
+
+        except (GeneratorExit, asyncio.CancelledError):
+            # The server noticed the disconnect first (failed send)
+            outcome = "cancelled"
+            raise
         except Exception as e:
+            outcome = "error"
             logger.error(f"Generation error: {e}")
-            yield f"Error: {str(e)}"
+            yield sse_frame("error", {"message": str(e)}) if sse else f"Error: {str(e)}"
+        finally:
+            disconnected.cancel()
+            telemetry.INFLIGHT_STREAMS.dec()
+            telemetry.finish_trace(trace, outcome)
 
+    if sse:
+        return StreamingResponse(generate(), media_type="text/event-stream", headers=SSE_HEADERS)
     return StreamingResponse(generate(), media_type="text/plain")
 
+@app.post("/api/chat/batch")
+async def chat_batch_endpoint(req: BatchChatRequest, request: Request):
+    """Many independent questions in one call (evaluation, bulk jobs). One
+    NDJSON line per answer, in completion order; nothing is saved to chat
+    history."""
+    _require_ready()
+    if len(req.questions) > CHAT_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"At most {CHAT_BATCH_MAX} questions per batch")
+    scope = {"owner": req.owner or "", "doc_id": req.doc_id} if (req.owner or req.doc_id) else None
+    concurrency = max(1, min(req.concurrency or agent_hub.BATCH_LLM_CONCURRENCY, 64))
+
+    async def results(disconnected):
+        batch = agent_hub.arun_batch(req.questions, llm, rag, get_profile, search_facts, top_k=3,
+                                     scope=scope, concurrency=concurrency, cancelled=disconnected)
+        try:
+            async for result in batch:
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        finally:
+            await batch.aclose()
+
+    async def lines():
+        trace = telemetry.start_trace("chat_batch")
+        outcome = "ok"
+        # Generations still running are cancelled as soon as the client leaves
+        disconnected = asyncio.ensure_future(wait_for_disconnect(request))
+        try:
+            async for _, text in coalesce(results(disconnected), disconnected=disconnected):
+                yield text
+            if disconnected.done():
+                outcome = "cancelled"
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = "cancelled"
+            raise
+        except Exception as e:
+            outcome = "error"
+            logger.error(f"Batch generation error: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+        finally:
+            disconnected.cancel()
+            telemetry.finish_trace(trace, outcome)
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def _save_upload(file: UploadFile) -> str:
+    uid = uuid.uuid4().hex[:8]
+    safe_name = f"{os.path.splitext(file.filename)[0]}_{uid}.pdf"
+    dest_path = os.path.join(TMP_DIR, safe_name)
+    with open(dest_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+    return dest_path
+
 @app.post("/api/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), owner: Optional[str] = Form(None),
+                      replaces: Optional[str] = Form(None)):
+    _require_ready()
     try:
-        uid = uuid.uuid4().hex[:8]
-        safe_name = f"{os.path.splitext(file.filename)[0]}_{uid}.pdf"
-        dest_path = os.path.join(TMP_DIR, safe_name)
-        
-        with open(dest_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-            
-        # Index
-        rag.load_pdf(dest_path)
-        return {"status": "success", "filename": file.filename, "message": "Indexed successfully"}
+        dest_path = await agent_hub.run_blocking(_save_upload, file)
+        # Index in the background; the client polls /api/ingest/{job_id}
+        job = ingest_queue.submit(dest_path, file.filename, owner=owner or "", replaces=replaces or None)
+        return {"status": "queued", "job_id": job.id, "filename": file.filename, "message": "Upload received, indexing in background"}
+    except queue.Full:
+        raise HTTPException(status_code=429, detail="Ingestion queue is full, try again shortly")
     except Exception as e:
         logger.error(f"Upload failed: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/api/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    _require_ready()
+    job = ingest_queue.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job id")
+    return job.to_dict()
+
+@app.get("/api/documents")
+async def list_documents(owner: Optional[str] = None):
+    _require_ready()
+    return await agent_hub.run_blocking(rag.list_documents, owner)
+
+@app.delete("/api/documents/{doc_id}")
+async def delete_document(doc_id: str, owner: str = ""):
+    _require_ready()
+    deleted = await agent_hub.run_blocking(rag.delete_document, doc_id, owner)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="Unknown document id")
+    return {"status": "success", "doc_id": doc_id, "chunks_deleted": deleted}
+
+@app.get("/api/rag/stats")
+async def rag_stats():
+    _require_ready()
+    stats = await agent_hub.run_blocking(rag.cache_stats)
+    return dict(stats, answers=answer_cache.stats())
+
 @app.get("/api/history")
-async def get_history(thread_id: str):
-    msgs = load_history(thread_id)
-    # Convert to simple list
-    history_data = []
-    for m in msgs:
-        role = "user" if isinstance(m, HumanMessage) else "assistant"
-        history_data.append({"role": role, "content": m.content})
-    return history_data
+async def get_history(thread_id: str, before: Optional[int] = None, after: Optional[int] = None,
+                      limit: Optional[int] = None, format: str = "json"):
+    # Full export as NDJSON, streamed page by page from SQLite
+    if format == "ndjson":
+        lines = (json.dumps(row) + "\n" for row in iter_history_rows(thread_id))
+        return StreamingResponse(lines, media_type="application/x-ndjson")
+
+    if limit is not None:
+        limit = max(1, min(limit, 500))
+    return await agent_hub.run_blocking(load_history_rows, thread_id, before=before, after=after, limit=limit)
 
 @app.delete("/api/history")
 async def delete_history(thread_id: str):
-    clear_history(thread_id)
+    await agent_hub.run_blocking(clear_history, thread_id)
+    conversation_memory.forget(thread_id)
     return {"status": "success"}
 
 @app.get("/api/threads")
 async def get_threads_endpoint():
-    return get_recent_threads()
+    # Reads wait for queued writes (memory_graph barrier); keep that off the loop
+    return await agent_hub.run_blocking(get_recent_threads)
+
+def _memory_data():
+    return {"name": get_profile("name"), "facts": get_facts()}
 
 @app.get("/api/memory")
 async def get_memory_data():
-    name = get_profile("name")
-    facts = get_facts()
-    return {"name": name, "facts": facts}
+    return await agent_hub.run_blocking(_memory_data)
 
 @app.post("/api/profile")
 async def set_profile(req: ProfileRequest):
-    save_profile("name", req.name)
+    await agent_hub.run_blocking(save_profile, "name", req.name)
     return {"status": "success", "name": req.name}
 
 if __name__ == "__main__":
@@ -1,118 +1,547 @@
 # memory_graph.py
-import sqlite3, os
+import sqlite3, os, re, threading, queue, time, atexit, logging
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+from . import telemetry
+from .telemetry import traced
+
+logger = logging.getLogger(__name__)
 
 # Resolving path relative to this file
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.dirname(BASE_DIR)
 DB_PATH = os.path.join(PROJECT_ROOT, "data", "memory.db")
 
+# Write-behind: turns and facts are queued and committed in batches by one
+# writer thread. MEMORY_WRITE_BEHIND=0 commits on the caller's thread instead.
+WRITE_BEHIND = os.getenv("MEMORY_WRITE_BEHIND", "1") == "1"
+FLUSH_MS = float(os.getenv("MEMORY_FLUSH_MS", "50"))
+FLUSH_BATCH = int(os.getenv("MEMORY_FLUSH_BATCH", "256"))
+# NORMAL survives process crashes but may lose the last commits on power
+# loss; FULL fsyncs every commit
+SYNCHRONOUS = os.getenv("MEMORY_SYNCHRONOUS", "NORMAL").upper()
+# Facts put in a prompt: the FACT_TOP_K most relevant to the message
+FACT_TOP_K = int(os.getenv("FACT_TOP_K", "5"))
+# Several app processes on one database (uvicorn --workers with RAG_SERVER,
+# or WEB_CONCURRENCY > 1): in-process caches of facts, profile and thread
+# history are checked against version counters in SQLite before use, so
+# writes made by another worker are seen. MEMORY_SHARED=1/0 forces it.
+_shared_env = os.getenv("MEMORY_SHARED", "auto")
+SHARED_STATE = (_shared_env == "1" if _shared_env != "auto"
+                else bool(os.getenv("RAG_SERVER")) or int(os.getenv("WEB_CONCURRENCY", "1") or 1) > 1)
+
+WRITE_ERRORS = telemetry.register(telemetry.Counter(
+    "nova_memory_write_errors_total", "Queued chat history / fact writes that failed to commit"))
+
+# ---------------- Connections ----------------
+# One long-lived connection per thread, in WAL mode so readers never block
+# the writer. sqlite3 keeps a per-connection cache of prepared statements,
+# so the constant SQL strings below are compiled once per thread.
+_local = threading.local()
+# The schema is created on first connection rather than at import time
+_schema_lock = threading.Lock()
+_schema_ready = None  # DB_PATH the schema was created for
+
+def _conn():
+    global _schema_ready
+    conn = getattr(_local, "conn", None)
+    if conn is None or getattr(_local, "path", None) != DB_PATH:
+        os.makedirs(os.path.dirname(DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(DB_PATH, timeout=30, cached_statements=256)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={'FULL' if SYNCHRONOUS == 'FULL' else 'NORMAL'}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _local.conn = conn
+        _local.path = DB_PATH
+    if _schema_ready != DB_PATH:
+        with _schema_lock:
+            if _schema_ready != DB_PATH:
+                _create_schema(conn)
+                _schema_ready = DB_PATH
+    return conn
+
 def init_db():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS chat_history (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        thread_id TEXT,
-        role TEXT,
-        content TEXT
-    )""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS profile (
-        key TEXT PRIMARY KEY,
-        value TEXT
-    )""")
-    cur.execute("""
-    CREATE TABLE IF NOT EXISTS facts (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        category TEXT,
-        label TEXT,
-        value TEXT
-    )""")
-    conn.commit()
-    conn.close()
-
-init_db()
+    _conn()
+
+def _create_schema(conn):
+    with conn:
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS chat_history (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            thread_id TEXT,
+            role TEXT,
+            content TEXT
+        )""")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS profile (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        )""")
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS facts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            category TEXT,
+            label TEXT,
+            value TEXT
+        )""")
+        # Per-thread summary so listing threads never scans chat_history
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS threads (
+            thread_id TEXT PRIMARY KEY,
+            title TEXT,
+            last_id INTEGER
+        )""")
+        # Rolling summary of each thread's turns up to upto_id (see conversation.py)
+        conn.execute("""
+        CREATE TABLE IF NOT EXISTS thread_summaries (
+            thread_id TEXT PRIMARY KEY,
+            summary TEXT,
+            upto_id INTEGER
+        )""")
+        # Bumped in the same transaction as every fact / profile write, so
+        # other processes can tell their caches are stale (SHARED_STATE)
+        conn.execute("CREATE TABLE IF NOT EXISTS memory_versions (name TEXT PRIMARY KEY, version INTEGER)")
+        conn.execute("INSERT OR IGNORE INTO memory_versions (name, version) VALUES ('facts', 0), ('profile', 0)")
+        _create_fact_index(conn)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_history_thread ON chat_history(thread_id, id)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_threads_last_id ON threads(last_id)")
+
+        # One-off backfill for databases created before the threads table
+        has_threads = conn.execute("SELECT 1 FROM threads LIMIT 1").fetchone()
+        has_history = conn.execute("SELECT 1 FROM chat_history LIMIT 1").fetchone()
+        if has_history and not has_threads:
+            conn.execute("""
+            INSERT INTO threads (thread_id, title, last_id)
+            SELECT thread_id,
+                   (SELECT content FROM chat_history ch2 WHERE ch2.thread_id = ch1.thread_id AND role='user' ORDER BY id LIMIT 1),
+                   MAX(id)
+            FROM chat_history ch1
+            GROUP BY thread_id
+            """)
+
+_fts_enabled = False
+
+def _create_fact_index(conn):
+    """One fact per (category, label), plus an FTS5 index over label and
+    value kept in sync by triggers. Without FTS5, search_facts falls back
+    to scanning in Python."""
+    global _fts_enabled
+    has_unique = conn.execute("SELECT 1 FROM sqlite_master WHERE name='idx_facts_category_label'").fetchone()
+    if not has_unique:
+        # Older databases appended duplicates: keep the latest value of each
+        conn.execute("""
+        DELETE FROM facts WHERE id NOT IN (SELECT MAX(id) FROM facts GROUP BY category, label)
+        """)
+        conn.execute("CREATE UNIQUE INDEX idx_facts_category_label ON facts(category, label)")
+    try:
+        exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name='facts_fts'").fetchone()
+        conn.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS facts_fts USING fts5(
+            label, value, content='facts', content_rowid='id'
+        )""")
+        conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS facts_ai AFTER INSERT ON facts BEGIN
+            INSERT INTO facts_fts(rowid, label, value) VALUES (new.id, new.label, new.value);
+        END""")
+        conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS facts_ad AFTER DELETE ON facts BEGIN
+            INSERT INTO facts_fts(facts_fts, rowid, label, value) VALUES ('delete', old.id, old.label, old.value);
+        END""")
+        conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS facts_au AFTER UPDATE ON facts BEGIN
+            INSERT INTO facts_fts(facts_fts, rowid, label, value) VALUES ('delete', old.id, old.label, old.value);
+            INSERT INTO facts_fts(rowid, label, value) VALUES (new.id, new.label, new.value);
+        END""")
+        if not exists:
+            conn.execute("INSERT INTO facts_fts(facts_fts) VALUES ('rebuild')")
+        _fts_enabled = True
+    except sqlite3.OperationalError as e:
+        logger.warning(f"SQLite FTS5 unavailable ({e}); fact search will scan")
+        _fts_enabled = False
+
+# ---------------- Write-behind queue ----------------
+class WriteBehind:
+    """
+    Single writer thread that commits queued writes in batches.
+
+    Each write is a function of a connection, tagged with a key (the thread
+    id for turns, "facts" for facts). The writer takes the first pending
+    write, gathers more until FLUSH_BATCH writes or FLUSH_MS have passed, and
+    runs them all in one transaction, so concurrent chats share a commit
+    instead of queueing on SQLite's write lock. Readers call barrier(key) to
+    see their own writes: it returns at once if nothing is pending for the
+    key, otherwise it asks for an immediate flush and waits for it.
+    """
+
+    def __init__(self, batch_size: int = FLUSH_BATCH, flush_ms: float = FLUSH_MS):
+        self.batch_size = max(1, batch_size)
+        self.flush_wait = max(0.0, flush_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._pending = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.writes = 0
+        self.errors = 0
+
+    def submit(self, key, op, urgent=False) -> Future:
+        """Queue `op`; `urgent` flushes the batch now instead of waiting FLUSH_MS."""
+        fut = Future()
+        with self._lock:
+            self._pending[key] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="memory-writer", daemon=True)
+                self._thread.start()
+        self._queue.put((key, op, fut, urgent))
+        return fut
+
+    def barrier(self, key=None, timeout=None):
+        """Wait until every write queued so far for `key` (any key if None) is committed."""
+        with self._lock:
+            if not (self._pending[key] if key is not None else +self._pending):
+                return
+        fut = Future()
+        self._queue.put((None, None, fut, True))
+        fut.result(timeout)
+
+    def pending(self) -> int:
+        with self._lock:
+            return sum(self._pending.values())
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_wait
+        while len(batch) < self.batch_size and not batch[-1][3]:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            writes = [b for b in batch if b[1] is not None]
+            if writes:
+                self._commit(writes)
+            for key, op, fut, _ in batch:
+                if op is None:
+                    fut.set_result(None)
+
+    @traced("sqlite_flush")
+    def _commit(self, writes):
+        try:
+            conn = _conn()
+            with conn:
+                for _, op, _, _ in writes:
+                    op(conn)
+            results = [None] * len(writes)
+        except Exception as e:
+            # One bad write must not sink the batch: retry them one by one
+            logger.warning(f"Batched memory write failed ({e}); retrying individually")
+            results = []
+            for _, op, _, _ in writes:
+                try:
+                    with _conn() as conn:
+                        op(conn)
+                    results.append(None)
+                except Exception as err:
+                    results.append(err)
+        with self._lock:
+            for key, _, _, _ in writes:
+                self._pending[key] -= 1
+                if self._pending[key] <= 0:
+                    del self._pending[key]
+        self.batches += 1
+        self.writes += len(writes)
+        for (key, _, fut, _), err in zip(writes, results):
+            if err is None:
+                fut.set_result(None)
+            else:
+                # Callers that didn't wait never look at the future
+                logger.error(f"Memory write for {key!r} lost: {err}")
+                self.errors += 1
+                WRITE_ERRORS.inc()
+                fut.set_exception(err)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.pending(),
+            "batches": self.batches,
+            "writes": self.writes,
+            "avg_batch": round(self.writes / self.batches, 2) if self.batches else 0.0,
+            "errors": self.errors,
+        }
+
+_writer = WriteBehind()
+
+def _write(key, op, wait=False):
+    """Run `op(conn)` in a transaction: queued on the writer thread, or
+    inline when write-behind is off. `wait` blocks until it is committed."""
+    if not WRITE_BEHIND:
+        conn = _conn()
+        with conn:
+            op(conn)
+        return
+    fut = _writer.submit(key, op, urgent=wait)
+    if wait:
+        fut.result()
+
+def flush_writes(timeout=None):
+    """Commit everything queued so far (call on shutdown)."""
+    _writer.barrier(None, timeout)
+
+def write_stats():
+    return dict(_writer.stats(), write_behind=WRITE_BEHIND)
+
+atexit.register(flush_writes, 5)
 
 # ---------------- History ----------------
-def save_turn(thread_id, human, ai):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO chat_history (thread_id, role, content) VALUES (?, ?, ?)", (thread_id, "user", human))
-    cur.execute("INSERT INTO chat_history (thread_id, role, content) VALUES (?, ?, ?)", (thread_id, "assistant", ai))
-    conn.commit()
-    conn.close()
+_INSERT_MSG = "INSERT INTO chat_history (thread_id, role, content) VALUES (?, ?, ?)"
+_UPSERT_THREAD = """
+INSERT INTO threads (thread_id, title, last_id) VALUES (?, ?, ?)
+ON CONFLICT(thread_id) DO UPDATE SET last_id = excluded.last_id
+"""
+
+@traced("sqlite_save_turn")
+def save_turn(thread_id, human, ai, wait=False):
+    def op(conn):
+        conn.execute(_INSERT_MSG, (thread_id, "user", human))
+        last_id = conn.execute(_INSERT_MSG, (thread_id, "assistant", ai)).lastrowid
+        # title is only set on first insert; later turns just move last_id
+        conn.execute(_UPSERT_THREAD, (thread_id, human, last_id))
+    _write(thread_id, op, wait)
 
 def load_history(thread_id):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT role, content FROM chat_history WHERE thread_id=? ORDER BY id", (thread_id,))
-    rows = cur.fetchall()
-    conn.close()
+    _writer.barrier(thread_id)
+    rows = _conn().execute("SELECT role, content FROM chat_history WHERE thread_id=? ORDER BY id", (thread_id,)).fetchall()
     from langchain_core.messages import HumanMessage, AIMessage
     return [HumanMessage(c) if r == "user" else AIMessage(c) for r, c in rows]
 
+@traced("sqlite_load_history_rows")
+def load_history_rows(thread_id, before=None, after=None, limit=None):
+    """
+    Keyset-paginated history as plain dicts ({"id", "role", "content"}),
+    oldest first. `before`/`after` are chat_history ids; with `before` (or no
+    cursor) and a limit, the newest `limit` rows below the cursor are returned.
+    """
+    where, args = ["thread_id=?"], [thread_id]
+    if after is not None:
+        where.append("id>?")
+        args.append(after)
+    if before is not None:
+        where.append("id<?")
+        args.append(before)
+    # Paging forward from `after` reads ascending; otherwise take the newest
+    # rows below the cursor and flip them back into order.
+    _writer.barrier(thread_id)
+    newest_first = after is None and limit is not None
+    sql = f"SELECT id, role, content FROM chat_history WHERE {' AND '.join(where)} ORDER BY id{' DESC' if newest_first else ''}"
+    if limit:
+        sql += " LIMIT ?"
+        args.append(limit)
+    rows = _conn().execute(sql, args).fetchall()
+    if newest_first:
+        rows.reverse()
+    return [{"id": i, "role": r, "content": c} for i, r, c in rows]
+
+def iter_history_rows(thread_id, batch_size=500):
+    """Yield every row of a thread in id order, one keyset page at a time."""
+    last_id = 0
+    while True:
+        rows = load_history_rows(thread_id, after=last_id, limit=batch_size)
+        if not rows:
+            return
+        yield from rows
+        last_id = rows[-1]["id"]
+
+@traced("sqlite_clear_history")
 def clear_history(thread_id):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM chat_history WHERE thread_id=?", (thread_id,))
-    conn.commit()
-    conn.close()
+    # Queued behind this thread's pending turns so they can't resurrect it
+    def op(conn):
+        conn.execute("DELETE FROM chat_history WHERE thread_id=?", (thread_id,))
+        conn.execute("DELETE FROM threads WHERE thread_id=?", (thread_id,))
+        conn.execute("DELETE FROM thread_summaries WHERE thread_id=?", (thread_id,))
+    _write(thread_id, op, wait=True)
+
+def thread_version(thread_id):
+    """(last turn id, summary upto_id) of a thread as committed in SQLite;
+    changes with every turn, summary or clear, by any process."""
+    _writer.barrier(thread_id)
+    row = _conn().execute("""
+    SELECT t.last_id, s.upto_id FROM threads t LEFT JOIN thread_summaries s ON s.thread_id = t.thread_id
+    WHERE t.thread_id=?""", (thread_id,)).fetchone()
+    return (row[0], row[1] or 0) if row else (0, 0)
 
+def count_history(thread_id, after=0):
+    _writer.barrier(thread_id)
+    return _conn().execute("SELECT COUNT(*) FROM chat_history WHERE thread_id=? AND id>?",
+                           (thread_id, after)).fetchone()[0]
+
+# ---------------- Thread summaries ----------------
+_UPSERT_SUMMARY = """
+INSERT INTO thread_summaries (thread_id, summary, upto_id)
+SELECT ?, ?, ? WHERE EXISTS (SELECT 1 FROM threads WHERE thread_id=?)
+ON CONFLICT(thread_id) DO UPDATE SET summary = excluded.summary, upto_id = excluded.upto_id
+"""
+
+@traced("sqlite_save_summary")
+def save_summary(thread_id, summary, upto_id, wait=False):
+    # Skipped if the thread was cleared while the summary was being written
+    _write(thread_id, lambda conn: conn.execute(_UPSERT_SUMMARY, (thread_id, summary, upto_id, thread_id)), wait)
+
+@traced("sqlite_load_summary")
+def load_summary(thread_id):
+    """(summary, upto_id) for a thread; ("", 0) if it has none yet."""
+    _writer.barrier(thread_id)
+    row = _conn().execute("SELECT summary, upto_id FROM thread_summaries WHERE thread_id=?", (thread_id,)).fetchone()
+    return (row[0] or "", row[1] or 0) if row else ("", 0)
+
+@traced("sqlite_get_recent_threads")
 def get_recent_threads(limit=10):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    # Get unique threads and their first message as title
-    query = """
-    SELECT thread_id, 
-           (SELECT content FROM chat_history ch2 WHERE ch2.thread_id = ch1.thread_id AND role='user' ORDER BY id LIMIT 1) as title
-    FROM chat_history ch1
-    GROUP BY thread_id
-    ORDER BY MAX(id) DESC
-    LIMIT ?
-    """
-    cur.execute(query, (limit,))
-    rows = cur.fetchall()
-    conn.close()
+    _writer.barrier()
+    rows = _conn().execute("SELECT thread_id, title FROM threads ORDER BY last_id DESC LIMIT ?", (limit,)).fetchall()
     return [{"id": r[0], "title": r[1] or "New Chat"} for r in rows]
 
+# ---------------- Shared versions ----------------
+_BUMP_VERSION = "UPDATE memory_versions SET version = version + 1 WHERE name=?"
+_shared_seen = {}  # name -> last committed version this process acted on
+_shared_lock = threading.Lock()
+
+def _sync_shared():
+    """With SHARED_STATE, drop local fact/profile caches if any process
+    committed a write since the last check."""
+    global _profile_gen
+    if not SHARED_STATE:
+        return
+    # Committed state only: this process's queued writes already invalidated
+    rows = dict(_conn().execute("SELECT name, version FROM memory_versions").fetchall())
+    with _shared_lock:
+        changed = {n for n, v in rows.items() if _shared_seen.get(n) != v}
+        _shared_seen.update(rows)
+    if "facts" in changed:
+        _invalidate_facts()
+    if "profile" in changed:
+        _profile_gen += 1
+
 # ---------------- Profile ----------------
+_profile_gen = 0
+
+@traced("sqlite_save_profile")
 def save_profile(key, value):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT OR REPLACE INTO profile (key, value) VALUES (?, ?)", (key, value))
-    conn.commit()
-    conn.close()
+    global _profile_gen
+    _profile_gen += 1
+    conn = _conn()
+    with conn:
+        conn.execute("INSERT OR REPLACE INTO profile (key, value) VALUES (?, ?)", (key, value))
+        conn.execute(_BUMP_VERSION, ("profile",))
 
+@traced("sqlite_get_profile")
 def get_profile(key):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("SELECT value FROM profile WHERE key=?", (key,))
-    res = cur.fetchone()
-    conn.close()
+    res = _conn().execute("SELECT value FROM profile WHERE key=?", (key,)).fetchone()
     return res[0] if res else None
 
 # ---------------- Facts (New Entity Memory) ----------------
-def save_fact(category, label, value):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("INSERT INTO facts (category, label, value) VALUES (?, ?, ?)", (category, label, value))
-    conn.commit()
-    conn.close()
+# Reads are cached until the next fact write. The generation is bumped
+# when a write is queued, and a read only fills the cache if no write was
+# queued while it ran.
+_facts_cache = OrderedDict()
+_facts_gen = 0
+_facts_lock = threading.Lock()
+_FACTS_CACHE_SIZE = 256
+_TERM_RE = re.compile(r"\w+")
+
+_UPSERT_FACT = """
+INSERT INTO facts (category, label, value) VALUES (?, ?, ?)
+ON CONFLICT(category, label) DO UPDATE SET value = excluded.value
+WHERE value IS NOT excluded.value
+"""
+
+def _invalidate_facts():
+    global _facts_gen
+    with _facts_lock:
+        _facts_gen += 1
+        _facts_cache.clear()
+
+def _cached_facts(key, load):
+    _sync_shared()
+    with _facts_lock:
+        if key in _facts_cache:
+            _facts_cache.move_to_end(key)
+            return _facts_cache[key]
+        gen = _facts_gen
+    _writer.barrier("facts")
+    value = load(_conn())
+    with _facts_lock:
+        if gen == _facts_gen:
+            _facts_cache[key] = value
+            while len(_facts_cache) > _FACTS_CACHE_SIZE:
+                _facts_cache.popitem(last=False)
+    return value
+
+@traced("sqlite_save_fact")
+def save_fact(category, label, value, wait=False):
+    # One row per (category, label): saying it again updates the value
+    _invalidate_facts()
+
+    def op(conn):
+        if conn.execute(_UPSERT_FACT, (category, label, value)).rowcount:
+            conn.execute(_BUMP_VERSION, ("facts",))
+    _write("facts", op, wait)
 
+@traced("sqlite_get_facts")
 def get_facts(category=None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
     if category:
-        cur.execute("SELECT label, value FROM facts WHERE category=?", (category,))
-    else:
-        cur.execute("SELECT category, label, value FROM facts")
-    rows = cur.fetchall()
-    conn.close()
+        return _cached_facts(("category", category), lambda conn: conn.execute(
+            "SELECT label, value FROM facts WHERE category=? ORDER BY id", (category,)).fetchall())
+    return _cached_facts(("all",), lambda conn: conn.execute(
+        "SELECT category, label, value FROM facts ORDER BY id").fetchall())
+
+@traced("sqlite_search_facts")
+def search_facts(query, limit=FACT_TOP_K):
+    """
+    The `limit` facts most relevant to `query` as (category, label, value),
+    ranked by BM25 over label and value. Falls back to the most recently
+    added facts when nothing matches (e.g. "what do you know about me?").
+    """
+    terms = sorted({t for t in _TERM_RE.findall((query or "").lower()) if len(t) > 1})
+    return _cached_facts(("search", tuple(terms), limit), lambda conn: _search_facts(conn, terms, limit))
+
+def _search_facts(conn, terms, limit):
+    rows = []
+    if terms and _fts_enabled:
+        match = " OR ".join('"' + t.replace('"', '""') + '"' for t in terms)
+        rows = conn.execute("""
+        SELECT f.category, f.label, f.value FROM facts_fts
+        JOIN facts f ON f.id = facts_fts.rowid
+        WHERE facts_fts MATCH ? ORDER BY bm25(facts_fts) LIMIT ?
+        """, (match, limit)).fetchall()
+    elif terms:
+        wanted = set(terms)
+        scored = []
+        for cat, label, value in conn.execute("SELECT category, label, value FROM facts"):
+            hits = len(wanted & set(_TERM_RE.findall(f"{label} {value}".lower().replace("_", " "))))
+            if hits:
+                scored.append((hits, (cat, label, value)))
+        scored.sort(key=lambda x: -x[0])
+        rows = [r for _, r in scored[:limit]]
+    if not rows:
+        rows = conn.execute("SELECT category, label, value FROM facts ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
     return rows
 
 def clear_facts():
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
-    cur.execute("DELETE FROM facts")
-    conn.commit()
-    conn.close()
+    _invalidate_facts()
+
+    def op(conn):
+        conn.execute("DELETE FROM facts")
+        conn.execute(_BUMP_VERSION, ("facts",))
+    _write("facts", op, wait=True)
+
+def memory_version():
+    """Changes whenever a fact or profile value is written (by any worker,
+    with SHARED_STATE), so answers that may have used memory can be tied to
+    the state they saw."""
+    _sync_shared()
+    return (_facts_gen, _profile_gen)
@@ -0,0 +1,308 @@
+# rag_server.py — one process that owns the embedding model and the index
+"""
+With several uvicorn workers, each worker would load its own copy of the
+embedding model and open its own Chroma client on the same directory.
+Instead, run one retrieval server:
+
+    python -m app.rag_server --uds data/rag.sock
+    RAG_SERVER=unix:data/rag.sock uvicorn app.main:app --workers 4
+
+and every worker talks to it through `RAGClient`. RAGClient has the same
+interface as RAGIndex and keeps a pool of keep-alive connections over the
+Unix socket, or over loopback HTTP with RAG_SERVER=http://127.0.0.1:8765.
+The server keeps a single model, a single index writer and the retrieval
+caches. Concurrent query encodes from all workers go through the index's
+EmbeddingBatcher, so they share model.encode calls.
+
+Endpoints (JSON):
+  POST /embed     {"texts": [...]} -> {"vectors": [[...], ...]}
+  POST /call      {"method", "args", "kwargs"} for the read/maintenance
+                  methods in CALLABLE -> {"result", "version"}
+  POST /load_pdf  NDJSON stream of {"pages", "chunks"[, "doc_id"]} progress lines, then
+                  {"result": n} or {"error": "..."}
+  GET  /version   {"version"}, the index version alone
+  GET  /healthz
+"""
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+RAG_SERVER = os.getenv("RAG_SERVER", "")  # unix:/path/to.sock | http://host:port
+RAG_CLIENT_POOL = int(os.getenv("RAG_CLIENT_POOL", "16"))
+RAG_CLIENT_TIMEOUT = float(os.getenv("RAG_CLIENT_TIMEOUT", "60"))
+RAG_SERVER_WAIT_S = float(os.getenv("RAG_SERVER_WAIT_S", "120"))
+# How stale the client's index version may get before it asks the server
+RAG_VERSION_MAX_AGE_S = float(os.getenv("RAG_VERSION_MAX_AGE_S", "1"))
+
+# RAGIndex methods reachable through /call (load_pdf has its own endpoint)
+CALLABLE = ("query", "query_batch", "count", "embed_query", "embed_queries", "relevance", "list_documents",
+            "delete_document", "cache_stats", "clear", "warm_up")
+
+
+# ---------------------------------------------------------
+# Server
+# ---------------------------------------------------------
+def create_app(rag):
+    """FastAPI app serving `rag`. Handlers are plain `def`s, so blocking
+    index work runs on Starlette's thread pool."""
+    from fastapi import FastAPI, HTTPException
+    from fastapi.responses import StreamingResponse
+    from pydantic import BaseModel
+
+    class EmbedRequest(BaseModel):
+        texts: List[str]
+
+    class CallRequest(BaseModel):
+        method: str
+        args: list = []
+        kwargs: dict = {}
+
+    class LoadRequest(BaseModel):
+        file_path: str
+        source: Optional[str] = None
+        owner: str = ""
+        replaces: Optional[str] = None
+        batch_size: Optional[int] = None
+
+    app = FastAPI(title="Nova retrieval server")
+
+    @app.get("/healthz")
+    def healthz():
+        return {"status": "ok", "version": rag.version, "count": rag.count()}
+
+    @app.get("/version")
+    def version():
+        return {"version": rag.version}
+
+    @app.post("/embed")
+    def embed(req: EmbedRequest):
+        if len(req.texts) == 1:
+            # Single queries join the cross-worker micro-batch
+            return {"vectors": [rag._batcher.encode(req.texts[0])]}
+        vectors = rag.model.encode(req.texts, batch_size=len(req.texts))
+        return {"vectors": np.asarray(vectors, dtype=np.float32).tolist()}
+
+    @app.post("/call")
+    def call(req: CallRequest):
+        if req.method not in CALLABLE:
+            raise HTTPException(status_code=404, detail=f"Unknown method {req.method!r}")
+        try:
+            result = getattr(rag, req.method)(*req.args, **req.kwargs)
+        except Exception as e:
+            logger.exception(f"{req.method} failed")
+            raise HTTPException(status_code=500, detail=f"{type(e).__name__}: {e}")
+        return {"result": result, "version": rag.version}
+
+    @app.post("/load_pdf")
+    def load_pdf(req: LoadRequest):
+        updates = queue.Queue()
+        done = object()
+
+        def run():
+            try:
+                kwargs = {"batch_size": req.batch_size} if req.batch_size else {}
+                n = rag.load_pdf(req.file_path, progress=lambda **kw: updates.put(kw),
+                                 source=req.source, owner=req.owner, replaces=req.replaces, **kwargs)
+                updates.put({"result": n})
+            except Exception as e:
+                logger.exception(f"Indexing {req.file_path} failed")
+                updates.put({"error": f"{type(e).__name__}: {e}"})
+            updates.put(done)
+
+        threading.Thread(target=run, name="rag-load", daemon=True).start()
+
+        def lines():
+            while True:
+                item = updates.get()
+                if item is done:
+                    return
+                yield json.dumps(item) + "\n"
+
+        return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+    return app
+
+
+def serve(persist_dir: str, uds: Optional[str] = None, host: str = "127.0.0.1", port: int = 8765):
+    import uvicorn
+    from .rag_utils import RAGIndex
+
+    t0 = time.time()
+    rag = RAGIndex(persist_dir=persist_dir)
+    rag.warm_up()
+    logger.info(f"Retrieval server ready in {time.time() - t0:.1f}s ({rag.count()} chunks)")
+    app = create_app(rag)
+    if uds:
+        if os.path.exists(uds):
+            os.remove(uds)  # stale socket from a previous run
+        os.makedirs(os.path.dirname(os.path.abspath(uds)), exist_ok=True)
+        uvicorn.run(app, uds=uds, log_level="warning")
+    else:
+        uvicorn.run(app, host=host, port=port, log_level="warning")
+
+
+# ---------------------------------------------------------
+# Client
+# ---------------------------------------------------------
+class _RemoteEncoder:
+    """Stands in for the model on the client (the router embeds its intent
+    prototypes with it)."""
+
+    def __init__(self, client: "RAGClient"):
+        self._client = client
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        data = self._client._post("/embed", {"texts": list(texts)})
+        return np.asarray(data["vectors"], dtype=np.float32)
+
+
+class RAGClient:
+    """RAGIndex's interface, served by a retrieval server (see module doc)."""
+
+    def __init__(self, address: str = RAG_SERVER, pool: int = RAG_CLIENT_POOL, timeout: float = RAG_CLIENT_TIMEOUT):
+        import httpx
+
+        limits = httpx.Limits(max_connections=pool, max_keepalive_connections=pool)
+        if address.startswith("unix:"):
+            transport = httpx.HTTPTransport(uds=address[len("unix:"):], limits=limits)
+            base_url = "http://rag"
+        else:
+            transport = httpx.HTTPTransport(limits=limits)
+            base_url = address.rstrip("/")
+        self.address = address
+        logging.getLogger("httpx").setLevel(logging.WARNING)  # one INFO line per call otherwise
+        self._http = httpx.Client(transport=transport, base_url=base_url, timeout=timeout)
+        self.model = _RemoteEncoder(self)
+        self.vector_store = "remote"
+        self._version = 0
+        self._version_at = 0.0  # monotonic time of the last version the server sent
+
+    def _post(self, path: str, payload: dict) -> dict:
+        r = self._http.post(path, json=payload)
+        if r.status_code >= 400:
+            try:
+                detail = r.json().get("detail")
+            except ValueError:
+                detail = r.text
+            raise RuntimeError(f"Retrieval server {path}: {detail}")
+        return r.json()
+
+    def _call(self, method: str, *args, **kwargs):
+        data = self._post("/call", {"method": method, "args": list(args), "kwargs": kwargs})
+        self._set_version(data.get("version", self._version))
+        return data["result"]
+
+    def _set_version(self, version: int):
+        self._version = version
+        self._version_at = time.monotonic()
+
+    def wait_ready(self, timeout: float = RAG_SERVER_WAIT_S):
+        """Block until the server answers /healthz (it may still be loading)."""
+        import httpx
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                r = self._http.get("/healthz")
+                if r.status_code == 200:
+                    self._set_version(r.json().get("version", 0))
+                    return
+            except httpx.TransportError:
+                pass
+            if time.monotonic() >= deadline:
+                raise RuntimeError(f"Retrieval server at {self.address} is not reachable")
+            time.sleep(0.25)
+
+    @property
+    def version(self) -> int:
+        """Index version from the last server response. Another worker may
+        have changed the index since, so one older than RAG_VERSION_MAX_AGE_S
+        is refreshed first."""
+        if time.monotonic() - self._version_at > RAG_VERSION_MAX_AGE_S:
+            self._set_version(self._http.get("/version").json()["version"])
+        return self._version
+
+    # ---- RAGIndex interface ----
+    def warm_up(self):
+        self.wait_ready()
+        self._call("warm_up")
+
+    def load_pdf(self, file_path: str, progress=None, batch_size: Optional[int] = None, source: Optional[str] = None,
+                 owner: str = "", replaces: Optional[str] = None) -> int:
+        payload = {"file_path": os.path.abspath(file_path), "source": source, "owner": owner or "",
+                   "replaces": replaces, "batch_size": batch_size}
+        with self._http.stream("POST", "/load_pdf", json=payload, timeout=None) as r:
+            if r.status_code >= 400:
+                r.read()
+                raise RuntimeError(f"Retrieval server /load_pdf: {r.text}")
+            for line in r.iter_lines():
+                if not line:
+                    continue
+                msg = json.loads(line)
+                if "error" in msg:
+                    raise RuntimeError(msg["error"])
+                if "result" in msg:
+                    self._version_at = 0.0  # the index changed; refresh on the next read
+                    return msg["result"]
+                if progress:
+                    progress(**msg)
+        raise RuntimeError("Retrieval server closed the stream before finishing")
+
+    def query(self, query_text: str, top_k: int = 3, scope: Optional[dict] = None) -> List[Tuple[str, float]]:
+        return [tuple(pair) for pair in self._call("query", query_text, top_k=top_k, scope=scope)]
+
+    def query_batch(self, query_texts: List[str], top_k: int = 3,
+                    scope: Optional[dict] = None) -> List[List[Tuple[str, float]]]:
+        rows = self._call("query_batch", list(query_texts), top_k=top_k, scope=scope)
+        return [[tuple(pair) for pair in row] for row in rows]
+
+    def embed_query(self, query_text: str) -> List[float]:
+        return self._call("embed_query", query_text)
+
+    def embed_queries(self, query_texts: List[str]) -> List[List[float]]:
+        return self._call("embed_queries", list(query_texts))
+
+    def relevance(self, query_text: str, scope: Optional[dict] = None) -> float:
+        return self._call("relevance", query_text, scope=scope)
+
+    def count(self, scope: Optional[dict] = None) -> int:
+        return self._call("count", scope=scope)
+
+    def list_documents(self, owner: Optional[str] = None) -> List[dict]:
+        return self._call("list_documents", owner=owner)
+
+    def delete_document(self, doc_id: str, owner: str = "") -> int:
+        return self._call("delete_document", doc_id, owner=owner)
+
+    def cache_stats(self) -> dict:
+        return dict(self._call("cache_stats"), server=self.address)
+
+    def clear(self):
+        self._call("clear")
+
+    def close(self):
+        self._http.close()
+
+
+if __name__ == "__main__":
+    import argparse
+
+    logging.basicConfig(level=logging.INFO)
+    project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Serve one shared embedding model and RAG index to all app workers")
+    parser.add_argument("--persist-dir", default=os.path.join(project_root, "data", "chroma_db"))
+    parser.add_argument("--uds", help="Unix socket path (otherwise loopback HTTP)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    serve(args.persist_dir, uds=args.uds, host=args.host, port=args.port)
@@ -1,118 +1,753 @@
 # rag_utils.py — RAG index helper (uses tmp_uploads/chroma_db)
 import os
-from typing import List, Tuple
+import re
+import hashlib
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Iterable, List, Optional, Tuple
 
-# Document loading & splitting (langchain community loaders)
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_text_splitters import RecursiveCharacterTextSplitter
+# Heavy dependencies (langchain loaders, sentence_transformers, chromadb) are
+# imported where they are first used, so importing this module stays cheap
+# and the app can start serving /healthz before the model is loaded.
 
-# SentenceTransformers embeddings
-from sentence_transformers import SentenceTransformer
+# BM25 keyword index for the lexical half of hybrid search
+from .lexical_index import BM25Index, reciprocal_rank_fusion
+from . import telemetry
+
+EMBED_CACHE_SIZE = int(os.getenv("RAG_EMBED_CACHE_SIZE", "2048"))
+RESULT_CACHE_SIZE = int(os.getenv("RAG_RESULT_CACHE_SIZE", "1024"))
+EMBED_BATCH_SIZE = int(os.getenv("RAG_EMBED_BATCH_SIZE", "32"))
+EMBED_BATCH_WAIT_MS = float(os.getenv("RAG_EMBED_BATCH_WAIT_MS", "2"))
+INGEST_BATCH_SIZE = int(os.getenv("RAG_INGEST_BATCH_SIZE", "64"))
+HYBRID_ENABLED = os.getenv("RAG_HYBRID", "1") == "1"
+HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+VECTOR_STORE = os.getenv("RAG_VECTOR_STORE", "chroma")  # chroma | mmap
+# One collection (and BM25 index) per owner instead of metadata filtering
+TENANT_COLLECTIONS = os.getenv("RAG_TENANT_COLLECTIONS", "0") == "1"
+
+
+def normalize_query(text: str) -> str:
+    """Cache key for a query: case, whitespace and trailing punctuation folded."""
+    return re.sub(r"\s+", " ", text.strip().lower()).rstrip("?!. ")
+
+
+def file_hash(path: str) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def chunk_id(text: str, owner: str = "", doc: str = "") -> str:
+    """Stable, content-addressed chunk id. Owners never share chunks, so the
+    owner is part of the hash (and ownerless ids keep their old values).
+    With `doc`, the id is also per document: each document stores its own
+    copy of a chunk, so listing, scoping and deleting never see another
+    document's chunks. Without it, the id is the chunk's text hash."""
+    key = f"{owner}\x00{text}" if owner else text
+    if doc:
+        key = f"{doc}\x00{key}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+
+
+def iter_pdf_pages(file_path: str, chunk_size: int = 800, chunk_overlap: int = 200):
+    """Parse a PDF lazily, yielding (1-based page number, [chunk texts]) per page."""
+    # Document loading & splitting (langchain community loaders)
+    from langchain_community.document_loaders import PyPDFLoader
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+    loader = PyPDFLoader(file_path)
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    for i, page in enumerate(loader.lazy_load()):
+        chunks = [c.page_content for c in text_splitter.split_documents([page])]
+        yield int(page.metadata.get("page", i)) + 1, chunks
+
+
+def scope_where(scope: Optional[dict]) -> Optional[dict]:
+    """
+    Metadata filter for a retrieval scope. A scope is {"owner": ...} and/or
+    {"doc_id": ...}; documents are namespaced by owner, so a doc_id without
+    an owner means a shared (ownerless) document. None searches everything.
+    """
+    if not scope:
+        return None
+    clauses = [{"owner": scope.get("owner") or ""}]
+    if scope.get("doc_id"):
+        clauses.append({"doc_hash": scope["doc_id"]})
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+
+class LRUCache:
+    """Small thread-safe LRU with hit/miss counters."""
+
+    def __init__(self, maxsize: int = 1024):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+class EmbeddingBatcher:
+    """
+    Micro-batches concurrent query encodes into one model.encode call.
+
+    Callers block on their own Future; a single dispatcher thread takes the
+    first pending text, gathers whatever else arrives within `max_wait_ms` (or
+    until `max_batch` items), encodes them together and fans the vectors back.
+    Requests that pile up while a batch is encoding go out in the next batch.
+    """
+
+    def __init__(self, model, max_batch: int = EMBED_BATCH_SIZE, max_wait_ms: float = EMBED_BATCH_WAIT_MS):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self.batches = 0
+        self.items = 0
+        self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text: str) -> Future:
+        fut = Future()
+        self._queue.put((text, fut))
+        return fut
+
+    def encode(self, text: str) -> List[float]:
+        return self.submit(text).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            texts = [t for t, _ in batch]
+            try:
+                vectors = self.model.encode(texts, batch_size=len(texts))
+                for (_, fut), vec in zip(batch, vectors):
+                    fut.set_result(vec.tolist() if hasattr(vec, "tolist") else list(vec))
+            except Exception as e:
+                for _, fut in batch:
+                    fut.set_exception(e)
+            self.batches += 1
+            self.items += len(batch)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": round(self.items / self.batches, 2) if self.batches else 0.0,
+        }
 
-# Chroma DB (persistent)
-import chromadb
-from chromadb.config import Settings
 
 class RAGIndex:
-    def __init__(self, persist_dir: str = "tmp_uploads/chroma_db", model_name: str = "all-MiniLM-L6-v2"):
+    def __init__(self, persist_dir: str = "tmp_uploads/chroma_db", model_name: str = "all-MiniLM-L6-v2", model=None,
+                 vector_store: Optional[str] = None):
         self.persist_dir = persist_dir
         os.makedirs(self.persist_dir, exist_ok=True)
 
-        # Sentence transformer for embeddings
-        self.model = SentenceTransformer(model_name)
+        # Retrieval caches. Results are keyed by index version, so bumping the
+        # version in load_pdf/clear invalidates them without polling Chroma.
+        self._embed_cache = LRUCache(EMBED_CACHE_SIZE)
+        self._result_cache = LRUCache(RESULT_CACHE_SIZE)
+        # Top-1 similarity per (query, version, scope), filled by dense
+        # searches so routing doesn't repeat one retrieval already ran
+        self._relevance_cache = LRUCache(RESULT_CACHE_SIZE)
+        self._version_lock = threading.Lock()
+        self.version = 0
+        self._count = None
 
-        # Use persistent client so DB is stored on disk
-        try:
-            # When using persistent client, pass path
-            self.client = chromadb.PersistentClient(path=self.persist_dir)
-        except Exception:
-            # fallback to regular client (some installations)
-            self.client = chromadb.Client(Settings(path=self.persist_dir))
+        # Embedding backend (RAG_EMBED_BACKEND: torch / torch-int8 / onnx /
+        # onnx-int8); any object with a compatible encode() can be passed
+        # instead (the benchmarks use a fake one)
+        if model is None:
+            from .embeddings import load_backend
+            cache_dir = os.getenv("RAG_MODEL_CACHE", os.path.join(os.path.dirname(os.path.abspath(self.persist_dir)), "models"))
+            model = load_backend(model_name=model_name, cache_dir=cache_dir)
+        self.model = model
+        # Query encodes from concurrent requests share batched encode calls
+        self._batcher = EmbeddingBatcher(self.model)
+
+        # Vector store: Chroma by default, or the in-process memory-mapped
+        # store (RAG_VECTOR_STORE=mmap), which speaks the same collection API
+        self.vector_store = vector_store or VECTOR_STORE
+        self.client = None
+        self.collection = self._open_collection()
+        # Per-owner (collection, lexical index) pairs, opened on first use
+        # when RAG_TENANT_COLLECTIONS=1
+        self._tenants = {}
+        self._tenant_lock = threading.Lock()
+
+        self._count = self._collection_count()
+
+        # Lexical index lives next to Chroma; backfill it once for collections
+        # indexed before it existed.
+        self.lexical = BM25Index(os.path.join(self.persist_dir, "lexical.db"))
+        if self._count and not len(self.lexical):
+            self._backfill_lexical()
+
+    def _open_collection(self, name: str = "docs"):
+        if self.vector_store == "mmap":
+            from .vector_store import MmapCollection
+            return MmapCollection(os.path.join(self.persist_dir, "vectors" if name == "docs" else name))
+        if self.vector_store != "chroma":
+            raise ValueError(f"Unknown vector store {self.vector_store!r}; expected chroma or mmap")
+
+        # Chroma DB (persistent)
+        import chromadb
+        from chromadb.config import Settings
+
+        if self.client is None:
+            # Use persistent client so DB is stored on disk
+            try:
+                # When using persistent client, pass path
+                self.client = chromadb.PersistentClient(path=self.persist_dir)
+            except Exception:
+                # fallback to regular client (some installations)
+                self.client = chromadb.Client(Settings(path=self.persist_dir))
 
         # Create / get collection
         try:
-            self.collection = self.client.get_or_create_collection(name="docs")
+            return self.client.get_or_create_collection(name=name)
         except Exception:
             # Some chroma versions use create_collection
+            return self.client.create_collection(name=name)
+
+    def _partition(self, owner: Optional[str]):
+        """(collection, lexical index) holding `owner`'s chunks: the shared
+        pair unless per-owner collections are enabled."""
+        if not (TENANT_COLLECTIONS and owner):
+            return self.collection, self.lexical
+        return self._tenant(hashlib.sha256(owner.encode("utf-8")).hexdigest()[:16])
+
+    def _tenant(self, suffix: str):
+        with self._tenant_lock:
+            part = self._tenants.get(suffix)
+            if part is None:
+                part = (self._open_collection(f"docs_{suffix}"),
+                        BM25Index(os.path.join(self.persist_dir, f"lexical_{suffix}.db")))
+                self._tenants[suffix] = part
+            return part
+
+    def _all_partitions(self):
+        """The shared partition plus every per-owner one on disk."""
+        parts = [(self.collection, self.lexical)]
+        if TENANT_COLLECTIONS:
+            for name in sorted(os.listdir(self.persist_dir)):
+                m = re.fullmatch(r"lexical_([0-9a-f]{16})\.db", name)
+                if m:
+                    parts.append(self._tenant(m.group(1)))
+        return parts
+
+    def _backfill_lexical(self, page: int = 1000):
+        offset = 0
+        while True:
             try:
-                self.collection = self.client.create_collection(name="docs")
+                res = self.collection.get(include=["documents", "metadatas"], limit=page, offset=offset)
             except Exception as e:
-                raise
+                print("⚠️ Lexical backfill failed:", e)
+                return
+            ids = res.get("ids") or []
+            if not ids:
+                return
+            groups = {}
+            for cid, text, meta in zip(ids, res.get("documents") or [], res.get("metadatas") or [{}] * len(ids)):
+                meta = meta or {}
+                group = groups.setdefault((meta.get("owner", ""), meta.get("doc_hash", "")), ([], []))
+                group[0].append(cid)
+                group[1].append(text)
+            for (owner, doc), (group_ids, texts) in groups.items():
+                self.lexical.add(group_ids, texts, owner=owner, doc=doc)
+            offset += len(ids)
+
+    def warm_up(self):
+        """Run one encode and one retrieval so the first real query doesn't
+        pay for lazy weight init, thread pools or Chroma's first open."""
+        self.model.encode(["warm up"])
+        self._batcher.encode("warm up")
+        if self.count():
+            self._dense_query("warm up", "", 1)
+
+    def _bump_version(self):
+        # Refresh the count once per write so reads never have to ask Chroma
+        with self._version_lock:
+            self.version += 1
+            self._count = self._collection_count()
 
-    def load_pdf(self, file_path: str):
+    def load_pdf(self, file_path: str, progress=None, batch_size: int = INGEST_BATCH_SIZE, source: Optional[str] = None,
+                 owner: str = "", replaces: Optional[str] = None):
         """
         Load a PDF, split into chunks, embed, and add to Chroma.
+
+        Runs as a pipeline: pages are parsed lazily and split one at a time,
+        chunks are embedded in fixed-size batches and each batch is added to
+        the collection as soon as it is ready. `progress`, if given, is called
+        with keyword counters (pages, chunks) after every page and batch, and
+        once up front with the document id (doc_id).
+
+        Ingestion is content-addressed: chunk ids are hashes of the document
+        hash and chunk text, and every chunk carries the document hash, its
+        text hash (`chunk_hash`, so text already embedded for any document
+        is not embedded again) and `source` name. A file
+        whose hash finished indexing is skipped without parsing; otherwise
+        only chunks not yet in the collection are embedded. A document only
+        counts as indexed once all its chunks are stored, so an interrupted
+        ingest resumes (re-embedding nothing) on the next upload.
+        Documents with the same `source` name are independent. To update
+        one, pass its document id as `replaces`; it is deleted once the new
+        version is completely indexed.
+        Chunks also carry their page number and `owner`, which queries can be
+        scoped to (see scope_where); the document id is the file hash.
+        Returns the number of chunks newly embedded.
         """
-        loader = PyPDFLoader(file_path)
-        docs = loader.load()
-        if not docs:
-            print("⚠️ No pages found in PDF:", file_path)
-            return
+        basename = os.path.basename(file_path)
+        source = source or basename
+        owner = owner or ""
+        doc_hash = file_hash(file_path)
+        if progress:
+            progress(pages=0, chunks=0, doc_id=doc_hash)
+        if self._has_document(doc_hash, owner):
+            print(f"⏭️ Already indexed, skipping: {source}")
+            if replaces and replaces != doc_hash:
+                self.delete_document(replaces, owner)
+            return 0
+
+        meta = {"source": source, "doc_hash": doc_hash, "owner": owner}
+
+        pages = 0
+        chunks_done = 0
+        seen = OrderedDict()  # chunk id -> (text, metadata), for every chunk in this document
+        pending = []
+        try:
+            for page_no, texts in iter_pdf_pages(file_path):
+                pages += 1
+                page_meta = dict(meta, page=page_no)
+                for text in texts:
+                    cid = chunk_id(text, owner, doc_hash)
+                    if cid in seen:
+                        continue
+                    seen[cid] = (text, dict(page_meta, chunk_hash=chunk_id(text, owner)))
+                    pending.append(cid)
+                    if len(pending) >= batch_size:
+                        chunks_done += self._add_new(pending, seen, owner)
+                        pending = []
+                        if progress:
+                            progress(pages=pages, chunks=chunks_done)
+                if progress:
+                    progress(pages=pages, chunks=chunks_done)
 
-        text_splitter = RecursiveCharacterTextSplitter(chunk_size=800, chunk_overlap=200)
-        chunks = text_splitter.split_documents(docs)
+            if pending:
+                chunks_done += self._add_new(pending, seen, owner)
+                if progress:
+                    progress(pages=pages, chunks=chunks_done)
 
-        ids, texts = [], []
-        for i, c in enumerate(chunks):
-            ids.append(f"{os.path.basename(file_path)}_{i}")
-            texts.append(c.page_content)
+            if seen:
+                self._complete_document(seen, owner, [replaces] if replaces else ())
+        finally:
+            self._bump_version()
 
-        if not texts:
+        if not pages:
+            print("⚠️ No pages found in PDF:", file_path)
+        elif not seen:
             print("⚠️ No text chunks extracted:", file_path)
-            return
+        else:
+            print(f"✅ Indexed {chunks_done} new of {len(seen)} chunks from {source}")
+        return chunks_done
+
+    def _has_document(self, doc_hash: str, owner: str = "") -> bool:
+        """Whether the document finished indexing (see _complete_document); the
+        chunks of an interrupted ingest alone do not count."""
+        _, lexical = self._partition(owner)
+        try:
+            return lexical.is_complete(owner, doc_hash)
+        except Exception:
+            return False
 
-        # compute embeddings in batch
-        embeddings = self.model.encode(texts).tolist()
+    def _existing_ids(self, ids: List[str], owner: str = "") -> set:
+        collection, _ = self._partition(owner)
+        try:
+            return set(collection.get(ids=ids, include=[]).get("ids") or [])
+        except Exception:
+            return set()
+
+    def _add_new(self, ids: List[str], chunks: dict, owner: str = "") -> int:
+        # Skip chunks this document already stored (an interrupted earlier run)
+        existing = self._existing_ids(ids, owner)
+        new_ids = [i for i in ids if i not in existing]
+        if not new_ids:
+            return 0
+        return self._add_batch(new_ids, [chunks[i][0] for i in new_ids], [dict(chunks[i][1]) for i in new_ids], owner)
+
+    def _complete_document(self, chunks: dict, owner: str = "", replaces: Iterable[str] = ()):
+        """Mark a document whose chunks are all stored as completely indexed,
+        then delete the earlier versions it `replaces` (document ids). On
+        failure it stays unmarked and is retried on the next ingest."""
+        _, lexical = self._partition(owner)
+        doc_hash = next(iter(chunks.values()))[1]["doc_hash"]
+        try:
+            lexical.mark_complete(owner, doc_hash)
+            for old in replaces:
+                if old and old != doc_hash:
+                    self._delete_chunks(old, owner)
+        except Exception as e:
+            print("⚠️ Could not complete document", doc_hash, e)
+
+    @telemetry.traced("rag_ingest_batch")
+    def _add_batch(self, ids: List[str], texts: List[str], metadatas: Optional[List[dict]] = None, owner: str = "") -> int:
+        collection, lexical = self._partition(owner)
+        # Identical text embeds the same wherever it appears: reuse vectors
+        # already stored (by any document) and encode each new text once
+        keys = [(m or {}).get("chunk_hash") or cid for cid, m in zip(ids, metadatas or [None] * len(ids))]
+        vectors = self._stored_embeddings(collection, keys) if metadatas else {}
+        todo = OrderedDict()  # key -> text still to encode
+        for key, text in zip(keys, texts):
+            if key not in vectors:
+                todo.setdefault(key, text)
+        if todo:
+            # compute embeddings in batch
+            encoded = self.model.encode(list(todo.values()), batch_size=len(todo)).tolist()
+            vectors.update(zip(todo, encoded))
+        embeddings = [vectors[key] for key in keys]
         # add to collection
         try:
-            self.collection.add(ids=ids, embeddings=embeddings, documents=texts)
-            print(f"✅ Indexed {len(texts)} chunks from {os.path.basename(file_path)}")
+            collection.add(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
         except Exception as e:
             print("❌ Failed to add to chroma:", e)
-            # try recreate collection and add
-            try:
-                self.collection = self.client.get_or_create_collection(name="docs")
-                self.collection.add(ids=ids, embeddings=embeddings, documents=texts)
-            except Exception as e2:
+            if collection is not self.collection:
                 raise
+            # try recreate collection and add
+            self.collection = collection = self._open_collection()
+            collection.add(ids=ids, embeddings=embeddings, documents=texts, metadatas=metadatas)
+        # Bulk ingest batches span documents: tag lexical entries per document
+        groups = OrderedDict()
+        for cid, text, meta in zip(ids, texts, metadatas or [None] * len(ids)):
+            group = groups.setdefault((meta or {}).get("doc_hash", ""), ([], []))
+            group[0].append(cid)
+            group[1].append(text)
+        for doc, (group_ids, group_texts) in groups.items():
+            lexical.add(group_ids, group_texts, owner=owner, doc=doc)
+        return len(texts)
+
+    @staticmethod
+    def _stored_embeddings(collection, hashes: List[str]) -> dict:
+        """Stored vectors for these chunk text hashes, {chunk_hash: embedding}."""
+        hashes = list(OrderedDict.fromkeys(hashes))
+        found = {}
+        try:
+            res = collection.get(where={"chunk_hash": {"$in": hashes}}, include=["metadatas", "embeddings"])
+            embs = res.get("embeddings")
+            for meta, emb in zip(res.get("metadatas") or [], [] if embs is None else embs):
+                if emb is not None:
+                    found.setdefault(meta["chunk_hash"], [float(x) for x in emb])
+            # Chunks stored before per-document ids have their text hash as id
+            missing = [h for h in hashes if h not in found]
+            if missing:
+                res = collection.get(ids=missing, include=["embeddings"])
+                embs = res.get("embeddings")
+                for cid, emb in zip(res.get("ids") or [], [] if embs is None else embs):
+                    if emb is not None:
+                        found[cid] = [float(x) for x in emb]
+        except Exception as e:
+            print("⚠️ Could not look up stored embeddings, encoding all:", e)
+            return {}
+        return found
+
+    def _embed_query(self, query_text: str, key: str) -> List[float]:
+        emb = self._embed_cache.get(key)
+        if emb is None:
+            with telemetry.span("rag_embed"):
+                emb = self._batcher.encode(query_text)
+            self._embed_cache.put(key, emb)
+        return emb
+
+    def embed_query(self, query_text: str) -> List[float]:
+        """Query embedding, shared with `query` through the embedding cache."""
+        return self._embed_query(query_text, normalize_query(query_text))
+
+    def embed_queries(self, query_texts: List[str]) -> List[List[float]]:
+        """Embeddings for many queries; the cache misses share one encode call."""
+        keys = [normalize_query(t) for t in query_texts]
+        vectors = [self._embed_cache.get(k) for k in keys]
+        missing = OrderedDict()  # key -> text, each distinct query encoded once
+        for text, key, vec in zip(query_texts, keys, vectors):
+            if vec is None:
+                missing.setdefault(key, text)
+        if missing:
+            with telemetry.span("rag_embed"):
+                encoded = self.model.encode(list(missing.values()), batch_size=min(len(missing), INGEST_BATCH_SIZE))
+            fresh = {}
+            for key, vec in zip(missing, encoded):
+                fresh[key] = vec.tolist() if hasattr(vec, "tolist") else list(vec)
+                self._embed_cache.put(key, fresh[key])
+            vectors = [vec if vec is not None else fresh[key] for key, vec in zip(keys, vectors)]
+        return vectors
+
+    def relevance(self, query_text: str, scope: Optional[dict] = None) -> float:
+        """Cosine similarity of the closest chunk in scope (0.0 if none).
+        Distances are squared L2 between unit vectors, so cos = 1 - d/2."""
+        if not self.count(scope):
+            return 0.0
+        key = normalize_query(query_text)
+        rel_key = (key, self.version, tuple(sorted(scope.items())) if scope else None)
+        cached = self._relevance_cache.get(rel_key)
+        if cached is not None:
+            return cached
+        hits = self._dense_query(query_text, key, 1, scope)
+        rel = 1.0 - hits[0][2] / 2.0 if hits else 0.0
+        self._relevance_cache.put(rel_key, rel)
+        return rel
+
+    def query(self, query_text: str, top_k: int = 3, scope: Optional[dict] = None) -> List[Tuple[str, float]]:
+        """
+        Hybrid search: dense Chroma hits and BM25 keyword hits fused by
+        reciprocal rank. Returns list of (document_text, score), best first.
+        With RAG_HYBRID=0 this is plain dense search and score is the distance.
 
-    def query(self, query_text: str, top_k: int = 3) -> List[Tuple[str, float]]:
+        `scope` ({"owner": ..., "doc_id": ...}) restricts both searches to
+        that owner's chunks (or one of their documents); the filter is applied
+        by the stores before ranking, not to the results.
         """
-        Query vector DB for semantic matches. Returns list of (document_text, distance/score).
+        n_scope = self.count(scope)
+        if not n_scope:
+            return []
+
+        key = normalize_query(query_text)
+        version = self.version
+        scope_key = tuple(sorted(scope.items())) if scope else None
+        cached = self._result_cache.get((key, top_k, version, scope_key))
+        if cached is not None:
+            return list(cached)
+
+        n_dense = max(top_k, HYBRID_CANDIDATES) if HYBRID_ENABLED else top_k
+        dense = self._dense_query(query_text, key, min(n_dense, n_scope), scope)
+        return self._finish_query(query_text, key, dense, top_k, version, scope, scope_key)
+
+    def query_batch(self, query_texts: List[str], top_k: int = 3,
+                    scope: Optional[dict] = None) -> List[List[Tuple[str, float]]]:
         """
-        try:
-            if not self.collection.count():
-                return []
-        except Exception:
-            # If collection.count isn't implemented, attempt a query and catch empty
-            pass
+        `query` for many texts at once, results in input order. Queries not
+        in the result cache are embedded in one encode call and searched with
+        one multi-query collection call; BM25 fusion is still per query.
+        """
+        n_scope = self.count(scope)
+        if not n_scope:
+            return [[] for _ in query_texts]
+
+        version = self.version
+        scope_key = tuple(sorted(scope.items())) if scope else None
+        keys = [normalize_query(t) for t in query_texts]
+        results = [self._result_cache.get((key, top_k, version, scope_key)) for key in keys]
+        todo = OrderedDict()  # key -> text of the queries still to search
+        for text, key, cached in zip(query_texts, keys, results):
+            if cached is None:
+                todo.setdefault(key, text)
+
+        fresh = {}
+        if todo:
+            texts = list(todo.values())
+            n_dense = max(top_k, HYBRID_CANDIDATES) if HYBRID_ENABLED else top_k
+            dense_rows = self._dense_search(self.embed_queries(texts), min(n_dense, n_scope), scope)
+            for key, text, dense in zip(todo, texts, dense_rows):
+                fresh[key] = self._finish_query(text, key, dense, top_k, version, scope, scope_key)
+        return [list(cached) if cached is not None else list(fresh[key]) for key, cached in zip(keys, results)]
+
+    def _finish_query(self, query_text: str, key: str, dense: List[Tuple[str, str, float]], top_k: int,
+                      version: int, scope: Optional[dict], scope_key) -> List[Tuple[str, float]]:
+        if dense:
+            self._relevance_cache.put((key, version, scope_key), 1.0 - dense[0][2] / 2.0)
+        if HYBRID_ENABLED:
+            pairs = self._fuse(query_text, dense, top_k, scope)
+        else:
+            pairs = [(doc, dist) for _, doc, dist in dense][:top_k]
+        # filter low-similarity (optional): if distance metric is large = dissimilar (depends on chroma settings)
+        # keep as-is and let agent decide
+        self._result_cache.put((key, top_k, version, scope_key), tuple(pairs))
+        return pairs
+
+    def _dense_query(self, query_text: str, key: str, n_results: int,
+                     scope: Optional[dict] = None) -> List[Tuple[str, str, float]]:
+        """Vector search. Returns [(chunk_id, document_text, distance)]."""
+        return self._dense_search([self._embed_query(query_text, key)], n_results, scope)[0]
 
-        q_emb = self.model.encode([query_text]).tolist()
+    def _dense_search(self, q_embs: List[List[float]], n_results: int,
+                      scope: Optional[dict] = None) -> List[List[Tuple[str, str, float]]]:
+        """One collection query for a list of query vectors; hits per vector."""
+        collection, _ = self._partition(scope.get("owner") if scope else None)
+        kwargs = {"where": scope_where(scope)} if scope else {}
         try:
-            results = self.collection.query(query_embeddings=q_emb, n_results=top_k)
+            with telemetry.span("rag_dense"):
+                results = collection.query(query_embeddings=q_embs, n_results=n_results, **kwargs)
         except Exception as e:
             # Some versions return dict differently; try alternate call
             try:
-                results = self.collection.query(query_embeddings=q_emb, top_k=top_k)
+                results = collection.query(query_embeddings=q_embs, top_k=n_results, **kwargs)
             except Exception:
-                return []
+                return [[] for _ in q_embs]
 
-        # results typically has "documents" and "distances"
-        documents = results.get("documents", [[]])[0] if isinstance(results, dict) else (results["documents"][0] if "documents" in results else [])
-        distances = results.get("distances", [[]])[0] if isinstance(results, dict) else (results["distances"][0] if "distances" in results else [])
+        return [self._hits(results, i) for i in range(len(q_embs))]
 
-        pairs = []
+    @staticmethod
+    def _hits(results, row: int) -> List[Tuple[str, str, float]]:
+        def column(name):
+            cols = results.get(name) if isinstance(results, dict) else (results[name] if name in results else None)
+            return cols[row] if cols and row < len(cols) and cols[row] is not None else []
+
+        # results typically has "ids", "documents" and "distances"
+        ids = column("ids")
+        documents = column("documents")
+        distances = column("distances")
+
+        hits = []
+        seen = set()
         for i, doc in enumerate(documents):
+            # Each document stores its own copy of a shared chunk
+            if doc in seen:
+                continue
+            seen.add(doc)
             try:
                 dist = distances[i] if i < len(distances) else 0.0
             except Exception:
                 dist = 0.0
-            pairs.append((doc, float(dist)))
-        # filter low-similarity (optional): if distance metric is large = dissimilar (depends on chroma settings)
-        # keep as-is and let agent decide
+            cid = ids[i] if i < len(ids) else chunk_id(doc)
+            hits.append((cid, doc, float(dist)))
+        return hits
+
+    def _fuse(self, query_text: str, dense: List[Tuple[str, str, float]], top_k: int,
+              scope: Optional[dict] = None) -> List[Tuple[str, float]]:
+        owner = scope.get("owner") or "" if scope else None
+        _, index = self._partition(owner)
+        with telemetry.span("rag_lexical"):
+            lexical = index.search(query_text, top_k=max(top_k, HYBRID_CANDIDATES), owner=owner,
+                                   doc=scope.get("doc_id") if scope else None)
+        texts = {cid: doc for cid, doc, _ in dense}
+        fused = reciprocal_rank_fusion([[cid for cid, _, _ in dense], [cid for cid, _ in lexical]], k=RRF_K)[:top_k]
+        missing = [cid for cid, _ in fused if cid not in texts]
+        texts.update(index.get_texts(missing))
+
+        pairs, seen = [], set()
+        for cid, score in fused:
+            doc = texts.get(cid)
+            if doc is None or doc in seen:
+                continue
+            seen.add(doc)
+            pairs.append((doc, score))
         return pairs
 
-    def count(self) -> int:
+    def count(self, scope: Optional[dict] = None) -> int:
+        """Chunk count, tracked locally and refreshed whenever the version
+        bumps. With a scope, the count comes from the lexical index's
+        in-memory owner/document tallies."""
+        if scope:
+            owner = scope.get("owner") or ""
+            _, index = self._partition(owner)
+            return index.count(owner, scope.get("doc_id"))
+        if self._count is None:
+            self._count = self._collection_count()
+        return self._count
+
+    def list_documents(self, owner: Optional[str] = None) -> List[dict]:
+        """Documents in the index (all of them, or one owner's), one entry per
+        document id with its source name, chunk count and page count."""
+        parts = self._all_partitions() if owner is None else [self._partition(owner)]
+        where = {"owner": owner} if owner is not None else None
+        docs = {}
+        for collection, _ in parts:
+            res = collection.get(where=where, include=["metadatas"])
+            for meta in res.get("metadatas") or []:
+                meta = meta or {}
+                key = (meta.get("owner", ""), meta.get("doc_hash", ""))
+                doc = docs.get(key)
+                if doc is None:
+                    doc = docs[key] = {"doc_id": key[1], "owner": key[0], "source": meta.get("source"), "chunks": 0, "pages": 0}
+                doc["chunks"] += 1
+                doc["pages"] = max(doc["pages"], int(meta.get("page") or 0))
+        return sorted(docs.values(), key=lambda d: (d["owner"], d["source"] or ""))
+
+    def delete_document(self, doc_id: str, owner: str = "") -> int:
+        """Remove one document's chunks from both indexes. Returns the number
+        of chunks deleted."""
+        try:
+            deleted = self._delete_chunks(doc_id, owner)
+        finally:
+            self._bump_version()
+        if deleted:
+            print(f"🗑️ Deleted {deleted} chunks of document {doc_id}")
+        return deleted
+
+    def _delete_chunks(self, doc_id: str, owner: str = "") -> int:
+        collection, lexical = self._partition(owner)
+        ids = collection.get(where=scope_where({"owner": owner, "doc_id": doc_id}), include=[]).get("ids") or []
+        if ids:
+            collection.delete(ids=ids)
+            lexical.remove(ids)
+        lexical.unmark(owner, [doc_id])
+        return len(ids)
+
+    def cache_stats(self) -> dict:
+        return {
+            "index_version": self.version,
+            "vector_store": self.vector_store,
+            "count": self.count(),
+            "lexical_count": len(self.lexical),
+            "embedding_cache": self._embed_cache.stats(),
+            "result_cache": self._result_cache.stats(),
+            "embedding_batches": self._batcher.stats(),
+        }
+
+    def _collection_count(self) -> int:
         try:
             return int(self.collection.count())
         except Exception:
@@ -123,11 +758,25 @@ class RAGIndex:
                 return 0
 
     def clear(self):
+        self.collection = self._empty_collection(self.collection, "docs")
+        self.lexical.clear()
+        self._all_partitions()  # open per-owner partitions that are only on disk
+        with self._tenant_lock:
+            for suffix, (collection, lexical) in list(self._tenants.items()):
+                self._tenants[suffix] = (self._empty_collection(collection, f"docs_{suffix}"), lexical)
+                lexical.clear()
+        self._result_cache.clear()
+        self._relevance_cache.clear()
+        self._bump_version()
+
+    def _empty_collection(self, collection, name: str):
         try:
-            self.collection.delete(where={})
+            collection.delete(where={})
         except Exception:
             # fallback: recreate
             try:
-                self.client.delete_collection(name="docs")
+                self.client.delete_collection(name=name)
+                return self._open_collection(name)
             except Exception:
                 pass
+        return collection
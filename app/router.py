@@ -0,0 +1,132 @@
+# router.py — embedding-based tool routing
+"""
+Decides which tools a turn needs, replacing keyword matching.
+
+The message is embedded once with the RAG index's model (the vector is cached
+and reused by retrieval) and compared with a few precomputed prototype
+phrases per intent. Each tool is then gated on its own evidence:
+
+  rag     documents exist in scope and either the best chunk is similar
+          enough to the message (a top-1 dense lookup) or the message is
+          clearly about the user's documents
+  search  "web" is the strongest intent, or the user explicitly asks to
+          search, and the documents do not already answer it
+  memory  the message is about the user / things they told us
+  math    the message parses as an arithmetic expression
+
+Every decision is logged with its scores so thresholds can be tuned from
+logs. Set AGENT_ROUTER=keyword to go back to the old keyword planner.
+"""
+import logging
+import os
+import re
+import threading
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+from . import telemetry
+
+logger = logging.getLogger(__name__)
+
+ROUTER_MODE = os.getenv("AGENT_ROUTER", "embedding")  # embedding | keyword
+RAG_MIN_SIM = float(os.getenv("ROUTER_RAG_MIN_SIM", "0.35"))
+DOCS_INTENT_MIN = float(os.getenv("ROUTER_DOCS_INTENT_MIN", "0.5"))
+SEARCH_INTENT_MIN = float(os.getenv("ROUTER_SEARCH_INTENT_MIN", "0.45"))
+MEMORY_INTENT_MIN = float(os.getenv("ROUTER_MEMORY_INTENT_MIN", "0.5"))
+
+INTENT_PROTOTYPES: Dict[str, Tuple[str, ...]] = {
+    "docs": (
+        "summarize the uploaded document",
+        "what does the pdf say about this",
+        "according to my resume what are my skills",
+        "list the projects mentioned in the file",
+        "what experience is described in the document",
+        "find the section of the report about the budget",
+    ),
+    "search": (
+        "what is the latest news today",
+        "search the web for this",
+        "who won the game last night",
+        "what is the current price of bitcoin",
+        "look up recent information online",
+        "what is the weather forecast this week",
+    ),
+    "memory": (
+        "what is my name",
+        "do you remember what I told you",
+        "who is my teacher",
+        "what is my friend's name",
+        "remember that I like python",
+        "what do you know about me",
+    ),
+    "chitchat": (
+        "hello how are you",
+        "thanks that was helpful",
+        "tell me a joke",
+        "good morning",
+        "explain how recursion works",
+        "write a short poem about autumn",
+    ),
+}
+
+_EXPLICIT_SEARCH = re.compile(r"\b(search|google|look\s*up|browse|latest|news)\b", re.I)
+_EXPLICIT_MEMORY = re.compile(r"\b(my name|remember|about me|my (friend|teacher|profile))\b", re.I)
+
+
+class ToolRouter:
+    """Prototype-similarity router over an already-loaded RAGIndex."""
+
+    def __init__(self, prototypes: Dict[str, Tuple[str, ...]] = INTENT_PROTOTYPES):
+        self.prototypes = prototypes
+        self._matrices: Dict[int, Dict[str, np.ndarray]] = {}  # id(model) -> intent -> unit vectors
+        self._lock = threading.Lock()
+
+    def _intent_vectors(self, rag_index) -> Dict[str, np.ndarray]:
+        key = id(rag_index.model)
+        vectors = self._matrices.get(key)
+        if vectors is None:
+            with self._lock:
+                vectors = self._matrices.get(key)
+                if vectors is None:
+                    vectors = {}
+                    for intent, phrases in self.prototypes.items():
+                        m = np.asarray(rag_index.model.encode(list(phrases)), dtype=np.float32)
+                        vectors[intent] = m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+                    self._matrices[key] = vectors
+        return vectors
+
+    def intent_scores(self, rag_index, user_text: str) -> Dict[str, float]:
+        q = np.asarray(rag_index.embed_query(user_text), dtype=np.float32)
+        q = q / max(float(np.linalg.norm(q)), 1e-12)
+        return {intent: float(np.max(m @ q)) for intent, m in self._intent_vectors(rag_index).items()}
+
+    def route(self, user_text: str, rag_index, scope: Optional[dict] = None, math_ok: bool = False) -> dict:
+        with telemetry.span("route"):
+            scores = self.intent_scores(rag_index, user_text)
+            top_intent = max(scores, key=scores.get)
+
+            docs_exist = rag_index.count(scope) > 0
+            relevance = rag_index.relevance(user_text, scope) if docs_exist else 0.0
+            use_rag = docs_exist and (relevance >= RAG_MIN_SIM or
+                                      (top_intent == "docs" and scores["docs"] >= DOCS_INTENT_MIN))
+
+            explicit_search = bool(_EXPLICIT_SEARCH.search(user_text))
+            wants_web = top_intent == "search" and scores["search"] >= SEARCH_INTENT_MIN
+            use_search = explicit_search or (wants_web and not (use_rag and relevance >= RAG_MIN_SIM))
+
+            use_memory = bool(_EXPLICIT_MEMORY.search(user_text)) or scores["memory"] >= MEMORY_INTENT_MIN
+
+        tools = {"use_rag": use_rag, "use_memory": use_memory, "use_math": math_ok, "use_search": use_search}
+        logger.info(
+            "route %s: %s | intent=%s %s relevance=%.3f",
+            telemetry.request_id_var.get() or "-",
+            ",".join(k[len("use_"):] for k, v in tools.items() if v) or "none",
+            top_intent,
+            " ".join(f"{k}={v:.2f}" for k, v in scores.items()),
+            relevance,
+        )
+        return tools
+
+
+router = ToolRouter()
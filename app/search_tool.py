@@ -2,9 +2,27 @@
 """
 Minimal wrapper using ddgs or duckduckgo_search.
 Handles rate-limit gracefully and returns top results as list of dicts.
+
+Searches go through a small pipeline:
+  TTL cache (memory LRU, optional SQLite tier) -> token-bucket rate limiter
+  -> backend call bounded by a per-call deadline.
+Backends are pluggable (see set_backend / FakeSearchBackend for tests).
 """
-from typing import List, Dict
+from typing import Callable, List, Dict, Optional
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import json
+import math
+import os
+import sqlite3
+import threading
 import time
+import logging
+
+from . import telemetry
+from .rag_utils import normalize_query
+
+logger = logging.getLogger(__name__)
 
 # prefer ddgs if available
 try:
@@ -20,24 +38,251 @@ try:
 except Exception:
     DDG_FALLBACK = False
 
-def web_search(query: str, limit: int = 3, pause: float = 0.5) -> List[Dict]:
-    results = []
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "900"))
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+SEARCH_CACHE_DB = os.getenv("SEARCH_CACHE_DB")  # optional path for the SQLite tier
+SEARCH_RATE = float(os.getenv("SEARCH_RATE_PER_S", "2"))
+SEARCH_BURST = float(os.getenv("SEARCH_BURST", "4"))
+SEARCH_TIMEOUT = float(os.getenv("SEARCH_TIMEOUT_S", "4"))
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "4"))
+
+SEARCH_CALLS = telemetry.register(telemetry.Counter(
+    "nova_search_calls_total", "Web search backend calls by outcome", ("outcome",)))
+
+
+# ---------------------------------------------------------
+# Backends
+# ---------------------------------------------------------
+class SearchBackend:
+    name = "base"
+
+    def search(self, query: str, limit: int, timeout: Optional[float] = None) -> List[Dict]:
+        """`timeout` is the caller's remaining deadline in seconds; backends
+        that can bound their own HTTP calls should honour it."""
+        raise NotImplementedError
+
+
+class DDGSBackend(SearchBackend):
+    name = "ddgs"
+
+    def search(self, query: str, limit: int, timeout: Optional[float] = None) -> List[Dict]:
+        results = []
+        # A call still running past the deadline would keep its worker busy
+        with DDGS(**({"timeout": max(1, math.ceil(timeout))} if timeout else {})) as ddgs:
+            for r in ddgs.text(query, timelimit=10, output="json"):
+                # ddgs yields multiple; break at limit
+                results.append({"title": r.get("title"), "body": r.get("body"), "url": r.get("href")})
+                if len(results) >= limit:
+                    break
+        return results
+
+
+class DDGFallbackBackend(SearchBackend):
+    name = "duckduckgo_search"
+
+    def search(self, query: str, limit: int, timeout: Optional[float] = None) -> List[Dict]:
+        # The legacy ddg() call takes no timeout
+        res = ddg(query, max_results=limit) or []
+        return [{"title": r.get("title"), "body": r.get("body") or r.get("snippet"), "url": r.get("href")} for r in res]
+
+
+class FakeSearchBackend(SearchBackend):
+    """Offline backend for tests and benchmarks: canned results, optional delay."""
+    name = "fake"
+
+    def __init__(self, results: Optional[Callable[[str, int], List[Dict]]] = None, delay: float = 0.0):
+        self.results = results
+        self.delay = delay
+        self.calls = 0
+
+    def search(self, query: str, limit: int, timeout: Optional[float] = None) -> List[Dict]:
+        self.calls += 1
+        if self.delay:
+            time.sleep(self.delay)
+        if self.results:
+            return self.results(query, limit)[:limit]
+        return [{"title": f"Result {i + 1} for {query}", "body": f"Snippet about {query}.", "url": f"https://example.com/{i}"}
+                for i in range(limit)]
+
+
+def _default_backend() -> Optional[SearchBackend]:
+    if DDGS_AVAILABLE:
+        return DDGSBackend()
+    if DDG_FALLBACK:
+        return DDGFallbackBackend()
+    return None
+
+
+# ---------------------------------------------------------
+# Cache + rate limiter
+# ---------------------------------------------------------
+class TTLCache:
+    """In-memory LRU with per-entry expiry and an optional SQLite tier."""
+
+    def __init__(self, ttl: float = SEARCH_CACHE_TTL, maxsize: int = SEARCH_CACHE_SIZE, db_path: Optional[str] = SEARCH_CACHE_DB):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self._db = None
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS search_cache (key TEXT PRIMARY KEY, expires REAL, value TEXT)")
+            self._db.commit()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            item = self._data.get(key)
+            if item and item[0] > now:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return item[1]
+            if item:
+                del self._data[key]
+            if self._db is not None:
+                row = self._db.execute("SELECT expires, value FROM search_cache WHERE key=?", (key,)).fetchone()
+                if row and row[0] > now:
+                    value = json.loads(row[1])
+                    self._put_memory(key, row[0], value)
+                    self.hits += 1
+                    return value
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        expires = time.time() + self.ttl
+        with self._lock:
+            self._put_memory(key, expires, value)
+            if self._db is not None:
+                self._db.execute("INSERT OR REPLACE INTO search_cache (key, expires, value) VALUES (?, ?, ?)",
+                                 (key, expires, json.dumps(value)))
+                self._db.commit()
+
+    def _put_memory(self, key, expires, value):
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0}
+
+
+class TokenBucket:
+    """Allows `rate` calls per second with bursts of `capacity`; only waits when empty."""
+
+    def __init__(self, rate: float = SEARCH_RATE, capacity: float = SEARCH_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return True
+                wait = (1 - self._tokens) / self.rate if self.rate > 0 else timeout
+            if now + wait > deadline:
+                return False
+            time.sleep(wait)
+
+
+# ---------------------------------------------------------
+# Public API
+# ---------------------------------------------------------
+_backend = _default_backend()
+_cache = TTLCache()
+_bucket = TokenBucket()
+# Backend calls run here so a hung request can be abandoned at the deadline.
+# A call only starts once a worker is free (_slots), so new searches never
+# queue behind abandoned calls that are still running.
+_search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+_slots = threading.BoundedSemaphore(SEARCH_WORKERS)
+_abandoned_lock = threading.Lock()
+_abandoned = 0  # timed-out calls still holding a worker
+
+
+def set_backend(backend: Optional[SearchBackend]):
+    global _backend
+    _backend = backend
+
+
+def search_stats() -> dict:
+    return {"backend": _backend.name if _backend else None, "cache": _cache.stats(), "abandoned": _abandoned}
+
+
+def _run_search(backend: SearchBackend, query: str, limit: int, timeout: float) -> List[Dict]:
     try:
-        if DDGS_AVAILABLE:
-            with DDGS() as ddgs:
-                for r in ddgs.text(query, timelimit=10, output="json"):
-                    # ddgs yields multiple; break at limit
-                    results.append({"title": r.get("title"), "body": r.get("body"), "url": r.get("href")})
-                    if len(results) >= limit:
-                        break
-        elif DDG_FALLBACK:
-            res = ddg(query, max_results=limit)
-            for r in res:
-                results.append({"title": r.get("title"), "body": r.get("body") or r.get("snippet"), "url": r.get("href")})
+        return backend.search(query, limit, timeout=timeout)
+    finally:
+        _slots.release()
+
+
+def _release_abandoned(_future):
+    global _abandoned
+    with _abandoned_lock:
+        _abandoned -= 1
+
+
+def web_search(query: str, limit: int = 3, pause: float = 0.0, timeout: float = SEARCH_TIMEOUT) -> List[Dict]:
+    """
+    Cached, rate-limited search. Returns at most `limit` result dicts, [] when
+    no backend is available or the deadline passes, or a single
+    {"error": ...} entry if the backend failed. `pause` is kept for callers of
+    the old API and no longer used; pacing comes from the token bucket.
+    """
+    global _abandoned
+    if _backend is None:
+        return []
+
+    key = f"{_backend.name}|{limit}|{normalize_query(query)}"
+    cached = _cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    start = time.monotonic()
+    if not _bucket.acquire(timeout):
+        logger.warning("web_search rate limited past deadline: %r", query)
+        return []
+
+    if not _slots.acquire(timeout=max(0.0, timeout - (time.monotonic() - start))):
+        SEARCH_CALLS.inc("saturated")
+        logger.warning("web_search workers busy (%d abandoned calls) past deadline: %r", _abandoned, query)
+        return []
+    remaining = max(0.0, timeout - (time.monotonic() - start))
+    future = _search_pool.submit(_run_search, _backend, query, limit, remaining)
+    try:
+        results = future.result(timeout=remaining)
+    except FutureTimeout:
+        if future.cancel():
+            _slots.release()  # never started
         else:
-            return []
+            # Still running; its worker frees up when the backend gives up
+            with _abandoned_lock:
+                _abandoned += 1
+            future.add_done_callback(_release_abandoned)
+        SEARCH_CALLS.inc("timeout")
+        logger.warning("web_search timed out after %.1fs: %r", timeout, query)
+        return []
     except Exception as e:
+        SEARCH_CALLS.inc("error")
         # graceful fallback
         return [{"error": f"search_error: {str(e)}"}]
-    time.sleep(pause)
+    SEARCH_CALLS.inc("ok")
+
+    results = results[:limit]
+    _cache.put(key, results)
     return results
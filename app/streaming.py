@@ -0,0 +1,100 @@
+# streaming.py — response streaming helpers for /api/chat
+"""
+Token streams from the LLM are tiny (a few characters each). Writing every
+one to the socket costs a send per token on the server and a re-render per
+token in the browser, so `coalesce` merges them into frames: the first token
+goes out immediately (TTFT is what users notice), later ones are held for up
+to STREAM_FLUSH_MS or until STREAM_FLUSH_CHARS have piled up.
+
+`coalesce` also watches the client connection. When the client goes away it
+stops pulling from the agent and closes it, which cancels the pending LLM
+request instead of generating the rest of an answer nobody will read.
+
+`sse_frame` formats Server-Sent Events for the `text/event-stream` mode.
+"""
+import asyncio
+import json
+import os
+from typing import AsyncIterator, Optional, Tuple
+
+STREAM_FLUSH_MS = float(os.getenv("STREAM_FLUSH_MS", "30"))
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "256"))
+
+
+def sse_frame(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def wait_for_disconnect(request) -> None:
+    """Return once the client has closed the connection. The request body
+    has already been read, so the next ASGI message is the disconnect."""
+    while True:
+        message = await request.receive()
+        if message["type"] == "http.disconnect":
+            return
+
+
+async def _discard(task: asyncio.Future):
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+
+
+async def coalesce(
+    tokens: AsyncIterator[str],
+    events: Optional[asyncio.Queue] = None,
+    disconnected: Optional[asyncio.Future] = None,
+    flush_ms: float = STREAM_FLUSH_MS,
+    max_chars: int = STREAM_FLUSH_CHARS,
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Merge `tokens` into ("text", str) frames, interleaved with (event, data)
+    pairs taken from `events`. Returns early, closing `tokens`, as soon as
+    `disconnected` completes.
+    """
+    loop = asyncio.get_running_loop()
+    flush_s = max(0.0, flush_ms) / 1000.0
+    events = events if events is not None else asyncio.Queue()
+    disconnected = disconnected if disconnected is not None else loop.create_future()
+
+    it = tokens.__aiter__()
+    next_token = asyncio.ensure_future(it.__anext__())
+    next_event = asyncio.ensure_future(events.get())
+    buf, size, deadline, sent = [], 0, None, False
+    try:
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - loop.time())
+            done, _ = await asyncio.wait({next_token, next_event, disconnected}, timeout=timeout,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            if disconnected in done:
+                return
+            if next_event in done:
+                if buf:
+                    yield "text", "".join(buf)
+                    buf, size, deadline = [], 0, None
+                yield next_event.result()
+                next_event = asyncio.ensure_future(events.get())
+            if next_token in done:
+                try:
+                    token = next_token.result()
+                except StopAsyncIteration:
+                    break
+                next_token = asyncio.ensure_future(it.__anext__())
+                if token:
+                    buf.append(token)
+                    size += len(token)
+                    if deadline is None:
+                        deadline = loop.time() + flush_s
+            if buf and (not sent or size >= max_chars or loop.time() >= deadline):
+                yield "text", "".join(buf)
+                buf, size, deadline, sent = [], 0, None, True
+
+        while not events.empty():
+            yield events.get_nowait()
+        if buf:
+            yield "text", "".join(buf)
+    finally:
+        await _discard(next_event)
+        # The generator can only be closed once its pending step is done
+        await _discard(next_token)
+        if hasattr(it, "aclose"):
+            await it.aclose()
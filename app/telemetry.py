@@ -0,0 +1,243 @@
+# telemetry.py — stage timing spans, request ids and Prometheus metrics
+"""
+Lightweight, dependency-free instrumentation.
+
+* span("rag_query") times a block, feeds the nova_stage_seconds histogram and,
+  when a request trace is active, records the stage in that trace.
+* Request ids live in a ContextVar set by RequestIdMiddleware; agent_hub's
+  run_blocking copies the context so spans on executor threads keep it.
+* render_metrics() produces the Prometheus text format for /metrics.
+
+A span costs two perf_counter() calls and one locked bucket increment.
+"""
+import bisect
+import contextvars
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from functools import wraps
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))  # 0 disables slow-request logging
+
+request_id_var: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("request_id", default=None)
+_trace_var: contextvars.ContextVar[Optional["Trace"]] = contextvars.ContextVar("trace", default=None)
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# ---------------------------------------------------------
+# Metric types
+# ---------------------------------------------------------
+def _fmt_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    parts = [f'{n}="{str(v).replace(chr(34), chr(39))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name, self.help, self.labels = name, help, labels
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount: float = 1.0):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for lv, v in sorted(self._values.items()):
+            lines.append(f"{self.name}{_fmt_labels(self.labels, lv)} {v}")
+        return lines
+
+
+class Gauge(Counter):
+    def set(self, *label_values, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+    def dec(self, *label_values, amount: float = 1.0):
+        self.inc(*label_values, amount=-amount)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        lines[1] = f"# TYPE {self.name} gauge"
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS):
+        self.name, self.help, self.labels = name, help, labels
+        self.buckets = tuple(buckets)
+        self._series: Dict[Tuple[str, ...], List] = {}  # labels -> [bucket counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *label_values):
+        idx = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            if idx < len(self.buckets):
+                series[0][idx] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = sorted((lv, (list(s[0]), s[1], s[2])) for lv, s in self._series.items())
+        for lv, (counts, total, n) in snapshot:
+            cumulative = 0
+            for bound, c in zip(self.buckets, counts):
+                cumulative += c
+                le = 'le="%s"' % bound
+                lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, lv, le)} {cumulative}")
+            inf = 'le="+Inf"'
+            lines.append(f"{self.name}_bucket{_fmt_labels(self.labels, lv, inf)} {n}")
+            lines.append(f"{self.name}_sum{_fmt_labels(self.labels, lv)} {total}")
+            lines.append(f"{self.name}_count{_fmt_labels(self.labels, lv)} {n}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("nova_stage_seconds", "Latency of individual pipeline stages", ("stage",))
+REQUEST_SECONDS = Histogram("nova_request_seconds", "End-to-end request latency", ("endpoint",))
+TOOL_USAGE = Counter("nova_tool_usage_total", "Turns that invoked each tool", ("tool",))
+REQUESTS = Counter("nova_requests_total", "Requests by endpoint and outcome", ("endpoint", "outcome"))
+INFLIGHT_STREAMS = Gauge("nova_inflight_streams", "Chat responses currently streaming")
+
+_metrics = [STAGE_SECONDS, REQUEST_SECONDS, TOOL_USAGE, REQUESTS, INFLIGHT_STREAMS]
+# Scrape-time collectors: fn() -> [(name, help, [(labels dict, value)])], rendered as gauges
+_collectors: List[Callable] = []
+
+
+def register(metric):
+    """Export a metric defined in another module on /metrics."""
+    _metrics.append(metric)
+    return metric
+
+
+def register_collector(fn: Callable):
+    _collectors.append(fn)
+
+
+def render_metrics() -> str:
+    lines: List[str] = []
+    for m in _metrics:
+        lines.extend(m.render())
+    for fn in _collectors:
+        try:
+            for name, help, samples in fn():
+                lines.append(f"# HELP {name} {help}")
+                lines.append(f"# TYPE {name} gauge")
+                for labels, value in samples:
+                    names, values = tuple(labels), tuple(labels.values())
+                    lines.append(f"{name}{_fmt_labels(names, values)} {float(value)}")
+        except Exception as e:
+            logger.warning(f"metrics collector failed: {e}")
+    return "\n".join(lines) + "\n"
+
+
+# ---------------------------------------------------------
+# Traces and spans
+# ---------------------------------------------------------
+class Trace:
+    """Per-request list of (stage, seconds), used for slow-request logs."""
+
+    def __init__(self, request_id: Optional[str], endpoint: str):
+        self.request_id = request_id
+        self.endpoint = endpoint
+        self.start = time.perf_counter()
+        self.stages: List[Tuple[str, float]] = []
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def breakdown(self) -> str:
+        return ", ".join(f"{name}={secs * 1000:.1f}ms" for name, secs in self.stages)
+
+
+def record(stage: str, seconds: float):
+    STAGE_SECONDS.observe(seconds, stage)
+    trace = _trace_var.get()
+    if trace is not None:
+        trace.stages.append((stage, seconds))
+
+
+@contextmanager
+def span(stage: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - t0)
+
+
+def traced(stage: str):
+    """Decorator form of span()."""
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(stage, time.perf_counter() - t0)
+        return wrapper
+    return deco
+
+
+def start_trace(endpoint: str) -> Trace:
+    trace = Trace(request_id_var.get(), endpoint)
+    _trace_var.set(trace)
+    return trace
+
+
+def finish_trace(trace: Trace, outcome: str = "ok"):
+    elapsed = trace.elapsed()
+    REQUEST_SECONDS.observe(elapsed, trace.endpoint)
+    REQUESTS.inc(trace.endpoint, outcome)
+    if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+        logger.warning(f"Slow request {trace.request_id} {trace.endpoint} {elapsed * 1000:.0f}ms: {trace.breakdown()}")
+
+
+# ---------------------------------------------------------
+# ASGI middleware
+# ---------------------------------------------------------
+class RequestIdMiddleware:
+    """Take X-Request-ID from the client (or mint one), expose it to spans via
+    a ContextVar for the whole request including the streamed body, and echo
+    it back in the response headers."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        rid = None
+        for key, value in scope.get("headers", []):
+            if key == b"x-request-id":
+                rid = value.decode("latin-1")[:128]
+                break
+        rid = rid or uuid.uuid4().hex
+        token = request_id_var.set(rid)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", rid.encode("latin-1"))]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            request_id_var.reset(token)
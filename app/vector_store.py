@@ -0,0 +1,482 @@
+# vector_store.py — in-process memory-mapped vector store (alternative to Chroma)
+"""
+`MmapCollection` implements the subset of Chroma's collection API that
+RAGIndex uses (add / get / update / delete / query / count), so RAGIndex can
+switch stores with RAG_VECTOR_STORE=mmap without other changes.
+
+Layout under `path`:
+
+  vectors.<epoch>.f32   append-only float32 matrix, one L2-normalised row per chunk
+  meta.db               SQLite: row -> (id, document, metadata JSON), plus state
+  ivf.<epoch>.npz       optional IVF centroids and row assignments
+
+Queries map the matrix read-only with np.memmap, so every process that opens
+the same directory shares one copy of the pages through the OS cache. Exact
+search is one matmul over the live rows plus argpartition. With RAG_IVF=1,
+once a store reaches RAG_IVF_MIN_ROWS rows it is partitioned with k-means and
+queries only scan the RAG_IVF_NPROBE closest partitions.
+
+Writers serialise on SQLite's write lock (BEGIN IMMEDIATE), so several
+processes may append safely. Every commit bumps a `generation` counter that
+readers check before each query to pick up other processes' writes. Deletes
+are tombstones (the row leaves meta.db); when dead rows outnumber live ones,
+the live rows are rewritten into a new epoch file. Files of an old epoch are
+unlinked rather than truncated, so readers still mapping them never fault.
+"""
+import json
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+IVF_ENABLED = os.getenv("RAG_IVF", "0") == "1"
+IVF_MIN_ROWS = int(os.getenv("RAG_IVF_MIN_ROWS", "50000"))
+IVF_NPROBE = int(os.getenv("RAG_IVF_NPROBE", "16"))
+COMPACT_MIN_DEAD = int(os.getenv("RAG_COMPACT_MIN_DEAD", "1000"))
+
+
+def _normalize(v: np.ndarray) -> np.ndarray:
+    v = np.asarray(v, dtype=np.float32)
+    if v.ndim == 1:
+        v = v[None, :]
+    return v / np.maximum(np.linalg.norm(v, axis=1, keepdims=True), 1e-12)
+
+
+def where_sql(where: Optional[Dict]) -> Tuple[str, list]:
+    """
+    Translate a Chroma-style metadata filter into SQL over the JSON `meta`
+    column. Supports {"k": v}, {"k": {"$eq"|"$ne"|"$in"|"$nin": ...}},
+    {"$and": [...]} and {"$or": [...]}. An empty filter matches everything.
+    """
+    if not where:
+        return "1", []
+    clauses, args = [], []
+    for key, cond in where.items():
+        if key in ("$and", "$or"):
+            parts = [where_sql(c) for c in cond]
+            joiner = " AND " if key == "$and" else " OR "
+            clauses.append("(" + joiner.join(p for p, _ in parts) + ")")
+            for _, a in parts:
+                args.extend(a)
+            continue
+        col = "json_extract(meta, ?)"
+        path = f"$.{key}"
+        if not isinstance(cond, dict):
+            cond = {"$eq": cond}
+        for op, value in cond.items():
+            if op == "$eq":
+                clauses.append(f"{col} = ?")
+                args.extend([path, value])
+            elif op == "$ne":
+                clauses.append(f"({col} IS NULL OR {col} != ?)")
+                args.extend([path, path, value])
+            elif op in ("$in", "$nin"):
+                values = list(value)
+                marks = ",".join("?" * len(values)) or "NULL"
+                clauses.append(f"{col} {'IN' if op == '$in' else 'NOT IN'} ({marks})")
+                args.append(path)
+                args.extend(values)
+            else:
+                raise ValueError(f"Unsupported filter operator {op!r}")
+    return " AND ".join(clauses), args
+
+
+class MmapCollection:
+    name = "mmap"
+
+    def __init__(self, path: str, ivf: bool = IVF_ENABLED, ivf_min_rows: int = IVF_MIN_ROWS,
+                 nprobe: int = IVF_NPROBE):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.db_path = os.path.join(path, "meta.db")
+        self.ivf_enabled = ivf
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = max(1, nprobe)
+
+        self._local = threading.local()
+        self._lock = threading.RLock()  # guards the cached view below
+        self._generation = None
+        self._epoch = None
+        self._dim = 0
+        self._rows = 0
+        self._matrix = np.zeros((0, 0), dtype=np.float32)
+        self._alive = np.zeros(0, dtype=bool)
+        self._n_alive = 0
+        self._filter_masks: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._ivf = None  # (centroids, assignments, lists)
+
+        conn = self._conn()
+        with conn:
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS vectors (
+                row INTEGER PRIMARY KEY,
+                id TEXT UNIQUE NOT NULL,
+                doc TEXT,
+                meta TEXT
+            )""")
+            conn.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value INTEGER)")
+            # RAGIndex looks chunks up by document hash and source on every ingest
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_doc_hash ON vectors(json_extract(meta, '$.doc_hash'))")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_source ON vectors(json_extract(meta, '$.source'))")
+            # ...and by chunk text hash, to reuse embeddings of identical chunks
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_vectors_chunk_hash ON vectors(json_extract(meta, '$.chunk_hash'))")
+            for key in ("generation", "epoch", "rows", "dim", "ivf_rows"):
+                conn.execute("INSERT OR IGNORE INTO state (key, value) VALUES (?, 0)", (key,))
+
+    # ---------------------------------------------------------
+    # Storage
+    # ---------------------------------------------------------
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, cached_statements=128)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _vec_path(self, epoch: int) -> str:
+        return os.path.join(self.path, f"vectors.{epoch}.f32")
+
+    def _ivf_path(self, epoch: int) -> str:
+        return os.path.join(self.path, f"ivf.{epoch}.npz")
+
+    def _state(self, conn) -> Dict[str, int]:
+        return dict(conn.execute("SELECT key, value FROM state").fetchall())
+
+    def _set_state(self, conn, **values):
+        values["generation"] = self._state_value(conn, "generation") + 1
+        conn.executemany("UPDATE state SET value=? WHERE key=?", [(v, k) for k, v in values.items()])
+
+    @staticmethod
+    def _state_value(conn, key: str) -> int:
+        return conn.execute("SELECT value FROM state WHERE key=?", (key,)).fetchone()[0]
+
+    def _refresh(self):
+        """Re-map the matrix and reload the live-row mask if anyone (this or
+        another process) committed since the last look. One indexed read when
+        nothing changed."""
+        conn = self._conn()
+        generation = self._state_value(conn, "generation")
+        if generation == self._generation:
+            return
+        with self._lock:
+            if generation == self._generation:
+                return
+            state = self._state(conn)
+            epoch, rows, dim = state["epoch"], state["rows"], state["dim"]
+            if rows and dim:
+                if epoch != self._epoch or rows > self._matrix.shape[0]:
+                    self._matrix = np.memmap(self._vec_path(epoch), dtype=np.float32, mode="r", shape=(rows, dim))
+            else:
+                self._matrix = np.zeros((0, dim), dtype=np.float32)
+            alive = np.zeros(rows, dtype=bool)
+            live_rows = np.fromiter((r for (r,) in conn.execute("SELECT row FROM vectors")), dtype=np.int64)
+            alive[live_rows] = True
+            if epoch != self._epoch or state["ivf_rows"] != (self._ivf[1].shape[0] if self._ivf else 0):
+                self._ivf = self._load_ivf(epoch) if state["ivf_rows"] else None
+            self._epoch, self._rows, self._dim = epoch, rows, dim
+            self._alive, self._n_alive = alive, int(len(live_rows))
+            self._filter_masks = {}
+            self._generation = generation
+
+    # ---------------------------------------------------------
+    # Chroma-compatible API
+    # ---------------------------------------------------------
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+
+    def add(self, ids: List[str], embeddings, documents: Optional[List[str]] = None,
+            metadatas: Optional[List[dict]] = None):
+        if not ids:
+            return
+        vectors = _normalize(embeddings)
+        documents = documents or [None] * len(ids)
+        metadatas = metadatas or [None] * len(ids)
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._state(conn)
+            dim = state["dim"] or vectors.shape[1]
+            if vectors.shape[1] != dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match store dimension {dim}")
+            present = self._present(conn, ids)
+            keep = [i for i, cid in enumerate(ids) if cid not in present]
+            if not keep:
+                conn.execute("ROLLBACK")
+                return
+            rows = state["rows"]
+            # Write past the committed end; bytes left there by a writer that
+            # crashed before committing are simply overwritten.
+            with open(self._vec_path(state["epoch"]), "ab") as f:
+                f.truncate(rows * dim * 4)
+                f.write(np.ascontiguousarray(vectors[keep]).tobytes())
+            conn.executemany(
+                "INSERT INTO vectors (row, id, doc, meta) VALUES (?, ?, ?, ?)",
+                [(rows + n, ids[i], documents[i], json.dumps(metadatas[i]) if metadatas[i] else None)
+                 for n, i in enumerate(keep)],
+            )
+            self._set_state(conn, rows=rows + len(keep), dim=dim)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if self.ivf_enabled:
+            self._maybe_train_ivf()
+
+    def _present(self, conn, ids: List[str]) -> set:
+        found = set()
+        for i in range(0, len(ids), 500):
+            part = ids[i:i + 500]
+            found.update(r for (r,) in conn.execute(
+                f"SELECT id FROM vectors WHERE id IN ({','.join('?' * len(part))})", part))
+        return found
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None, limit: Optional[int] = None,
+            offset: Optional[int] = None, include=("documents", "metadatas")) -> Dict:
+        sql, args = where_sql(where)
+        if ids is not None:
+            if not ids:
+                return {"ids": [], "documents": [], "metadatas": []}
+            sql += f" AND id IN ({','.join('?' * len(ids))})"
+            args = args + list(ids)
+        sql = f"SELECT id, doc, meta, row FROM vectors WHERE {sql} ORDER BY row"
+        if limit is not None:
+            sql += " LIMIT ? OFFSET ?"
+            args = args + [limit, offset or 0]
+        rows = self._conn().execute(sql, args).fetchall()
+        out = {"ids": [r[0] for r in rows]}
+        if "documents" in include:
+            out["documents"] = [r[1] for r in rows]
+        if "metadatas" in include:
+            out["metadatas"] = [json.loads(r[2]) if r[2] else None for r in rows]
+        if "embeddings" in include:
+            self._refresh()
+            with self._lock:
+                matrix = self._matrix
+            # Rows committed after the refresh are not mapped yet; skip them
+            out["embeddings"] = [np.array(matrix[r[3]]) if r[3] < matrix.shape[0] else None for r in rows]
+        return out
+
+    def update(self, ids: List[str], metadatas: Optional[List[dict]] = None, documents: Optional[List[str]] = None, **_):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if metadatas is not None:
+                conn.executemany("UPDATE vectors SET meta=? WHERE id=?",
+                                 [(json.dumps(m) if m else None, i) for i, m in zip(ids, metadatas)])
+            if documents is not None:
+                conn.executemany("UPDATE vectors SET doc=? WHERE id=?", list(zip(documents, ids)))
+            self._set_state(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[Dict] = None):
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if ids is not None:
+                for i in range(0, len(ids), 500):
+                    part = ids[i:i + 500]
+                    conn.execute(f"DELETE FROM vectors WHERE id IN ({','.join('?' * len(part))})", part)
+            else:
+                sql, args = where_sql(where)
+                conn.execute(f"DELETE FROM vectors WHERE {sql}", args)
+            live = conn.execute("SELECT COUNT(*) FROM vectors").fetchone()[0]
+            rows = self._state_value(conn, "rows")
+            if live == 0:
+                # Nothing left: start a fresh epoch rather than keep a matrix of tombstones
+                self._set_state(conn, epoch=self._state_value(conn, "epoch") + 1, rows=0, ivf_rows=0)
+            else:
+                self._set_state(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        if live and rows - live >= max(COMPACT_MIN_DEAD, live):
+            self.compact()
+        self._remove_stale_files()
+
+    def compact(self):
+        """Rewrite the live rows into a new epoch file, dropping tombstones."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            state = self._state(conn)
+            old, new = state["epoch"], state["epoch"] + 1
+            rows, dim = state["rows"], state["dim"]
+            live = [r for (r,) in conn.execute("SELECT row FROM vectors ORDER BY row")]
+            matrix = np.memmap(self._vec_path(old), dtype=np.float32, mode="r", shape=(rows, dim)) if rows else None
+            with open(self._vec_path(new), "wb") as f:
+                for i in range(0, len(live), 8192):
+                    f.write(np.ascontiguousarray(matrix[live[i:i + 8192]]).tobytes())
+            # Renumber in two passes so the PRIMARY KEY never collides
+            conn.executemany("UPDATE vectors SET row=? WHERE row=?", [(-1 - n, r) for n, r in enumerate(live)])
+            conn.execute("UPDATE vectors SET row = -1 - row")
+            self._set_state(conn, epoch=new, rows=len(live), ivf_rows=0)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._remove_stale_files()
+        if self.ivf_enabled:
+            self._maybe_train_ivf()
+
+    def _remove_stale_files(self):
+        epoch = self._state_value(self._conn(), "epoch")
+        for name in os.listdir(self.path):
+            parts = name.split(".")
+            if len(parts) == 3 and parts[0] in ("vectors", "ivf") and parts[1].isdigit() and int(parts[1]) != epoch:
+                try:
+                    os.unlink(os.path.join(self.path, name))  # open maps stay valid until released
+                except OSError:
+                    pass
+
+    def query(self, query_embeddings, n_results: int = 10, where: Optional[Dict] = None,
+              include=("documents", "metadatas", "distances")) -> Dict:
+        """
+        Exact (or IVF-probed) cosine search. Distances are squared L2 between
+        unit vectors (2 - 2·cos), matching Chroma's default space.
+        """
+        self._refresh()
+        out = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        with self._lock:
+            matrix, alive, ivf = self._matrix, self._alive, self._ivf
+            mask, selected = self._filter_mask(where) if where else (alive, None)
+        for q in _normalize(query_embeddings):
+            rows, sims = self._search(q, matrix, mask, ivf, n_results, selected)
+            ids, docs, metas = self._fetch(rows)
+            out["ids"].append(ids)
+            out["documents"].append(docs)
+            out["metadatas"].append(metas)
+            out["distances"].append([float(2.0 - 2.0 * s) for s in sims])
+        return out
+
+    def _filter_mask(self, where: Dict) -> Tuple[np.ndarray, np.ndarray]:
+        """Live rows that also match `where` (as a mask and as row numbers),
+        cached until the next write."""
+        key = json.dumps(where, sort_keys=True)
+        cached = self._filter_masks.get(key)
+        if cached is None:
+            sql, args = where_sql(where)
+            mask = np.zeros(self._rows, dtype=bool)
+            rows = np.fromiter((r for (r,) in self._conn().execute(f"SELECT row FROM vectors WHERE {sql}", args)),
+                               dtype=np.int64)
+            mask[rows[rows < self._rows]] = True
+            if len(self._filter_masks) > 256:
+                self._filter_masks.clear()
+            cached = self._filter_masks[key] = (mask, np.flatnonzero(mask))
+        return cached
+
+    def _search(self, q: np.ndarray, matrix: np.ndarray, mask: np.ndarray, ivf, k: int,
+                selected: Optional[np.ndarray] = None):
+        if ivf is not None:
+            centroids, assign, lists = ivf
+            probe = np.argsort(-(centroids @ q))[:self.nprobe]
+            rows = np.concatenate([lists[c] for c in probe] + [np.arange(assign.shape[0], matrix.shape[0])])
+            rows = rows[mask[rows]]
+            sims = matrix[rows] @ q if len(rows) else np.zeros(0, dtype=np.float32)
+        elif selected is not None and len(selected) < matrix.shape[0] // 2:
+            # Narrow filter: score only the matching rows, so cost follows the
+            # size of the filtered set rather than the whole store
+            rows = selected
+            sims = matrix[rows] @ q if len(rows) else np.zeros(0, dtype=np.float32)
+        else:
+            sims = matrix @ q if matrix.shape[0] else np.zeros(0, dtype=np.float32)
+            if mask.size and not mask.all():
+                sims = np.where(mask, sims, -np.inf)
+            rows = np.arange(len(sims))
+        k = min(k, int(np.isfinite(sims).sum()))
+        if k <= 0:
+            return [], []
+        top = np.argpartition(-sims, k - 1)[:k] if k < len(sims) else np.arange(len(sims))
+        top = top[np.argsort(-sims[top])]
+        top = top[np.isfinite(sims[top])]
+        return rows[top].tolist(), sims[top].tolist()
+
+    def _fetch(self, rows: List[int]):
+        if not rows:
+            return [], [], []
+        found = {r[0]: r[1:] for r in self._conn().execute(
+            f"SELECT row, id, doc, meta FROM vectors WHERE row IN ({','.join('?' * len(rows))})", rows)}
+        ids, docs, metas = [], [], []
+        for r in rows:
+            if r in found:  # deleted since the mask was built
+                cid, doc, meta = found[r]
+                ids.append(cid)
+                docs.append(doc)
+                metas.append(json.loads(meta) if meta else None)
+        return ids, docs, metas
+
+    # ---------------------------------------------------------
+    # IVF partitioning
+    # ---------------------------------------------------------
+    def _load_ivf(self, epoch: int):
+        try:
+            data = np.load(self._ivf_path(epoch))
+        except (OSError, ValueError):
+            return None
+        centroids, assign = data["centroids"], data["assign"]
+        order = np.argsort(assign, kind="stable")
+        bounds = np.searchsorted(assign[order], np.arange(len(centroids) + 1))
+        lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(centroids))]
+        return centroids, assign, lists
+
+    def _maybe_train_ivf(self):
+        """(Re)train once the store reaches the threshold and whenever it has
+        doubled since the last training; rows added in between are scanned
+        exactly until then."""
+        state = self._state(self._conn())
+        rows, trained = state["rows"], state["ivf_rows"]
+        if rows < self.ivf_min_rows or (trained and rows < 2 * trained):
+            return
+        self.train_ivf()
+
+    def train_ivf(self, nlist: Optional[int] = None, iters: int = 10, sample: int = 65536):
+        state = self._state(self._conn())
+        epoch, rows, dim = state["epoch"], state["rows"], state["dim"]
+        if not rows:
+            return
+        matrix = np.memmap(self._vec_path(epoch), dtype=np.float32, mode="r", shape=(rows, dim))
+        nlist = nlist or max(1, int(np.sqrt(rows)))
+        rng = np.random.default_rng(0)
+        train = np.asarray(matrix[np.sort(rng.choice(rows, size=min(rows, max(sample, nlist)), replace=False))])
+        centroids = train[rng.choice(len(train), size=min(nlist, len(train)), replace=False)].copy()
+        # Spherical k-means: assign by dot product, re-normalise the means
+        for _ in range(iters):
+            labels = np.argmax(train @ centroids.T, axis=1)
+            for c in range(len(centroids)):
+                members = train[labels == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+            centroids = _normalize(centroids)
+        assign = np.concatenate([np.argmax(matrix[i:i + 8192] @ centroids.T, axis=1)
+                                 for i in range(0, rows, 8192)]).astype(np.int32)
+
+        tmp = self._ivf_path(epoch) + ".tmp.npz"
+        np.savez(tmp, centroids=centroids, assign=assign)
+        os.replace(tmp, self._ivf_path(epoch))
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if self._state_value(conn, "epoch") == epoch:
+                self._set_state(conn, ivf_rows=rows)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def stats(self) -> dict:
+        self._refresh()
+        return {
+            "rows": self._rows,
+            "live": self._n_alive,
+            "dim": self._dim,
+            "epoch": self._epoch,
+            "ivf_lists": len(self._ivf[2]) if self._ivf else 0,
+            "ivf_rows": int(self._ivf[1].shape[0]) if self._ivf else 0,
+        }
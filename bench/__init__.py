@@ -0,0 +1,7 @@
+"""
+Offline benchmarks for Nova.
+
+Everything here runs without network access: the LLM, web search and the
+embedding model are replaced by fakes, and the FastAPI app is served
+in-process on a loopback port. Run with `python -m bench --help`.
+"""
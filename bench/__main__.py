@@ -0,0 +1,77 @@
+# python -m bench — run the offline benchmark suite
+import argparse
+import json
+import sys
+import tempfile
+
+from . import scenarios
+from .report import compare, save_results
+
+SCENARIOS = ("chat", "upload", "retrieval", "sqlite", "routing", "burst", "batch")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Offline Nova benchmarks")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="comma-separated subset of " + ", ".join(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=8, help="concurrent chat clients")
+    parser.add_argument("--requests", type=int, default=5, help="chat requests per client")
+    parser.add_argument("--tokens-per-s", type=float, default=200.0, help="fake LLM token rate")
+    parser.add_argument("--ttft", type=float, default=0.15, help="fake LLM time-to-first-token (s)")
+    parser.add_argument("--upload-docs", type=int, default=4)
+    parser.add_argument("--upload-pages", type=int, default=25)
+    parser.add_argument("--sizes", default="1000,5000,20000", help="retrieval corpus sizes (chunks)")
+    parser.add_argument("--vector-store", default="chroma", choices=("chroma", "mmap"), help="vector store for retrieval")
+    parser.add_argument("--sqlite-turns", type=int, default=5000)
+    parser.add_argument("--out", default="bench_results.json", help="where to write results JSON")
+    parser.add_argument("--compare", help="baseline results JSON to check for regressions")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    chosen = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(chosen) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="nova_bench_") as work:
+        for name in chosen:
+            print(f"▶ {name} ...", flush=True)
+            if name == "chat":
+                results[name] = scenarios.chat_scenario(f"{work}/chat", clients=args.clients, requests_per_client=args.requests,
+                                                        tokens_per_s=args.tokens_per_s, ttft_s=args.ttft)
+            elif name == "upload":
+                results[name] = scenarios.upload_scenario(f"{work}/upload", docs=args.upload_docs, pages_per_doc=args.upload_pages)
+            elif name == "retrieval":
+                sizes = [int(x) for x in args.sizes.split(",") if x]
+                results[name] = scenarios.retrieval_scenario(f"{work}/retrieval", sizes=sizes,
+                                                             vector_store=args.vector_store)
+            elif name == "sqlite":
+                results[name] = scenarios.sqlite_scenario(f"{work}/sqlite", turns=args.sqlite_turns)
+            elif name == "routing":
+                results[name] = scenarios.routing_scenario(f"{work}/routing")
+            elif name == "burst":
+                results[name] = scenarios.burst_scenario(f"{work}/burst", clients=args.clients,
+                                                         tokens_per_s=args.tokens_per_s, ttft_s=args.ttft)
+            elif name == "batch":
+                results[name] = scenarios.batch_scenario(f"{work}/batch", tokens_per_s=args.tokens_per_s,
+                                                         ttft_s=args.ttft)
+            print(json.dumps(results[name], indent=2))
+
+    doc = save_results(results, args.out, config=vars(args))
+    print(f"Results written to {args.out}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(doc, baseline, tolerance=args.tolerance)
+        if regressions:
+            print("Regressions vs baseline:")
+            for line in regressions:
+                print("  " + line)
+            return 1
+        print("No regressions vs baseline.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+# corpus.py — synthetic documents for ingest and retrieval benchmarks
+import os
+import random
+from typing import List
+
+_VOCAB = """
+python fastapi sqlite chroma vector embedding retrieval hybrid agent memory
+resume project experience skills education manager engineer analyst policy
+report quarterly revenue budget compliance security customer onboarding
+latency throughput cache index cluster deployment kubernetes docker cloud
+machine learning model training evaluation dataset pipeline streaming search
+""".split()
+
+
+# Zipf-distributed vocabulary: the domain words above plus pseudo-words, so
+# term frequencies look like real text rather than 60 words repeated evenly
+_RNG = random.Random(42)
+_PSEUDO = ["".join(_RNG.choice("bcdfghjklmnprstvz") + _RNG.choice("aeiou") for _ in range(_RNG.randint(2, 4)))
+           for _ in range(20000)]
+_WORDS = _VOCAB + _PSEUDO
+_WEIGHTS = [1.0 / (rank + 1) for rank in range(len(_WORDS))]
+
+
+def synthetic_paragraph(rng: random.Random, words: int = 120) -> str:
+    body = " ".join(rng.choices(_WORDS, weights=_WEIGHTS, k=words))
+    # Sprinkle exact-match identifiers the way resumes and reports have them
+    return f"{body} ID-{rng.randint(1000, 9999)} {rng.choice(['AWS', 'GCP', 'SQL', 'NLP', 'ETL'])}."
+
+
+def synthetic_chunks(n: int, seed: int = 0, words: int = 120) -> List[str]:
+    rng = random.Random(seed)
+    return [synthetic_paragraph(rng, words) for _ in range(n)]
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def write_pdf(path: str, pages: List[List[str]]):
+    """Write a minimal, valid text-only PDF (Helvetica, one line per string)."""
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in below
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    page_ids = []
+    for lines in pages:
+        ops = ["BT", "/F1 10 Tf", "12 TL", "50 780 Td"]
+        for line in lines:
+            ops.append(f"({_escape(line)}) Tj T*")
+        ops.append("ET")
+        stream = "\n".join(ops)
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>")
+        page_ids.append(len(objects))
+    kids = " ".join(f"{i} 0 R" for i in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, obj in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    for off in offsets:
+        out += f"{off:010d} 00000 n \n".encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    with open(path, "wb") as f:
+        f.write(out)
+
+
+def generate_pdfs(out_dir: str, n_docs: int = 4, pages_per_doc: int = 20, seed: int = 0) -> List[str]:
+    """Create `n_docs` PDFs of `pages_per_doc` pages each; returns their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    for d in range(n_docs):
+        pages = []
+        for _ in range(pages_per_doc):
+            text = " ".join(synthetic_paragraph(rng) for _ in range(3))
+            words = text.split()
+            pages.append([" ".join(words[i:i + 14]) for i in range(0, len(words), 14)])
+        path = os.path.join(out_dir, f"bench_doc_{seed}_{d}.pdf")
+        write_pdf(path, pages)
+        paths.append(path)
+    return paths
@@ -0,0 +1,79 @@
+# fakes.py — offline stand-ins for the LLM and the embedding model
+import asyncio
+import hashlib
+import math
+import re
+import time
+from typing import Iterator, List
+
+import numpy as np
+
+_WORD_RE = re.compile(r"\w+")
+
+
+class FakeStreamingLLM:
+    """
+    Streams a canned answer at a fixed token rate after a fixed
+    time-to-first-token. Exposes both `astream` and `stream`, like ChatGroq.
+    """
+
+    def __init__(self, tokens_per_s: float = 200.0, ttft_s: float = 0.15, answer_tokens: int = 60):
+        self.tokens_per_s = tokens_per_s
+        self.ttft_s = ttft_s
+        self.answer_tokens = answer_tokens
+        self.calls = 0
+        self.tokens_emitted = 0  # shows whether abandoned streams stop early
+
+    def _tokens(self, prompt: str) -> List[str]:
+        return [f"tok{i} " for i in range(self.answer_tokens)]
+
+    async def astream(self, prompt: str):
+        self.calls += 1
+        await asyncio.sleep(self.ttft_s)
+        delay = 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+        for tok in self._tokens(prompt):
+            self.tokens_emitted += 1
+            yield tok
+            if delay:
+                await asyncio.sleep(delay)
+
+    def stream(self, prompt: str) -> Iterator[str]:
+        self.calls += 1
+        time.sleep(self.ttft_s)
+        delay = 1.0 / self.tokens_per_s if self.tokens_per_s > 0 else 0.0
+        for tok in self._tokens(prompt):
+            self.tokens_emitted += 1
+            yield tok
+            if delay:
+                time.sleep(delay)
+
+
+class FakeEncoder:
+    """
+    Deterministic hashing-trick encoder with SentenceTransformer's encode()
+    shape: texts sharing words get similar unit vectors. `cost_per_item_s`
+    and `cost_per_call_s` simulate model compute.
+    """
+
+    def __init__(self, dim: int = 384, cost_per_call_s: float = 0.0, cost_per_item_s: float = 0.0):
+        self.dim = dim
+        self.cost_per_call_s = cost_per_call_s
+        self.cost_per_item_s = cost_per_item_s
+        self.calls = 0
+
+    def _vector(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for word in _WORD_RE.findall(text.lower()):
+            h = int.from_bytes(hashlib.blake2b(word.encode(), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        norm = math.sqrt(float(vec @ vec)) or 1.0
+        return vec / norm
+
+    def encode(self, texts, batch_size: int = 32, **kwargs) -> np.ndarray:
+        if isinstance(texts, str):
+            texts = [texts]
+        self.calls += 1
+        cost = self.cost_per_call_s + self.cost_per_item_s * len(texts)
+        if cost:
+            time.sleep(cost)
+        return np.stack([self._vector(t) for t in texts]) if texts else np.zeros((0, self.dim), dtype=np.float32)
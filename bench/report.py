@@ -0,0 +1,86 @@
+# report.py — latency summaries, result files and run-to-run comparison
+import json
+import os
+import platform
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+
+def percentiles(samples: List[float]) -> Dict[str, float]:
+    """p50/p95/p99/mean/max of `samples` (seconds), reported in milliseconds."""
+    if not samples:
+        return {"n": 0}
+    xs = sorted(samples)
+
+    def pct(p):
+        idx = min(len(xs) - 1, max(0, int(round(p / 100.0 * (len(xs) - 1)))))
+        return round(xs[idx] * 1000, 3)
+
+    return {
+        "n": len(xs),
+        "p50_ms": pct(50),
+        "p95_ms": pct(95),
+        "p99_ms": pct(99),
+        "mean_ms": round(sum(xs) / len(xs) * 1000, 3),
+        "max_ms": round(xs[-1] * 1000, 3),
+    }
+
+
+def _git_rev() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+def save_results(results: Dict, path: str, config: Dict) -> Dict:
+    doc = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "config": config,
+        },
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(doc, f, indent=2)
+    return doc
+
+
+def _flatten(d: Dict, prefix: str = "") -> Dict[str, float]:
+    out = {}
+    for k, v in d.items():
+        key = f"{prefix}.{k}" if prefix else k
+        if isinstance(v, dict):
+            out.update(_flatten(v, key))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            out[key] = float(v)
+    return out
+
+
+def _lower_is_better(key: str) -> bool:
+    return key.endswith("_ms") or key.endswith("_s")
+
+
+def _higher_is_better(key: str) -> bool:
+    return key.endswith("_per_s")
+
+
+def compare(current: Dict, baseline: Dict, tolerance: float = 0.15) -> List[str]:
+    """Return a line per metric that regressed by more than `tolerance`."""
+    cur, base = _flatten(current["results"]), _flatten(baseline["results"])
+    regressions = []
+    for key, old in base.items():
+        new = cur.get(key)
+        if new is None or old <= 0:
+            continue
+        if _higher_is_better(key) and new < old * (1 - tolerance):
+            regressions.append(f"{key}: {old:.3f} -> {new:.3f} ({(new / old - 1) * 100:+.1f}%)")
+        elif _lower_is_better(key) and not _higher_is_better(key) and new > old * (1 + tolerance):
+            regressions.append(f"{key}: {old:.3f} -> {new:.3f} ({(new / old - 1) * 100:+.1f}%)")
+    return regressions
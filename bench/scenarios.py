@@ -0,0 +1,503 @@
+# scenarios.py — benchmark scenarios driving the app in-process
+import asyncio
+import os
+import random
+import socket
+import threading
+import time
+from typing import Dict, List
+
+import httpx
+import uvicorn
+
+from .corpus import generate_pdfs, synthetic_chunks, synthetic_paragraph
+from .fakes import FakeEncoder, FakeStreamingLLM
+from .report import percentiles
+
+CHAT_MESSAGES = [
+    "Summarize the uploaded document",
+    "What projects are listed in my resume?",
+    "What is the latest news on vector databases?",
+    "calculate 12 * (3 + 4)",
+    "Tell me a fun fact about caching",
+    "Which skills mention python and sqlite?",
+]
+
+
+# ---------------------------------------------------------
+# App wiring
+# ---------------------------------------------------------
+def prepare_app(work_dir: str, llm=None, encoder=None, search_delay_s: float = 0.05):
+    """
+    Point app.main at fakes and a scratch data directory, and mark it ready.
+    Returns the app.main module.
+    """
+    from app import memory_graph, search_tool
+    memory_graph.DB_PATH = os.path.join(work_dir, "memory.db")
+
+    from app import main
+    from app.rag_utils import RAGIndex
+    from app.ingest_jobs import IngestQueue
+
+    main.TMP_DIR = os.path.join(work_dir, "uploads")
+    os.makedirs(main.TMP_DIR, exist_ok=True)
+    main.llm = llm or FakeStreamingLLM()
+    main.rag = RAGIndex(persist_dir=os.path.join(work_dir, "chroma"), model=encoder or FakeEncoder())
+    main.ingest_queue = IngestQueue(main.rag)
+    main._ready.set()
+    search_tool.set_backend(search_tool.FakeSearchBackend(delay=search_delay_s))
+    return main
+
+
+class LocalServer:
+    """Run an ASGI app under uvicorn on a free loopback port in a background thread."""
+
+    def __init__(self, app):
+        with socket.socket() as s:
+            s.bind(("127.0.0.1", 0))
+            self.port = s.getsockname()[1]
+        config = uvicorn.Config(app, host="127.0.0.1", port=self.port, lifespan="off", log_level="warning")
+        self.server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self):
+        self._thread.start()
+        while not self.server.started:
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self.server.should_exit = True
+        self._thread.join(timeout=10)
+
+
+# ---------------------------------------------------------
+# /api/chat
+# ---------------------------------------------------------
+async def _chat_clients(base_url: str, clients: int, requests_per_client: int) -> Dict:
+    ttfts: List[float] = []
+    totals: List[float] = []
+    errors = 0
+
+    async def client_loop(cid: int, client: httpx.AsyncClient):
+        nonlocal errors
+        rng = random.Random(cid)
+        thread_id = f"bench-{cid}"
+        for _ in range(requests_per_client):
+            msg = rng.choice(CHAT_MESSAGES)
+            t0 = time.perf_counter()
+            first = None
+            try:
+                async with client.stream("POST", "/api/chat", json={"message": msg, "thread_id": thread_id}) as r:
+                    async for chunk in r.aiter_raw():
+                        if first is None and chunk:
+                            first = time.perf_counter() - t0
+                    if r.status_code != 200:
+                        errors += 1
+                        continue
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            totals.append(time.perf_counter() - t0)
+            ttfts.append(first if first is not None else totals[-1])
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(client_loop(i, client) for i in range(clients)))
+        wall = time.perf_counter() - t0
+
+    return {
+        "clients": clients,
+        "requests": len(totals),
+        "errors": errors,
+        "requests_per_s": round(len(totals) / wall, 2) if wall else 0.0,
+        "ttft": percentiles(ttfts),
+        "total": percentiles(totals),
+    }
+
+
+def chat_scenario(work_dir: str, clients: int = 8, requests_per_client: int = 5,
+                  tokens_per_s: float = 200.0, ttft_s: float = 0.15, docs: int = 2) -> Dict:
+    main = prepare_app(work_dir, llm=FakeStreamingLLM(tokens_per_s=tokens_per_s, ttft_s=ttft_s))
+    for path in generate_pdfs(os.path.join(work_dir, "corpus"), n_docs=docs, pages_per_doc=10):
+        main.rag.load_pdf(path)
+    with LocalServer(main.app) as server:
+        return asyncio.run(_chat_clients(server.url, clients, requests_per_client))
+
+
+# ---------------------------------------------------------
+# /api/upload
+# ---------------------------------------------------------
+def upload_scenario(work_dir: str, docs: int = 4, pages_per_doc: int = 25, poll_s: float = 0.05) -> Dict:
+    main = prepare_app(work_dir)
+    paths = generate_pdfs(os.path.join(work_dir, "uploads_src"), n_docs=docs, pages_per_doc=pages_per_doc, seed=1)
+    with LocalServer(main.app) as server, httpx.Client(base_url=server.url, timeout=120) as client:
+        t0 = time.perf_counter()
+        accept = []
+        job_ids = []
+        for path in paths:
+            t_req = time.perf_counter()
+            with open(path, "rb") as f:
+                r = client.post("/api/upload", files={"file": (os.path.basename(path), f, "application/pdf")})
+            accept.append(time.perf_counter() - t_req)
+            r.raise_for_status()
+            job_ids.append(r.json()["job_id"])
+
+        jobs = {}
+        while len(jobs) < len(job_ids):
+            for jid in job_ids:
+                if jid in jobs:
+                    continue
+                job = client.get(f"/api/ingest/{jid}").json()
+                if job["status"] in ("done", "error"):
+                    jobs[jid] = job
+            time.sleep(poll_s)
+        wall = time.perf_counter() - t0
+
+    pages = sum(j["pages_done"] for j in jobs.values())
+    chunks = sum(j["chunks_done"] for j in jobs.values())
+    return {
+        "docs": docs,
+        "pages": pages,
+        "chunks": chunks,
+        "errors": sum(1 for j in jobs.values() if j["status"] == "error"),
+        "wall_s": round(wall, 3),
+        "pages_per_s": round(pages / wall, 2) if wall else 0.0,
+        "chunks_per_s": round(chunks / wall, 2) if wall else 0.0,
+        "accept": percentiles(accept),
+    }
+
+
+# ---------------------------------------------------------
+# Retrieval vs. corpus size
+# ---------------------------------------------------------
+def retrieval_scenario(work_dir: str, sizes=(1000, 5000, 20000), queries: int = 200, vector_store: str = "chroma") -> Dict:
+    from app.rag_utils import RAGIndex, chunk_id, normalize_query
+
+    out = {}
+    for size in sizes:
+        rag = RAGIndex(persist_dir=os.path.join(work_dir, f"{vector_store}_{size}"), model=FakeEncoder(),
+                       vector_store=vector_store)
+        texts = synthetic_chunks(size, seed=size)
+        t0 = time.perf_counter()
+        for i in range(0, size, 512):
+            batch = texts[i:i + 512]
+            rag._add_batch([chunk_id(f"{i + j}:{t}") for j, t in enumerate(batch)], batch)
+        rag._bump_version()
+        build = time.perf_counter() - t0
+
+        qs = [" ".join(t.split()[:6]) + f" q{n}" for n, t in enumerate(synthetic_chunks(queries, seed=size + 1))]
+        cold, warm = [], []
+        for q in qs:
+            t = time.perf_counter()
+            rag.query(q, top_k=5)
+            cold.append(time.perf_counter() - t)
+        for q in qs:
+            t = time.perf_counter()
+            rag.query(q, top_k=5)
+            warm.append(time.perf_counter() - t)
+        dense = []
+        for q in qs:
+            t = time.perf_counter()
+            rag._dense_query(q, normalize_query(q), 20)
+            dense.append(time.perf_counter() - t)
+        lexical = []
+        for q in qs:
+            t = time.perf_counter()
+            rag.lexical.search(q, top_k=20)
+            lexical.append(time.perf_counter() - t)
+
+        out[str(size)] = {
+            "chunks": rag.count(),
+            "build_s": round(build, 3),
+            "query_cold": percentiles(cold),
+            "query_cached": percentiles(warm),
+            "dense": percentiles(dense),
+            "lexical": percentiles(lexical),
+        }
+    return out
+
+
+# ---------------------------------------------------------
+# SQLite history
+# ---------------------------------------------------------
+def sqlite_scenario(work_dir: str, turns: int = 5000, threads: int = 200, writers: int = 4) -> Dict:
+    from app import memory_graph
+    memory_graph.DB_PATH = os.path.join(work_dir, "memory_bench.db")
+
+    t0 = time.perf_counter()
+    for i in range(turns):
+        memory_graph.save_turn(f"t{i % threads}", f"question {i}", f"answer {i}")
+    memory_graph.flush_writes()  # count write-behind commits, not just enqueues
+    save_s = time.perf_counter() - t0
+
+    def writer(w: int):
+        for i in range(turns // writers):
+            memory_graph.save_turn(f"w{w}-{i % 10}", f"q {i}", f"a {i}")
+
+    t0 = time.perf_counter()
+    pool = [threading.Thread(target=writer, args=(w,)) for w in range(writers)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    memory_graph.flush_writes()
+    concurrent_s = time.perf_counter() - t0
+
+    reads = 2000
+    t0 = time.perf_counter()
+    for i in range(reads):
+        memory_graph.load_history_rows(f"t{i % threads}", limit=50)
+    history_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    for _ in range(reads):
+        memory_graph.get_recent_threads()
+    threads_s = time.perf_counter() - t0
+
+    return {
+        "rows": turns * 4,
+        "write_behind": memory_graph.write_stats(),
+        "save_turn_per_s": round(turns / save_s, 1),
+        "save_turn_concurrent_per_s": round((turns // writers * writers) / concurrent_s, 1),
+        "load_history_page_per_s": round(reads / history_s, 1),
+        "recent_threads_per_s": round(reads / threads_s, 1),
+    }
+
+
+# ---------------------------------------------------------
+# Tool routing
+# ---------------------------------------------------------
+# (message, tools a good planner would pick) with documents loaded
+ROUTING_EVAL = [
+    ("Summarize the uploaded document", {"rag"}),
+    ("What projects are listed in my resume?", {"rag", "memory"}),
+    ("Which skills mention python and sqlite?", {"rag"}),
+    ("What does the report say about the quarterly budget?", {"rag"}),
+    ("Find the section on kubernetes deployment", {"rag"}),
+    ("What is the latest news on vector databases?", {"search"}),
+    ("Search the web for the current price of gold", {"search"}),
+    ("Who won the football game last night?", {"search"}),
+    ("calculate 12 * (3 + 4)", {"math"}),
+    ("what is 45 / 9 - 1", {"math"}),
+    ("What is my name?", {"memory"}),
+    ("Do you remember who my teacher is?", {"memory"}),
+    ("Tell me a fun fact about caching", set()),
+    ("hello, how are you today", set()),
+    ("Write a short poem about the sea", set()),
+    ("What is recursion?", set()),
+    ("thanks, that was helpful", set()),
+    ("Explain the trade-off between latency and throughput", set()),
+]
+
+
+def routing_scenario(work_dir: str, docs: int = 2, repeats: int = 20) -> Dict:
+    """Keyword planner vs. embedding router on ROUTING_EVAL: tools per turn,
+    per-tool precision/recall and planning latency."""
+    from app import agent_hub, router as router_mod
+    from app.rag_utils import RAGIndex
+
+    rag = RAGIndex(persist_dir=os.path.join(work_dir, "chroma"), model=FakeEncoder())
+    for path in generate_pdfs(os.path.join(work_dir, "corpus"), n_docs=docs, pages_per_doc=10):
+        rag.load_pdf(path)
+
+    out = {}
+    saved_mode = agent_hub.ROUTER_MODE
+    try:
+        for mode in ("keyword", "embedding"):
+            agent_hub.ROUTER_MODE = mode
+            picked, times = [], []
+            for _ in range(repeats):
+                for msg, _ in ROUTING_EVAL:
+                    t = time.perf_counter()
+                    tools = agent_hub._plan(msg, rag)
+                    times.append(time.perf_counter() - t)
+                    picked.append({k[len("use_"):] for k, v in tools.items() if v})
+
+            expected = [want for _ in range(repeats) for _, want in ROUTING_EVAL]
+            per_tool = {}
+            for tool in ("rag", "search", "memory", "math"):
+                tp = sum(1 for p, e in zip(picked, expected) if tool in p and tool in e)
+                fp = sum(1 for p, e in zip(picked, expected) if tool in p and tool not in e)
+                fn = sum(1 for p, e in zip(picked, expected) if tool not in p and tool in e)
+                per_tool[tool] = {
+                    "precision": round(tp / (tp + fp), 3) if tp + fp else 1.0,
+                    "recall": round(tp / (tp + fn), 3) if tp + fn else 1.0,
+                }
+            out[mode] = {
+                "tools_per_turn": round(sum(len(p) for p in picked) / len(picked), 3),
+                "rag_rate": round(sum("rag" in p for p in picked) / len(picked), 3),
+                "search_rate": round(sum("search" in p for p in picked) / len(picked), 3),
+                "exact_match": round(sum(p == e for p, e in zip(picked, expected)) / len(picked), 3),
+                "tools": per_tool,
+                "plan": percentiles(times),
+            }
+    finally:
+        agent_hub.ROUTER_MODE = saved_mode
+    out["thresholds"] = {
+        "rag_min_sim": router_mod.RAG_MIN_SIM,
+        "docs_intent_min": router_mod.DOCS_INTENT_MIN,
+        "search_intent_min": router_mod.SEARCH_INTENT_MIN,
+        "memory_intent_min": router_mod.MEMORY_INTENT_MIN,
+    }
+    return out
+
+
+# ---------------------------------------------------------
+# Bursty popular questions (single-flight + answer cache)
+# ---------------------------------------------------------
+BURST_QUESTIONS = [
+    ("Summarize the uploaded policy", "summarize the uploaded policy?", "The uploaded policy: summarize"),
+    ("What projects are listed in the document?", "what projects are listed in the document",
+     "Which projects are listed in the document?"),
+    ("What is the latest news on vector databases?", "latest news on vector databases?",
+     "What's the latest news on vector databases"),
+    ("Explain hybrid search in simple terms", "explain hybrid search in simple terms!",
+     "Hybrid search explained in simple terms"),
+]
+
+
+async def _burst_clients(base_url: str, clients: int, waves: int, gap_s: float, seed: int, tag: str) -> Dict:
+    rng = random.Random(seed)
+    ttfts: List[float] = []
+    totals: List[float] = []
+    errors = 0
+
+    async def one(client: httpx.AsyncClient, thread_id: str, msg: str):
+        nonlocal errors
+        await asyncio.sleep(rng.uniform(0, gap_s / 2))  # arrivals spread within the wave
+        t0 = time.perf_counter()
+        first = None
+        try:
+            async with client.stream("POST", "/api/chat", json={"message": msg, "thread_id": thread_id}) as r:
+                async for chunk in r.aiter_raw():
+                    if first is None and chunk:
+                        first = time.perf_counter() - t0
+                if r.status_code != 200:
+                    errors += 1
+                    return
+        except httpx.HTTPError:
+            errors += 1
+            return
+        totals.append(time.perf_counter() - t0)
+        ttfts.append(first if first is not None else totals[-1])
+
+    limits = httpx.Limits(max_connections=clients, max_keepalive_connections=clients)
+    async with httpx.AsyncClient(base_url=base_url, timeout=120, limits=limits) as client:
+        t0 = time.perf_counter()
+        for w in range(waves):
+            # Fresh threads: first turns are what the shared layers may serve
+            batch = [one(client, f"burst-{tag}-{w}-{i}", rng.choice(rng.choice(BURST_QUESTIONS)))
+                     for i in range(clients)]
+            await asyncio.gather(*batch)
+            await asyncio.sleep(gap_s)
+        wall = time.perf_counter() - t0
+
+    return {
+        "requests": len(totals),
+        "errors": errors,
+        "requests_per_s": round(len(totals) / wall, 2) if wall else 0.0,
+        "ttft": percentiles(ttfts),
+        "total": percentiles(totals),
+    }
+
+
+def burst_scenario(work_dir: str, clients: int = 16, waves: int = 5, gap_s: float = 0.2,
+                   tokens_per_s: float = 200.0, ttft_s: float = 0.15, docs: int = 2) -> Dict:
+    """Waves of concurrent first-turn requests for a few popular questions,
+    with single-flight and the answer cache off, then on."""
+    from app import answer_cache
+
+    llm = FakeStreamingLLM(tokens_per_s=tokens_per_s, ttft_s=ttft_s)
+    main = prepare_app(work_dir, llm=llm)
+    for path in generate_pdfs(os.path.join(work_dir, "corpus"), n_docs=docs, pages_per_doc=10):
+        main.rag.load_pdf(path)
+
+    out = {}
+    saved = answer_cache.ANSWER_CACHE, answer_cache.SINGLE_FLIGHT
+    try:
+        with LocalServer(main.app) as server:
+            for mode, enabled in (("off", False), ("on", True)):
+                answer_cache.ANSWER_CACHE = answer_cache.SINGLE_FLIGHT = enabled
+                answer_cache.cache.clear()
+                calls = llm.calls
+                res = asyncio.run(_burst_clients(server.url, clients, waves, gap_s, seed=7, tag=mode))
+                res["llm_calls"] = llm.calls - calls
+                out[mode] = res
+    finally:
+        answer_cache.ANSWER_CACHE, answer_cache.SINGLE_FLIGHT = saved
+    out["answers"] = answer_cache.stats()
+    return out
+
+
+# ---------------------------------------------------------
+# /api/chat/batch vs. serial /api/chat
+# ---------------------------------------------------------
+def _eval_questions(n: int, seed: int = 3) -> List[str]:
+    rng = random.Random(seed)
+    forms = ("What does the document say about {}?", "Summarize the section on {}", "Explain {} in the uploaded file",
+             "Which pages mention {}?")
+    return [rng.choice(forms).format(synthetic_paragraph(rng, words=3)) for _ in range(n)]
+
+
+async def _serial_chat(base_url: str, questions: List[str]) -> float:
+    async with httpx.AsyncClient(base_url=base_url, timeout=120) as client:
+        t0 = time.perf_counter()
+        for i, q in enumerate(questions):
+            # Fresh thread and no answer reuse: every question is a full turn
+            r = await client.post("/api/chat", json={"message": q, "thread_id": f"eval-{i}", "cache": False})
+            r.raise_for_status()
+        return time.perf_counter() - t0
+
+
+async def _batch_chat(base_url: str, questions: List[str], concurrency: int) -> Dict:
+    firsts, lines = [], 0
+    async with httpx.AsyncClient(base_url=base_url, timeout=None) as client:
+        t0 = time.perf_counter()
+        async with client.stream("POST", "/api/chat/batch",
+                                 json={"questions": questions, "concurrency": concurrency}) as r:
+            r.raise_for_status()
+            async for line in r.aiter_lines():
+                if line:
+                    lines += 1
+                    if not firsts:
+                        firsts.append(time.perf_counter() - t0)
+        wall = time.perf_counter() - t0
+    return {"wall_s": wall, "answers": lines, "first_answer_s": firsts[0] if firsts else wall}
+
+
+def batch_scenario(work_dir: str, questions: int = 40, concurrency: int = 8,
+                   tokens_per_s: float = 200.0, ttft_s: float = 0.15, docs: int = 2) -> Dict:
+    """Evaluation-style workload: the same questions sent one by one to
+    /api/chat, then in one /api/chat/batch call."""
+    encoder = FakeEncoder()
+    llm = FakeStreamingLLM(tokens_per_s=tokens_per_s, ttft_s=ttft_s)
+    main = prepare_app(work_dir, llm=llm, encoder=encoder)
+    for path in generate_pdfs(os.path.join(work_dir, "corpus"), n_docs=docs, pages_per_doc=10):
+        main.rag.load_pdf(path)
+    qs = _eval_questions(questions)
+
+    out = {}
+    with LocalServer(main.app) as server:
+        main.rag._embed_cache.clear()
+        main.rag._result_cache.clear()
+        calls = encoder.calls
+        serial = asyncio.run(_serial_chat(server.url, qs))
+        out["serial"] = {"wall_s": round(serial, 3), "questions_per_s": round(len(qs) / serial, 2),
+                         "encode_calls": encoder.calls - calls}
+
+        main.rag._embed_cache.clear()
+        main.rag._result_cache.clear()
+        main.rag._relevance_cache.clear()
+        calls = encoder.calls
+        res = asyncio.run(_batch_chat(server.url, qs, concurrency))
+        out["batch"] = {"wall_s": round(res["wall_s"], 3), "questions_per_s": round(len(qs) / res["wall_s"], 2),
+                        "first_answer_s": round(res["first_answer_s"], 3), "answers": res["answers"],
+                        "encode_calls": encoder.calls - calls, "concurrency": concurrency}
+    out["speedup"] = round(out["serial"]["wall_s"] / out["batch"]["wall_s"], 2)
+    return out
@@ -14,10 +14,25 @@ document.addEventListener('DOMContentLoaded', () => {
     }
 
     // --- History Loading ---
+    // Load the newest page first, then older pages as the user scrolls up
+    const HISTORY_PAGE = 50;
+    let oldestId = null;
+    let historyExhausted = false;
+    let historyLoading = false;
+
+    async function fetchHistoryPage(before) {
+        const params = new URLSearchParams({ thread_id: threadId, limit: HISTORY_PAGE });
+        if (before !== null) params.set('before', before);
+        const res = await fetch(`/api/history?${params}`);
+        const data = await res.json();
+        if (data.length < HISTORY_PAGE) historyExhausted = true;
+        if (data.length) oldestId = data[0].id;
+        return data;
+    }
+
     async function loadHistory() {
         try {
-            const res = await fetch(`/api/history?thread_id=${threadId}`);
-            const data = await res.json();
+            const data = await fetchHistoryPage(null);
             data.forEach(msg => {
                 appendMessage(msg.role, msg.content, false);
             });
@@ -27,6 +42,29 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     }
 
+    async function loadOlderHistory() {
+        if (historyExhausted || historyLoading || oldestId === null) return;
+        historyLoading = true;
+        try {
+            const data = await fetchHistoryPage(oldestId);
+            const prevHeight = chatContainer.scrollHeight;
+            const anchor = chatContainer.firstChild;
+            data.forEach(msg => {
+                chatContainer.insertBefore(renderMessage(msg.role, msg.content), anchor);
+            });
+            // Keep the viewport on the message the user was reading
+            chatContainer.scrollTop += chatContainer.scrollHeight - prevHeight;
+        } catch (e) {
+            console.error("Failed to load older history", e);
+        } finally {
+            historyLoading = false;
+        }
+    }
+
+    chatContainer.addEventListener('scroll', () => {
+        if (chatContainer.scrollTop < 100) loadOlderHistory();
+    });
+
     // --- Memory Loading ---
     async function loadMemory() {
         try {
@@ -45,6 +83,13 @@ document.addEventListener('DOMContentLoaded', () => {
 
     // --- Chat Logic ---
     function appendMessage(role, text, animate = true) {
+        const div = renderMessage(role, text);
+        chatContainer.appendChild(div);
+        scrollToBottom();
+        return div;
+    }
+
+    function renderMessage(role, text) {
         const div = document.createElement('div');
         div.className = `message ${role}`;
         
@@ -62,8 +107,6 @@ document.addEventListener('DOMContentLoaded', () => {
             <div class="avatar"><i class="fas ${role === 'user' ? 'fa-user' : 'fa-robot'}"></i></div>
             <div class="content">${contentHtml}</div>
         `;
-        chatContainer.appendChild(div);
-        scrollToBottom();
         return div;
     }
 
@@ -157,16 +200,33 @@ document.addEventListener('DOMContentLoaded', () => {
                 body: formData
             });
             const data = await res.json();
-            if (res.ok) {
-                statusDiv.innerHTML = `<i class="fas fa-check" style="color:#10a37f"></i> ${data.message}`;
-            } else {
+            if (!res.ok) {
                 throw new Error(data.detail || 'Upload failed');
             }
+            await pollIngest(data.job_id, statusDiv);
         } catch (e) {
             statusDiv.innerHTML = `<i class="fas fa-times" style="color:red"></i> ${e.message}`;
         }
     }
 
+    // Indexing runs in the background; poll its progress until it finishes
+    async function pollIngest(jobId, statusDiv) {
+        while (true) {
+            const res = await fetch(`/api/ingest/${jobId}`);
+            const job = await res.json();
+            if (!res.ok) throw new Error(job.detail || 'Indexing status unavailable');
+
+            if (job.status === 'done') {
+                statusDiv.innerHTML = `<i class="fas fa-check" style="color:#10a37f"></i> Indexed ${job.chunks_done} chunks from ${job.pages_done} pages`;
+                return;
+            }
+            if (job.status === 'error') throw new Error(job.error || 'Indexing failed');
+
+            statusDiv.innerHTML = `<i class="fas fa-spinner fa-spin"></i> Indexing... ${job.pages_done} pages, ${job.chunks_done} chunks`;
+            await new Promise(r => setTimeout(r, 1000));
+        }
+    }
+
     // Drag and Drop
     dropZone.addEventListener('dragover', (e) => {
         e.preventDefault();